@@ -0,0 +1,109 @@
+import html
+import json
+
+RESOURCE_URL = '{base}/mod/resource/view.php?id={id}'
+FOLDER_URL = '{base}/mod/folder/view.php?id={id}'
+
+_ACTIVITY = '''
+<li class="activity {kind} modtype_{kind}" id="module-{id}">
+  <div><div class="mod-indent-outer w-100"><div class="mod-indent"></div>
+    <div class="activityinstance">
+      <a class="aalink" onclick="" href="{url}">
+        <img src="{base}/theme/image.php/boost/{kind}/1/icon" class="iconlarge activityicon" alt="" role="presentation">
+        <span class="instancename">{name}<span class="accesshide "> {label}</span></span>
+      </a>
+    </div>
+    <div class="contentafterlink"><div class="no-overflow">{description}</div></div>
+  </div></div>
+</li>'''
+
+_SECTION = '''
+<li id="section-{n}" class="section main clearfix" role="region" aria-labelledby="sectionid-{n}-title">
+  <span class="hidden sectionname">{title}</span>
+  <div class="left side"></div><div class="right side"></div>
+  <div class="content">
+    <h3 id="sectionid-{n}-title" class="sectionname"><a href="{base}/course/view.php?id={cid}#section-{n}">{title}</a></h3>
+    <div class="section_availability"></div><div class="summary"><div class="no-overflow"><p>{summary}</p></div></div>
+    <ul class="section img-text">{activities}</ul>
+  </div>
+</li>'''
+
+
+def moodle_course_page(base, cid, sections: dict[str, list[tuple[str, str, int]]]):
+    # sections: title -> [(kind, name, module id)], kind being 'resource' or 'folder'
+    body = []
+    for n, (title, activities) in enumerate(sections.items(), start=1):
+        items = []
+        for kind, name, mid in activities:
+            url = (RESOURCE_URL if kind == 'resource' else FOLDER_URL).format(base=base, id=mid)
+            label = '文件' if kind == 'resource' else '文件夹'
+            items.append(_ACTIVITY.format(kind=kind, id=mid, url=url, base=base, name=html.escape(name),
+                                          label=label, description='<p>' + 'Lorem ipsum dolor sit amet. ' * 4 + '</p>'))
+        body.append(_SECTION.format(n=n, cid=cid, base=base, title=html.escape(title),
+                                    summary='Course materials of the week. ' * 3, activities=''.join(items)))
+    return _wrap(f'Course {cid}', f'<ul class="topics">{"".join(body)}</ul>')
+
+
+def moodle_folder_page(base, fid, files: list[str]):
+    items = ''.join(f'<li><span class="fp-filename-icon"><a href="{base}/pluginfile.php/{fid}/mod_folder/content/0/'
+                    f'{html.escape(name)}?forcedownload=1"><span class="fp-icon"><img src="{base}/pix/f/pdf.png">'
+                    f'</span><span class="fp-filename">{html.escape(name)}</span></a></span></li>' for name in files)
+    return _wrap(f'Folder {fid}', f'<div class="foldertree"><ul>{items}</ul></div>')
+
+
+def moodle_video_page(base, mid, src, name):
+    return _wrap(f'Video {mid}', f'<div class="resourcecontent resourcevideo"><video controls>'
+                                 f'<source src="{src}" type="video/mp4">{html.escape(name)}</video></div>')
+
+
+def moodle_dashboard_page(base, courses: list[tuple[int, str]]):
+    cards = ''.join(f'<div class="card dashboard-card" data-course-id="{cid}"><a href="{base}/course/view.php?id={cid}">'
+                    f'<div class="card-img dashboard-card-img"></div></a><div class="card-body"><div class="media">'
+                    f'<span class="media-body">{html.escape(name)}</span></div></div></div>' for cid, name in courses)
+    return _wrap('Dashboard', f'<div class="card-deck dashboard-card-deck">{cards}</div>')
+
+
+def moodle_course_contents(base, sections: dict[str, list[tuple[str, str, int, list[tuple[str, int]]]]]):
+    # Response of core_course_get_contents in the shape Moodle records it.
+    # sections: title -> [(kind, name, module id, [(file path, size)])]
+    result = []
+    for n, (title, activities) in enumerate(sections.items(), start=1):
+        modules = []
+        for kind, name, mid, files in activities:
+            url = (RESOURCE_URL if kind == 'resource' else FOLDER_URL).format(base=base, id=mid)
+            contents = [{'type': 'file', 'filename': path.rsplit('/', 1)[-1], 'filepath': '/', 'filesize': size,
+                         'fileurl': f'{base}/webservice{path}?forcedownload=1', 'timecreated': 1663200000,
+                         'timemodified': 1663200000 + mid, 'sortorder': 0, 'mimetype': 'application/pdf',
+                         'isexternalfile': False, 'userid': 2, 'author': 'Teacher', 'license': 'allrightsreserved'}
+                        for path, size in files]
+            modules.append({'id': mid, 'url': url, 'name': name, 'instance': mid, 'contextid': mid + 100,
+                            'visible': 1, 'uservisible': True, 'visibleoncoursepage': 1,
+                            'modicon': f'{base}/theme/image.php/boost/{kind}/1/icon', 'modname': kind,
+                            'modplural': 'Files' if kind == 'resource' else 'Folders', 'indent': 0,
+                            'onclick': '', 'afterlink': None, 'customdata': '""', 'noviewlink': False,
+                            'completion': 0, 'dates': [], 'contents': contents,
+                            'contentsinfo': {'filescount': len(contents),
+                                             'filessize': sum(size for _, size in files),
+                                             'lastmodified': 1663200000 + mid, 'mimetypes': ['application/pdf'],
+                                             'repositorytype': ''}})
+        result.append({'id': n, 'name': title, 'visible': 1, 'summary': '<p>Course materials of the week.</p>',
+                       'summaryformat': 1, 'section': n, 'hiddenbynumsections': 0, 'uservisible': True,
+                       'modules': modules})
+    return json.dumps(result, ensure_ascii=False)
+
+
+def generic_index_page(base, files: list[str]):
+    rows = ''.join(f'<tr><td>Lecture {i}</td><td><a href="{base}/files/{html.escape(name)}" title="{html.escape(name)}">'
+                   f'Slides {i}</a></td><td><a href="{base}/notes/{i}.html">Notes</a></td></tr>'
+                   for i, name in enumerate(files, start=1))
+    return _wrap('Course index', f'<table><thead><tr><th>#</th><th>Slides</th><th>Notes</th></tr></thead>'
+                                 f'<tbody>{rows}</tbody></table>')
+
+
+def _wrap(title, content):
+    scripts = '<script>var M = {}; M.yui = {}; M.cfg = {"wwwroot": "", "sesskey": "x"};</script>' * 10
+    nav = ''.join(f'<li class="nav-item"><a class="nav-link" href="/my/courses.php?p={i}">Item {i}</a></li>'
+                  for i in range(40))
+    return (f'<!DOCTYPE html><html dir="ltr" lang="zh-cn"><head><title>{html.escape(title)}</title>'
+            f'<meta charset="UTF-8">{scripts}</head><body><nav><ul>{nav}</ul></nav>'
+            f'<div id="page"><div id="region-main">{content}</div></div></body></html>')
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http import server as _server
+
+# Benchmarks import the crawler modules the same way the scripts do
+DOCCRAWLER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../doccrawler')
+if DOCCRAWLER_PATH not in sys.path:
+    sys.path.insert(0, DOCCRAWLER_PATH)
+
+import engine  # noqa: E402
+from const import PAGE_CACHE_ENTRIES, PAGE_CACHE_BYTES, PAGE_CACHE_FRESH  # noqa: E402
+from pagecache import PageCache  # noqa: E402
+
+
+def fresh_manifest(tmp_dir=None):
+    # Keep benchmark runs out of the real manifest, page cache and failed tasks, and independent of each other.
+    # Several processes share their state through the same tmp_dir.
+    engine.manifest.close()
+    tmp_dir = tmp_dir or tempfile.mkdtemp(prefix='doccrawler-bench-')
+    engine.manifest.path = os.path.join(tmp_dir, 'manifest.db')
+    engine.failed_tasks.path = os.path.join(tmp_dir, 'failed.jsonl')
+    engine.page_cache = PageCache(os.path.join(tmp_dir, 'pages'), PAGE_CACHE_ENTRIES, PAGE_CACHE_BYTES, PAGE_CACHE_FRESH)
+    return tmp_dir
+
+
+class _Handler(_server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle would hold back for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        with self.server.stats_lock:
+            self.server.requests += 1
+            self.server.active += 1
+            overloaded = self.server.capacity and self.server.active > self.server.capacity
+            if overloaded:
+                self.server.rejected += 1
+            fault = self.server.random.random() if self.path.startswith(self.server.fault_paths) else 1.0
+        try:
+            if self.path in self.server.redirects:
+                self.send_response(303)
+                self.send_header('Location', self.server.redirects[self.path])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if overloaded:
+                # Like a throttling reverse proxy in front of a small server
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if fault < self.server.error_rate:
+                self.send_error(503)
+                return
+            self.__serve(head, fault < self.server.error_rate + self.server.truncate_rate)
+        finally:
+            with self.server.stats_lock:
+                self.server.active -= 1
+
+    def __serve(self, head, truncate=False):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self.server.files.get(self.path) or self.server.files.get(self.path.split('?')[0])
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.server.validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        status, start, end = 200, 0, len(body)
+        ranged = self.headers.get('Range', '').removeprefix('bytes=')
+        if ranged and self.headers.get('If-Range', etag) == etag:
+            first, last = ranged.split('-')
+            start, end = int(first), int(last) + 1 if last else len(body)
+            if start >= len(body):
+                self.send_error(416)
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(body)}')
+        if self.server.validators:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if head:
+            return
+        view = memoryview(body)[start:end]
+        if truncate:
+            # The connection drops halfway through the body
+            self.wfile.write(view[:len(view) // 2])
+            self.close_connection = True
+            return
+        if not self.server.rate:
+            self.wfile.write(view)
+            return
+        # Per-connection bandwidth cap, in bytes per second
+        step = max(self.server.rate // 100, 1)
+        for pos in range(0, len(view), step):
+            self.wfile.write(view[pos:pos + step])
+            time.sleep(step / self.server.rate)
+
+
+class StandInServer(_server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    request_queue_size = 1024
+
+    # Paths may carry a query, e.g. '/course/view.php?id=1', and are also looked up without it.
+    # capacity: requests served at once, the ones beyond get a 429 with Retry-After (0 for no limit)
+    # redirects: path -> location, answered with a 303
+    # error_rate, truncate_rate: fractions of the requests under fault_paths answered with a 503, or cut halfway
+    def __init__(self, files: dict[str, bytes], tls=False, validators=True, latency=0.0, rate=0, capacity=0,
+                 redirects=None, error_rate=0.0, truncate_rate=0.0, fault_paths=('/',), seed=0):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.files = files
+        self.validators = validators
+        self.latency = latency
+        self.rate = rate
+        self.capacity = capacity
+        self.redirects = {} if redirects is None else redirects
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.fault_paths = tuple(fault_paths)
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.active = 0
+        self.rejected = 0
+        self.scheme = 'http'
+        self.cert_path = None
+        if tls:
+            self.cert_path = _make_cert()
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(*self.cert_path)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f'{self.scheme}://127.0.0.1:{self.server_address[1]}'
+
+    def handle_error(self, request, client_address):
+        # Clients legitimately drop connections, e.g. after the first segment of a file
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.connections = 0
+            self.requests = 0
+            self.rejected = 0
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def _make_cert():
+    # Self-signed certificate, trusted by the client through REQUESTS_CA_BUNDLE
+    tmp_dir = tempfile.mkdtemp(prefix='doccrawler-bench-')
+    cert, key = os.path.join(tmp_dir, 'cert.pem'), os.path.join(tmp_dir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', key, '-out', cert], check=True, capture_output=True)
+    os.environ['REQUESTS_CA_BUNDLE'] = cert
+    return cert, key
@@ -0,0 +1,45 @@
+import argparse
+import os
+import tempfile
+import time
+
+from _server import StandInServer, fresh_manifest
+import engine
+from const import MAX_WORKERS
+
+
+def run(servers, files, use_async):
+    fresh_manifest()
+    engine.close_sessions()
+    engine.host_limits = type(engine.host_limits)(MAX_WORKERS, engine.host_limits.network_errors)
+    for server in servers:
+        server.reset_stats()
+    with tempfile.TemporaryDirectory() as out_dir:
+        # Interleaved, like presets of several sites feeding one scheduler
+        tasks = [engine.TaskInfo(out_dir, server.base_url + path, f'{i}-{path[7:]}', '', {}, True, False)
+                 for path in files for i, server in enumerate(servers)]
+        start = time.perf_counter()
+        success, failed = engine.parallel_process(tasks, use_async)
+        elapsed = time.perf_counter() - start
+    return success, failed, elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-n', '--files', type=int, default=1000)
+    arg_parser.add_argument('-s', '--size', type=int, default=16 * 1024)
+    arg_parser.add_argument('-A', '--async', action='store_true', dest='use_async')
+    args = arg_parser.parse_args()
+
+    files = {f'/files/{i}.pdf': os.urandom(args.size) for i in range(args.files)}
+    # A slow server that throttles beyond 6 requests at once, and a fast static one
+    with StandInServer(files, latency=0.02, capacity=6) as small, StandInServer(files, latency=0.02) as static:
+        success, failed, elapsed = run([small, static], files, args.use_async)
+        print(f'{success + failed} files in {elapsed:.2f} s ({(success + failed) / elapsed:.1f} files/s), '
+              f'{failed} failed')
+        print(f'throttled server: {small.requests} requests, {small.rejected} rejected with 429')
+        print(f'static server:    {static.requests} requests')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+import _pages
+from _server import StandInServer, fresh_manifest
+import engine
+
+SCENARIOS = ('general', 'moodle', 'queue')
+WS_TOKEN = 'bench'
+# Faults are only injected into file transfers, pages are always served
+FILE_PATHS = ('/files/', '/pluginfile.php/')
+
+
+# ---- Stand-in sites ---- #
+def static_site(base, args) -> (dict, dict):
+    names = [f'{i}.pdf' for i in range(args.files)]
+    files = {f'/files/{name}': os.urandom(args.size) for name in names}
+    files['/index.html'] = _pages.generic_index_page(base, names).encode()
+    return files, {}
+
+
+def moodle_site(base, args) -> (dict, dict):
+    # Dashboard, course homes with the slides and videos sections, folders, video pages and files.
+    # Resource pages redirect to their file, like Moodle does. The web services list the same files.
+    ws_path = '/webservice/rest/server.php?wstoken=' + WS_TOKEN + \
+        '&wsfunction=core_course_get_contents&moodlewsrestformat=json&courseid={}'
+    files, redirects = {}, {}
+    courses = [(cid, f'Course {cid}') for cid in range(1, args.courses + 1)]
+    files['/my/'] = _pages.moodle_dashboard_page(base, courses).encode()
+    mid = 1000
+    for cid, _ in courses:
+        slides, videos = [], []
+        ws_slides, ws_videos = [], []
+        for i in range(args.files):
+            mid += 1
+            path = f'/pluginfile.php/{mid}/mod_resource/content/1/slides-{cid}-{i}.pdf'
+            files[path] = os.urandom(args.size)
+            redirects[f'/mod/resource/view.php?id={mid}'] = base + path
+            slides.append(('resource', f'Slides {i}', mid))
+            ws_slides.append(('resource', f'Slides {i}', mid, [(path, args.size)]))
+        for i in range(args.folders):
+            mid += 1
+            names = [f'notes-{cid}-{i}-{j}.pdf' for j in range(args.folder_files)]
+            for name in names:
+                files[f'/pluginfile.php/{mid}/mod_folder/content/0/{name}'] = os.urandom(args.size)
+            files[f'/mod/folder/view.php?id={mid}'] = _pages.moodle_folder_page(base, mid, names).encode()
+            slides.append(('folder', f'Folder {i}', mid))
+            ws_slides.append(('folder', f'Folder {i}', mid,
+                              [(f'/pluginfile.php/{mid}/mod_folder/content/0/{name}', args.size) for name in names]))
+        for i in range(args.videos):
+            mid += 1
+            path = f'/pluginfile.php/{mid}/mod_resource/content/1/lecture-{cid}-{i}.mp4'
+            files[path] = os.urandom(args.size)
+            files[f'/mod/resource/view.php?id={mid}'] = \
+                _pages.moodle_video_page(base, mid, base + path, f'Lecture {i}').encode()
+            videos.append(('resource', f'Lecture {i}', mid))
+            ws_videos.append(('resource', f'Lecture {i}', mid, [(path, args.size)]))
+        files[f'/course/view.php?id={cid}'] = \
+            _pages.moodle_course_page(base, cid, {'课件': slides, '课堂视频': videos}).encode()
+        files[ws_path.format(cid)] = \
+            _pages.moodle_course_contents(base, {'课件': ws_slides, '课堂视频': ws_videos}).encode()
+    return files, redirects
+
+
+def serve(args, conn):
+    # Runs in its own process, so that the measurements only cover the crawler
+    server = StandInServer({}, latency=args.latency, rate=args.rate, error_rate=args.error_rate,
+                           truncate_rate=args.truncate_rate, fault_paths=FILE_PATHS)
+    files, redirects = (moodle_site if args.scenario == 'moodle' else static_site)(server.base_url, args)
+    server.files.update(files)
+    server.redirects.update(redirects)
+    with server:
+        conn.send(server.base_url)
+        conn.recv()
+
+
+# ---- Drivers ---- #
+def run_general(base, out_dir, args):
+    argv = ['-u', base + '/index.html', '-e', 'pdf', '-d', out_dir] + (['-A'] if args.use_async else []) + \
+        (['--plan'] if args.plan else [])
+    engine.CrawlTask(vars(engine.get_arg_parser().parse_args(argv))).run()
+
+
+def run_moodle(base, out_dir, args):
+    import moodle_crawler
+    moodle_crawler.MAIN_PAGE_URL = base + '/my/'
+    moodle_crawler.MOODLE_RESOURCE_PAT = base + '/mod/resource/.*'
+    moodle_crawler.MOODLE_FOLDER_PAT = base + '/mod/folder/.*'
+    moodle_crawler.DOWNLOAD_PATH = out_dir
+    # Cookies in the config skip the QR login
+    moodle_crawler.MOODLE_CONFIG_PATH = os.path.join(out_dir, 'moodle_config.yaml')
+    config = {'cookies': 'MoodleSession=bench', 'videos': True, 'async': args.use_async}
+    if args.ws:
+        config.update(backend='ws', token=WS_TOKEN)
+    if args.plan:
+        config['plan'] = True
+    with open(moodle_crawler.MOODLE_CONFIG_PATH, 'w') as fd:
+        yaml.safe_dump({'moodle': config}, fd)
+    sys.argv = ['moodle_crawler.py']
+    moodle_crawler.driver()
+    os.remove(moodle_crawler.MOODLE_CONFIG_PATH)
+
+
+def run_queue(base, out_dir, args):
+    tasks = [engine.TaskInfo(out_dir, f'{base}/files/{i}.pdf', None, '', {}, False, False) for i in range(args.files)]
+    engine.parallel_process(tasks, args.use_async, planner=engine.new_planner({'plan': args.plan}))
+
+
+def downloaded(out_dir) -> (int, int):
+    count = size = 0
+    for root, _, names in os.walk(out_dir):
+        for name in names:
+            if not name.endswith(('.part', '.yaml')):
+                count += 1
+                size += os.path.getsize(os.path.join(root, name))
+    return count, size
+
+
+def measure(args) -> dict:
+    context = multiprocessing.get_context('fork')
+    conn, child_conn = context.Pipe()
+    server = context.Process(target=serve, args=(args, child_conn), daemon=True)
+    server.start()
+    base = conn.recv()
+
+    state_dir = fresh_manifest()
+    out_dir = tempfile.mkdtemp(prefix='doccrawler-bench-')
+    driver = {'general': run_general, 'moodle': run_moodle, 'queue': run_queue}[args.scenario]
+    if args.headless:
+        # Measures the crawl without the rendering of the progress panel and the per-file lines
+        engine.headless.start()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        driver(base, out_dir, args)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    conn.send(None)
+    server.join()
+
+    count, size = downloaded(out_dir)
+    failed_path = os.path.join(state_dir, 'failed.jsonl')
+    failed = sum(1 for _ in open(failed_path)) if os.path.exists(failed_path) else 0
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = after.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {'scenario': args.scenario, 'engine': 'asyncio' if args.use_async else 'threads',
+            'headless': args.headless, 'ws': args.ws, 'plan': args.plan,
+            'files': count, 'failed': failed, 'bytes': size, 'seconds': elapsed,
+            'files_per_s': count / elapsed, 'mb_per_s': size / elapsed / 1024 / 1024,
+            'peak_rss_mb': peak_rss / 1024 / 1024,
+            'cpu_s': after.ru_utime - before.ru_utime + after.ru_stime - before.ru_stime}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('scenarios', nargs='*', help=f'Any of {", ".join(SCENARIOS)}, all by default')
+    arg_parser.add_argument('-n', '--files', type=int, default=200, help='Files per site, or per course')
+    arg_parser.add_argument('-s', '--size', type=int, default=64 * 1024)
+    arg_parser.add_argument('-c', '--courses', type=int, default=8)
+    arg_parser.add_argument('--folders', type=int, default=2, help='Folders per course')
+    arg_parser.add_argument('--folder-files', type=int, default=10)
+    arg_parser.add_argument('--videos', type=int, default=4, help='Videos per course')
+    arg_parser.add_argument('-l', '--latency', type=float, default=0.01, help='Server latency in seconds')
+    arg_parser.add_argument('-r', '--rate', type=int, default=0, help='Bandwidth per connection in bytes/s')
+    arg_parser.add_argument('-e', '--error-rate', type=float, default=0.0, help='Fraction of 503 responses')
+    arg_parser.add_argument('-t', '--truncate-rate', type=float, default=0.0, help='Fraction of cut bodies')
+    arg_parser.add_argument('-A', '--async', action='store_true', dest='use_async')
+    arg_parser.add_argument('-H', '--headless', action='store_true', help='Run the crawler in headless mode')
+    arg_parser.add_argument('--ws', action='store_true', help='Discover the Moodle files through the web services')
+    arg_parser.add_argument('--plan', action='store_true', help='Size the files first and mix large and small ones')
+    arg_parser.add_argument('-j', '--json', action='store_true', help='Print the results as JSON lines')
+    arg_parser.add_argument('--one', action='store_true', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            arg_parser.error(f'unknown scenario {scenario}')
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    if args.one:
+        args.scenario = args.scenarios[0]
+        print(json.dumps(measure(args)))
+        return
+
+    # Each scenario runs in a process of its own, so that the peak RSS is its own too
+    options = [arg for arg in sys.argv[1:] if arg not in SCENARIOS and arg not in ('-j', '--json')]
+    for scenario in args.scenarios:
+        output = subprocess.run([sys.executable, __file__, scenario, '--one'] + options,
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if args.json:
+            print(json.dumps(result))
+            continue
+        mode = result['engine'] + (', headless' if result['headless'] else '') + (', ws' if result['ws'] else '') + \
+            (', plan' if result['plan'] else '')
+        print(f'{result["scenario"]:>8} ({mode}): {result["files"]:5d} files, {result["failed"]} failed, '
+              f'{result["files_per_s"]:8.1f} files/s, {result["mb_per_s"]:7.2f} MB/s, '
+              f'peak RSS {result["peak_rss_mb"]:6.1f} MB, CPU {result["cpu_s"]:6.2f} s')
+
+
+if __name__ == '__main__':
+    main()
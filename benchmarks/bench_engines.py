@@ -0,0 +1,45 @@
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+from _server import StandInServer, fresh_manifest
+import async_engine
+import engine
+
+
+def run(server, files, use_async, per_host):
+    fresh_manifest()
+    engine.close_sessions()
+    with tempfile.TemporaryDirectory() as out_dir, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        queue = [engine.TaskInfo(out_dir, server.base_url + path, None, '', {}, True, False)
+                 for path in files]
+        start = time.perf_counter()
+        if use_async:
+            success, failed = async_engine.parallel_process(queue, per_host=per_host, max_concurrency=per_host)
+        else:
+            success, failed = engine.parallel_process(queue)
+        elapsed = time.perf_counter() - start
+    return elapsed, failed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-n', '--files', type=int, nargs='+', default=[100, 1000, 10000])
+    arg_parser.add_argument('-s', '--size', type=int, default=4096)
+    arg_parser.add_argument('-l', '--latency', type=float, default=0.02, help='Server latency in seconds')
+    arg_parser.add_argument('-p', '--per-host', type=int, default=256, help='Async per-host cap')
+    args = arg_parser.parse_args()
+
+    for n in args.files:
+        files = {f'/files/{i}.pdf': os.urandom(args.size) for i in range(n)}
+        with StandInServer(files, latency=args.latency) as server:
+            for label, use_async in (('thread pool', False), ('asyncio', True)):
+                elapsed, failed = run(server, files, use_async, args.per_host)
+                print(f'{n:6d} files, {label:>11}: {n / elapsed:8.1f} files/s ({failed} failed)')
+
+
+if __name__ == '__main__':
+    main()
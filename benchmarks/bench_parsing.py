@@ -0,0 +1,77 @@
+import argparse
+import re
+import time
+
+import bs4
+
+import _pages
+import _server  # noqa: F401, puts doccrawler on sys.path
+import links
+from const import MOODLE_RESOURCE_PAT, MOODLE_FOLDER_PAT, SLIDE_SEC_CHN, VIDEO_SEC_CHN
+
+BASE = 'https://selearning.nju.edu.cn'
+
+
+def moodle_soup(html, builder):
+    # What the Moodle driver collected from a course home with BeautifulSoup
+    soup = bs4.BeautifulSoup(html, builder)
+    sec_map = {section.h3.text.strip(): section
+               for section in soup.find_all(name='li', id=re.compile(r'section-[0-9]'))}
+    found = [tag['href'] for tag in sec_map[SLIDE_SEC_CHN].find_all(name='a', href=re.compile(MOODLE_RESOURCE_PAT))]
+    found += [tag['href'] for tag in sec_map[SLIDE_SEC_CHN].find_all(name='a', href=re.compile(MOODLE_FOLDER_PAT))]
+    found += [tag['href'] for tag in sec_map[VIDEO_SEC_CHN].find_all(name='a', href=re.compile(MOODLE_RESOURCE_PAT))]
+    return found
+
+
+def moodle_links(html):
+    page = links.extract(html)
+    found = [tag.url for tag in page.find_all('a', MOODLE_RESOURCE_PAT, section=SLIDE_SEC_CHN)]
+    found += [tag.url for tag in page.find_all('a', MOODLE_FOLDER_PAT, section=SLIDE_SEC_CHN)]
+    found += [tag.url for tag in page.find_all('a', MOODLE_RESOURCE_PAT, section=VIDEO_SEC_CHN)]
+    return found
+
+
+def generic_soup(html, builder):
+    soup = bs4.BeautifulSoup(html, builder)
+    return [tag['href'] for tag in soup.find_all(name='a', href=re.compile(r'.*\.pdf$'))]
+
+
+def generic_links(html):
+    return [tag.url for tag in links.extract(html).find_all('a', re.compile(r'.*\.pdf$'))]
+
+
+def measure(parse, html, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = parse(html)
+    return (time.perf_counter() - start) / rounds, result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-r', '--rounds', type=int, default=20)
+    args = arg_parser.parse_args()
+
+    sections = {f'Week {w}': [('resource', f'Reading {w}.{i}', w * 100 + i) for i in range(8)] for w in range(1, 13)}
+    sections[SLIDE_SEC_CHN] = [('resource', f'Lecture {i}', 2000 + i) for i in range(40)] + \
+                              [('folder', f'Lab {i} 文件夹', 3000 + i) for i in range(6)]
+    sections[VIDEO_SEC_CHN] = [('resource', f'Recording {i}', 4000 + i) for i in range(30)]
+    pages = {
+        'Moodle course': (_pages.moodle_course_page(BASE, 42, sections), moodle_soup, moodle_links),
+        'Generic index': (_pages.generic_index_page(BASE, [f'lecture-{i}.pdf' for i in range(300)]),
+                          generic_soup, generic_links),
+    }
+    for title, (html, soup_parse, links_parse) in pages.items():
+        print(f'{title} ({len(html) / 1024:.0f} KB):')
+        expected = None
+        for label, parse in (('html5lib', lambda h: soup_parse(h, 'html5lib')),
+                             ('html.parser', lambda h: soup_parse(h, 'html.parser')),
+                             ('links', links_parse)):
+            elapsed, result = measure(parse, html, args.rounds)
+            expected = expected or result
+            same = 'same links' if result == expected else 'DIFFERENT links'
+            print(f'  {label:>11}: {elapsed * 1000:8.2f} ms ({len(result)} links, {same})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+import tempfile
+import time
+
+from _server import StandInServer, fresh_manifest
+import congestion
+import engine
+
+
+def run(server, count):
+    fresh_manifest()
+    engine.SEGMENT_THRESHOLD = 0 if count > 1 else float('inf')
+    # Segments only take the free slots of the host, so its window starts with room for all of them
+    limits, engine.host_limits = engine.host_limits, congestion.HostLimits(count + 1, initial=count + 1)
+    engine.SEGMENT_COUNT = count
+    engine.close_sessions()
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            task = engine.TaskInfo(out_dir, server.base_url + '/video.mp4', None, '', {}, True, False)
+            start = time.perf_counter()
+            engine.download_doc(task)
+            return time.perf_counter() - start
+    finally:
+        engine.host_limits = limits
+        engine.close_sessions()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-s', '--size', type=int, default=64, help='File size in MB')
+    arg_parser.add_argument('-r', '--rate', type=int, default=8, help='Per-connection bandwidth in MB/s')
+    arg_parser.add_argument('-c', '--segments', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = arg_parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    with StandInServer({'/video.mp4': os.urandom(size)}, rate=args.rate * 1024 * 1024) as server:
+        for count in args.segments:
+            elapsed = run(server, count)
+            print(f'{count:3d} segment{"s" if count > 1 else " "}: {size / elapsed / 1024 / 1024:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import os
+import tempfile
+import time
+from concurrent import futures as _futures
+
+import requests
+
+from _server import StandInServer, fresh_manifest
+import engine
+from const import MAX_WORKERS
+
+
+def run(server, files, use_sessions):
+    server.reset_stats()
+    fresh_manifest()
+    engine.close_sessions()
+    get_session = engine.get_session
+    if not use_sessions:
+        # The module-level API behaves like the previous one-connection-per-request code
+        engine.get_session = lambda url, cookies=None: requests
+    try:
+        with tempfile.TemporaryDirectory() as out_dir, \
+                _futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            tasks = [engine.TaskInfo(out_dir, server.base_url + path, None, '', {}, True, False)
+                     for path in files]
+            start = time.perf_counter()
+            for future in [executor.submit(engine.download_doc, t) for t in tasks]:
+                future.result()
+            elapsed = time.perf_counter() - start
+    finally:
+        engine.get_session = get_session
+    return elapsed, server.connections
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-n', '--files', type=int, default=2000)
+    arg_parser.add_argument('-s', '--size', type=int, default=4096)
+    args = arg_parser.parse_args()
+
+    files = {f'/files/{i}.pdf': os.urandom(args.size) for i in range(args.files)}
+    with StandInServer(files, tls=True) as server:
+        for label, use_sessions in (('requests.get', False), ('pooled sessions', True)):
+            elapsed, connections = run(server, files, use_sessions)
+            print(f'{label:>16}: {len(files) / elapsed:8.1f} files/s, {connections:5d} connections')
+
+
+if __name__ == '__main__':
+    main()
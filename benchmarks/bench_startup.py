@@ -0,0 +1,105 @@
+import argparse
+import contextlib
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import _pages
+from _server import StandInServer, fresh_manifest, DOCCRAWLER_PATH
+import engine
+
+# Dependencies that a run with nothing to download should not need
+HEAVY = ('bs4', 'html5lib', 'PIL', 'rarfile', 'aiohttp')
+ENTRIES = ('general_crawler', 'moodle_crawler')
+# Packages whose own import time is shown
+PACKAGES = HEAVY + ('requests', 'urllib3', 'rich.console', 'rich.progress', 'yaml', 'sqlite3')
+
+
+def parse_importtime(stderr) -> (float, dict[str, float]):
+    # Total import time and the cumulative time of the packages of PACKAGES that were imported, in seconds
+    total, packages = 0.0, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        seconds = int(cumulative) / 1e6
+        if name.strip() in PACKAGES:
+            packages[name.strip()] = seconds
+        # Nested imports are already counted by the import that triggered them
+        if not name.startswith('  '):
+            total += seconds
+    return total, packages
+
+
+def time_import(module, runs) -> (float, dict[str, float]):
+    totals, last = [], {}
+    for _ in range(runs):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                cwd=DOCCRAWLER_PATH, check=True, capture_output=True, text=True).stderr
+        total, last = parse_importtime(stderr)
+        totals.append(total)
+    return statistics.median(totals), last
+
+
+def child(base, state_dir, out_dir):
+    # A headless run of the general crawler over files that are all there already
+    fresh_manifest(state_dir)
+    engine.headless.start()
+    args = engine.get_arg_parser().parse_args(['-u', base + '/index.html', '-e', 'pdf', '-d', out_dir, '-H'])
+    engine.CrawlTask(vars(args)).run()
+    print(' '.join(module for module in HEAVY if module in sys.modules))
+
+
+def time_nothing_to_do(args) -> list[tuple[float, float, str]]:
+    names = [f'{i}.pdf' for i in range(args.files)]
+    files = {f'/files/{name}': os.urandom(args.size) for name in names}
+    results = []
+    with StandInServer(files) as server:
+        server.files['/index.html'] = _pages.generic_index_page(server.base_url, names).encode()
+        state_dir = fresh_manifest()
+        out_dir = tempfile.mkdtemp(prefix='doccrawler-bench-')
+        argv = ['-u', server.base_url + '/index.html', '-e', 'pdf', '-d', out_dir]
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            engine.CrawlTask(vars(engine.get_arg_parser().parse_args(argv))).run()
+        engine.manifest.close()
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            done = subprocess.run([sys.executable, '-X', 'importtime', __file__, '--child',
+                                   server.base_url, state_dir, out_dir],
+                                  check=True, capture_output=True, text=True)
+            elapsed = time.perf_counter() - start
+            total, _ = parse_importtime(done.stderr)
+            results.append((elapsed, total, done.stdout.strip().splitlines()[-1] if done.stdout.strip() else ''))
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-r', '--runs', type=int, default=5)
+    arg_parser.add_argument('-n', '--files', type=int, default=50)
+    arg_parser.add_argument('-s', '--size', type=int, default=16 * 1024)
+    arg_parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    for module in ENTRIES:
+        total, packages = time_import(module, args.runs)
+        top = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+        print(f'import {module:<16} {total * 1000:7.1f} ms  '
+              + ', '.join(f'{name} {seconds * 1000:.1f}' for name, seconds in top))
+
+    results = time_nothing_to_do(args)
+    wall = statistics.median(elapsed for elapsed, _, _ in results)
+    imports = statistics.median(total for _, total, _ in results)
+    heavy = results[-1][2] or 'none'
+    print(f'nothing to do ({args.files} files): {wall * 1000:7.1f} ms, of which imports {imports * 1000:.1f} ms, '
+          f'heavy modules loaded: {heavy}')
+
+
+if __name__ == '__main__':
+    main()
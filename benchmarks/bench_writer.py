@@ -0,0 +1,50 @@
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from _server import StandInServer
+import engine
+from writer import StreamWriter
+
+
+def chunked(response, fd):
+    # The write loop download_doc used before StreamWriter
+    digest = hashlib.sha256()
+    for chunk in response.iter_content(chunk_size=128):
+        fd.write(chunk)
+        digest.update(chunk)
+    fd.close()
+
+
+def buffered(response, fd):
+    response.raw.decode_content = True
+    with StreamWriter(fd, hashlib.sha256(), int(response.headers['Content-Length'])) as writer:
+        writer.copy(response.raw)
+
+
+def run(server, write):
+    session = engine.get_session(server.base_url)
+    with tempfile.TemporaryDirectory() as out_dir:
+        response = session.get(server.base_url + '/video.mp4', stream=True)
+        # Only the CPU time of this thread counts, not the one of the server threads
+        start = time.thread_time()
+        write(response, open(os.path.join(out_dir, 'video.mp4'), mode='wb'))
+        return time.thread_time() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-s', '--size', type=int, default=256, help='File size in MB')
+    args = arg_parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    with StandInServer({'/video.mp4': os.urandom(size)}) as server:
+        for label, write in (('iter_content(128)', chunked), ('StreamWriter', buffered)):
+            cpu = run(server, write)
+            print(f'{label:>17}: {cpu / size * 1024 ** 3:6.2f} CPU s/GB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import tempfile
+
+from _server import StandInServer, fresh_manifest
+import bench_e2e
+import engine
+import moodle_crawler
+import moodle_ws
+import taskexception
+
+COOKIES = {'MoodleSession': 'check'}
+# A token that the stand-in web services reject, the way Moodle does: a 200 with an exception object
+EXPIRED_TOKEN = 'expired'
+EXPIRED = {'exception': 'moodle_exception', 'errorcode': 'invalidtoken',
+           'message': 'Invalid token - token expired'}
+
+
+def stand_in(args) -> StandInServer:
+    server = StandInServer({})
+    files, redirects = bench_e2e.moodle_site(server.base_url, args)
+    server.files.update(files)
+    server.redirects.update(redirects)
+    server.files['/webservice/rest/server.php?wstoken=' + EXPIRED_TOKEN +
+                 '&wsfunction=core_course_get_contents&moodlewsrestformat=json&courseid=1'] = \
+        json.dumps(EXPIRED).encode()
+    moodle_crawler.MOODLE_RESOURCE_PAT = server.base_url + '/mod/resource/.*'
+    moodle_crawler.MOODLE_FOLDER_PAT = server.base_url + '/mod/folder/.*'
+    return server
+
+
+def courses_of(server, args, out_dir, my_args) -> (list, dict):
+    courses = [{'url': f'{server.base_url}/course/view.php?id={cid}', 'cid': cid}
+               for cid in range(1, args.courses + 1)]
+    infos = {cid: {'dir': os.path.join(out_dir, f'Course {cid}'), 'name': f'Course {cid}',
+                   'my_args': my_args, 'exclude': False} for cid in range(1, args.courses + 1)}
+    return courses, infos
+
+
+def ws_discovery(server, token=bench_e2e.WS_TOKEN) -> moodle_crawler.WSDiscovery:
+    return moodle_crawler.WSDiscovery(moodle_ws.MoodleWS(server.base_url, token, COOKIES), COOKIES, True)
+
+
+def targets(server, tasks) -> set[tuple[str, str]]:
+    # (file URL, directory) of the tasks, the resource pages followed to the file they redirect to
+    return {(server.redirects.get(t_info.url[len(server.base_url):], t_info.url), t_info.download_path)
+            for t_info in tasks}
+
+
+def check_same_files(server, args):
+    # The web services find the files and directories that the pages lead to
+    out_dir = tempfile.mkdtemp(prefix='doccrawler-check-')
+    courses, infos = courses_of(server, args, out_dir, [])
+    pages = targets(server, moodle_crawler.CourseDiscovery(COOKIES, True).run(courses, infos))
+    listed = targets(server, ws_discovery(server).run(courses, infos))
+    expected = args.courses * (args.files + args.folders * args.folder_files + args.videos)
+    assert len(pages) == expected, f'{len(pages)} files found on the pages, {expected} expected'
+    assert listed == pages, f'only on the pages: {sorted(pages - listed)[:3]}, ' \
+                            f'only in the listing: {sorted(listed - pages)[:3]}'
+    print(f'same files: {len(listed)} files in the same directories')
+
+
+def check_incremental(server, args):
+    # With -i, files whose timemodified matches the manifest are kept without any request
+    out_dir = tempfile.mkdtemp(prefix='doccrawler-check-')
+    courses, infos = courses_of(server, args, out_dir, ['-i'])
+    success, failed = engine.parallel_process(ws_discovery(server).run(courses, infos))
+    assert failed == 0 and success > 0, f'first run: {success} files, {failed} failed'
+    server.reset_stats()
+    success, failed = engine.parallel_process(ws_discovery(server).run(courses, infos))
+    assert failed == 0 and success > 0, f'second run: {success} files, {failed} failed'
+    # One core_course_get_contents call per course, no file request
+    assert server.requests == args.courses, f'{server.requests} requests for {args.courses} courses'
+    print(f'incremental: {success} files kept with {server.requests} requests, all of them listings')
+
+
+def check_error(server):
+    # Error objects come back with a 200 and raise WSException
+    try:
+        ws_discovery(server, EXPIRED_TOKEN).ws.course_contents(1)
+    except taskexception.WSException as e:
+        assert e.errorcode == EXPIRED['errorcode'], f'error code {e.errorcode}'
+        print(f'error payload: {e}')
+    else:
+        raise AssertionError('no WSException for an error payload')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Check the web services discovery against a stand-in Moodle')
+    arg_parser.add_argument('-c', '--courses', type=int, default=3)
+    arg_parser.add_argument('-n', '--files', type=int, default=5, help='Files per course')
+    arg_parser.add_argument('--folders', type=int, default=2, help='Folders per course')
+    arg_parser.add_argument('--folder-files', type=int, default=3)
+    arg_parser.add_argument('--videos', type=int, default=2, help='Videos per course')
+    args = arg_parser.parse_args()
+    args.size = 1024
+
+    fresh_manifest()
+    # Only the results of the checks are printed
+    engine.console.quiet = True
+    with stand_in(args) as server:
+        check_same_files(server, args)
+        check_incremental(server, args)
+        check_error(server)
+
+
+if __name__ == '__main__':
+    main()
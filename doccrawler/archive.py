@@ -0,0 +1,85 @@
+import os
+import time
+import zipfile
+import zlib
+
+# Runs in the extraction processes, so it only depends on the archive libraries
+
+CHUNK_SIZE = 1024 * 1024
+# Set in the header of zip members whose names are UTF-8, the others use the code page of the archiver
+_ZIP_UTF8 = 0x800
+_ZIP_ENCODING = 'gbk'
+
+
+def _zip_name(member: zipfile.ZipInfo):
+    if member.flag_bits & _ZIP_UTF8:
+        return member.filename
+    try:
+        return member.filename.encode('cp437').decode(_ZIP_ENCODING)
+    except UnicodeError:
+        return member.filename
+
+
+def _target(out_dir, name):
+    # Where the member lands, with absolute paths and '..' stripped like zipfile does
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return os.path.join(out_dir, *parts)
+
+
+def file_crc(path):
+    crc = 0
+    with open(path, 'rb') as fd:
+        while chunk := fd.read(CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def unchanged(path, size, crc) -> bool:
+    # The size is checked first, so that only likely matches are read back
+    if crc is None or not os.path.isfile(path) or os.path.getsize(path) != size:
+        return False
+    return file_crc(path) == crc
+
+
+def _extract_zip(path, out_dir):
+    extracted = skipped = size = 0
+    with zipfile.ZipFile(path) as zf:
+        for member in zf.infolist():
+            member.filename = _zip_name(member)
+            if not member.is_dir() and unchanged(_target(out_dir, member.filename), member.file_size, member.CRC):
+                skipped += 1
+                continue
+            zf.extract(member, path=out_dir)
+            if not member.is_dir():
+                extracted += 1
+                size += member.file_size
+    return extracted, skipped, size
+
+
+def _extract_rar(path, out_dir):
+    # Only loaded once a RAR archive turns up
+    import rarfile
+    extracted = skipped = size = 0
+    with rarfile.RarFile(path) as rf:
+        for member in rf.infolist():
+            # RAR5 archives may carry a BLAKE2 hash instead, those members are always extracted
+            crc = member.CRC if isinstance(member.CRC, int) else None
+            if not member.is_dir() and unchanged(_target(out_dir, member.filename), member.file_size, crc):
+                skipped += 1
+                continue
+            rf.extract(member, path=out_dir)
+            if not member.is_dir():
+                extracted += 1
+                size += member.file_size
+    return extracted, skipped, size
+
+
+def extract(path, out_dir) -> (int, int, int, float):
+    # Returns the members extracted, the members skipped as unchanged, the bytes written and the seconds taken
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    if path.endswith('zip'):
+        extracted, skipped, size = _extract_zip(path, out_dir)
+    else:
+        extracted, skipped, size = _extract_rar(path, out_dir)
+    return extracted, skipped, size, time.perf_counter() - started
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import queue as _queue
+import time
+from collections.abc import Iterable
+
+import aiohttp
+
+import metrics as _metrics
+from congestion import AsyncHostLimits
+from const import ASYNC_MAX_CONCURRENCY, ASYNC_PER_HOST, MAX_IN_FLIGHT, SEGMENT_WORKERS, CONNECT_TIMEOUT, READ_TIMEOUT
+from engine import TaskInfo, manifest, conditional_headers, same_length, resume_range, open_part, \
+    SegmentWriter, segment_validator, segment_slots, segment_ranges, segment_headers, check_segment, \
+    open_segmented, file_sha256, check_status, resolve_filename, extractor, new_progress, iter_tasks, ProgressBook, \
+    plan_known, keep_known, resumed_offset, plan_update, finish_stream, finish_download, \
+    host_limits, print_host_report, metrics
+from retry import retry_delay
+
+CHUNK_SIZE = 64 * 1024
+# Errors of the transport, retried and counted as congestion of the host
+_NETWORK_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+_TIMEOUT_ERRORS = (asyncio.TimeoutError,)
+
+
+def trace_config(limits: AsyncHostLimits) -> aiohttp.TraceConfig:
+    # Feeds the status and the time to the response headers of every request to the host windows,
+    # and the connect time and time to first byte to the record of the transfer
+    async def on_request_start(session, context, params):
+        context.started = time.monotonic()
+
+    async def on_request_end(session, context, params):
+        elapsed = time.monotonic() - context.started
+        limits.limits.observe(params.url, params.response.status, elapsed,
+                              params.response.headers.get('Retry-After'))
+        if (record := _metrics.current()) is not None:
+            record.add_ttfb(params.response.status, elapsed)
+        await limits.notify()
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_started = time.monotonic()
+
+    async def on_connection_create_end(session, context, params):
+        if (record := _metrics.current()) is not None:
+            record.add_connect(time.monotonic() - context.connect_started)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_connection_create_start.append(on_connection_create_start)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    return trace
+
+
+class AsyncDownloader:
+    def __init__(self, client: aiohttp.ClientSession, my_console, host_limit: AsyncHostLimits):
+        self.client = client
+        self.console = my_console
+        self.host_limit = host_limit
+
+    @staticmethod
+    def cookies(task: TaskInfo) -> dict | None:
+        # The cookies of the account the task belongs to, sent with each of its requests, since the
+        # tasks of one host may come from several accounts, e.g. in a queue worker
+        return task.session.cookies.get_dict() or None
+
+    async def __revalidate(self, task: TaskInfo, record, path):
+        headers = conditional_headers(record)
+        cookies = self.cookies(task)
+        if len(headers) == 0:
+            async with self.client.head(task.url, allow_redirects=True, cookies=cookies) as head:
+                if head.ok and same_length(record, head.headers, path):
+                    return None
+            return await self.client.get(task.url, cookies=cookies)
+
+        response = await self.client.get(task.url, headers=headers, cookies=cookies)
+        if response.status == 304:
+            response.release()
+            return None
+        return response
+
+    async def __fetch_segment(self, task: TaskInfo, validator, fd, start, end):
+        async with self.client.get(task.url, headers=segment_headers(validator, start, end),
+                                   cookies=self.cookies(task)) as response:
+            check_segment(response.status, response.headers, validator, start, end)
+            await self.__write_segment(task, response, fd, start, end)
+
+    @staticmethod
+    async def __write_segment(task: TaskInfo, response, fd, start, end):
+        writer = SegmentWriter(fd, start, end, task.progress)
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if writer.write(chunk):
+                break
+        writer.check()
+
+    async def __download_segmented(self, task: TaskInfo, response, path, length) -> str:
+        validator = segment_validator(response.headers)
+        # The file first, so that the host slots are only taken once nothing but the transfers can fail
+        fd = open_segmented(task, path, length)
+        slots = 0
+        try:
+            slots = segment_slots(task)
+            ranges = segment_ranges(length, slots + 1)
+            # The response already streams from byte 0, so it serves the first segment
+            results = await asyncio.gather(self.__write_segment(task, response, fd, *ranges[0]),
+                                           *(self.__fetch_segment(task, validator, fd, start, end)
+                                             for start, end in ranges[1:]),
+                                           return_exceptions=True)
+        finally:
+            os.close(fd)
+            for _ in range(slots):
+                await self.host_limit.release(task.url)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        os.replace(path + '.part', path)
+        return await asyncio.to_thread(file_sha256, path)
+
+    async def download_doc(self, task: TaskInfo) -> (str, bool):
+        with metrics.transfer('file', task.url, task.group) as record:
+            record.attempt = task.attempts
+            return await self.__download_doc(task, record)
+
+    async def __download_doc(self, task: TaskInfo, record: _metrics.Transfer) -> (str, bool):
+        # ---- Plan from manifest ---- #
+        response = None
+        known, filename, changed = plan_known(task)
+        if known is not None and changed is None:
+            response = await self.__revalidate(task, known, os.path.join(task.download_path, filename))
+            changed = response is not None
+        if keep_known(task, known, changed):
+            return filename, False
+
+        offset = 0
+        if response is None:
+            headers, offset = resume_range(task)
+            response = await self.client.get(task.url, headers=headers, cookies=self.cookies(task))
+            offset = resumed_offset(task, offset, response.status, response.headers)
+            if offset is None:
+                offset = 0
+                response.release()
+                response = await self.client.get(task.url, cookies=self.cookies(task))
+        try:
+            check_status(response.status, response.headers, task.url)
+            filename = resolve_filename(task, str(response.url))
+            path = os.path.join(task.download_path, filename)
+
+            # ---- Update ---- #
+            updated, sha256, length = plan_update(task, offset, changed, response.status, response.url,
+                                                  response.headers, path)
+            linked = sha256 is not None
+            if updated and not linked:
+                if length is not None:
+                    sha256 = await self.__download_segmented(task, response, path, length)
+                    record.bytes = length
+                else:
+                    # Resuming hashes the .part file again, which stalls every transfer if done on the loop
+                    writer = await asyncio.to_thread(open_part, task, response.url, response.headers, path, offset) \
+                        if offset else open_part(task, response.url, response.headers, path, offset)
+                    with writer:
+                        await writer.copy_async(response.content)
+                    sha256 = finish_stream(task, record, writer, response.headers, path)
+        finally:
+            response.release()
+        finish_download(task, response.url, response.headers, filename, path, updated, linked, sha256)
+        return filename, updated
+
+
+async def _process(queue: Iterable[TaskInfo] | _queue.Queue, book: ProgressBook, per_host, max_concurrency):
+    limit = asyncio.Semaphore(max_concurrency)
+    host_limit = AsyncHostLimits(host_limits)
+    # Bounds the tasks created but not finished yet
+    window = asyncio.Semaphore(max_concurrency + MAX_IN_FLIGHT)
+    in_flight = set()
+    # Extra connections for segments, so that they never wait on the transfers they belong to
+    connector = aiohttp.TCPConnector(limit=max_concurrency + SEGMENT_WORKERS,
+                                     limit_per_host=per_host + SEGMENT_WORKERS)
+
+    async with aiohttp.ClientSession(connector=connector,
+                                     # Cookies come from the sessions of the tasks, see AsyncDownloader.cookies
+                                     cookie_jar=aiohttp.DummyCookieJar(),
+                                     # No limit on a whole transfer, so that long videos are never cut off
+                                     timeout=aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT,
+                                                                   sock_read=READ_TIMEOUT),
+                                     trace_configs=[trace_config(host_limit)]) as client:
+        downloader = AsyncDownloader(client, book.progress.console, host_limit)
+
+        async def attempt(t_info: TaskInfo):
+            # The host window first, so that a throttled host never holds global slots
+            await host_limit.acquire(t_info.url)
+            error = None
+            try:
+                async with limit:
+                    return await downloader.download_doc(t_info)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                await host_limit.release(t_info.url, error if isinstance(error, _NETWORK_ERRORS) else None)
+
+        async def worker(t_info: TaskInfo):
+            try:
+                while True:
+                    try:
+                        result = await attempt(t_info)
+                    except Exception as e:
+                        delay = retry_delay(t_info.attempts, e, _NETWORK_ERRORS, _TIMEOUT_ERRORS)
+                        if delay is None:
+                            book.done(t_info, error=e)
+                            return
+                        t_info.attempts += 1
+                        book.retrying(t_info, e, delay)
+                        await asyncio.sleep(delay)
+                    else:
+                        book.done(t_info, result=result)
+                        return
+            finally:
+                window.release()
+
+        # The source may block (e.g. a discovery generator), so it is read from a thread
+        tasks = iter_tasks(queue)
+        submitted = 0
+        while (t_info := await asyncio.to_thread(next, tasks, None)) is not None:
+            await window.acquire()
+            book.add(t_info)
+            future = asyncio.create_task(worker(t_info))
+            in_flight.add(future)
+            future.add_done_callback(in_flight.discard)
+            submitted += 1
+        await asyncio.gather(*in_flight)
+
+    book.finish(submitted)
+
+
+def parallel_process(queue: Iterable[TaskInfo] | _queue.Queue,
+                     per_host=None, max_concurrency=ASYNC_MAX_CONCURRENCY, groups=None, on_done=None):
+    try:
+        with new_progress() as progress:
+            manifest.begin_run()
+            book = ProgressBook(progress, len(queue) if hasattr(queue, '__len__') else None, groups, on_done)
+            extractor.attach(progress)
+            host_limits.reset(per_host or ASYNC_PER_HOST)
+            asyncio.run(_process(queue, book, per_host or ASYNC_PER_HOST, max_concurrency))
+    finally:
+        extractor.wait()
+        manifest.save()
+
+    print_host_report()
+    return book.result
@@ -0,0 +1,31 @@
+from rich import progress as _progress, panel as _panel, text as _text
+
+
+class BoxProgress(_progress.Progress):
+    def get_renderables(self):
+        yield _panel.Panel(self.make_tasks_table(self.tasks), border_style='white')
+
+
+class TransferColumn(_progress.ProgressColumn):
+    # Bytes, speed and time remaining of the rows counting bytes, nothing for the others
+    def __init__(self):
+        super().__init__()
+        self.columns = (_progress.DownloadColumn(), _progress.TransferSpeedColumn(), _progress.TimeRemainingColumn())
+
+    def render(self, task):
+        if not task.fields.get('bytes'):
+            return _text.Text('')
+        return _text.Text(' ').join(column.render(task) for column in self.columns)
+
+
+def new_progress(console, disable=False) -> BoxProgress:
+    return BoxProgress(
+        _progress.TextColumn("[progress.description]{task.description}"),
+        _progress.SpinnerColumn(),
+        _progress.BarColumn(),
+        _progress.TaskProgressColumn(),
+        _progress.TimeElapsedColumn(),
+        TransferColumn(),
+        console=console,
+        disable=disable,
+    )
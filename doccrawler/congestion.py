@@ -0,0 +1,276 @@
+import asyncio
+import email.utils
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from urllib import parse as _parse
+
+from const import ADAPTIVE_INITIAL, LATENCY_TOLERANCE, RETRY_AFTER_MAX
+
+# Responses telling the client to slow down, or that the server is struggling
+_THROTTLED = (429, 503)
+
+
+def retry_after(value, now=None) -> float:
+    # Seconds to wait from a Retry-After header, either delay-seconds or an HTTP date
+    if value is None:
+        return 0.0
+    now = time.time() if now is None else now
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = email.utils.parsedate_to_datetime(value).timestamp() - now
+        except (TypeError, ValueError):
+            return 0.0
+    return min(max(delay, 0.0), RETRY_AFTER_MAX)
+
+
+class HostWindow:
+    # AIMD window of the requests in flight to one host. It grows by one per window of successes while
+    # the latency stays near the best seen, shrinks gently when the latency builds up and halves on
+    # 429/5xx or connection errors, at most once per round trip. Past the limit where the host last
+    # pushed back, it only grows by one per window squared, so that it probes instead of hammering.
+    def __init__(self, initial, ceiling):
+        self.limit = float(min(initial, ceiling))
+        self.ceiling = ceiling
+        self.in_flight = 0
+        self.peak = self.limit
+        self.base_latency: float | None = None
+        self.latency: float | None = None
+        self.blocked_until = 0.0
+        self.threshold = float(ceiling)
+        self.responses = 0
+        self.throttled = 0
+        self._last_decrease = 0.0
+
+    @property
+    def allowed(self):
+        return max(1, min(int(self.limit), self.ceiling))
+
+    def wait_time(self, now) -> float | None:
+        # None if a request can start now, otherwise the seconds to wait at most before checking again
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= self.allowed:
+            return 1.0
+        return None
+
+    def __decrease(self, factor, now):
+        if now - self._last_decrease < (self.latency or 0.0):
+            return
+        if factor < 0.9:
+            self.threshold = self.limit
+        self.limit = max(1.0, self.limit * factor)
+        self._last_decrease = now
+
+    def on_response(self, status, latency, retry_after_value=None):
+        now = time.monotonic()
+        self.responses += 1
+        if status in _THROTTLED or status >= 500:
+            self.throttled += 1
+            self.__decrease(0.5, now)
+            self.blocked_until = max(self.blocked_until, now + retry_after(retry_after_value))
+            return
+
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        if self.latency > self.base_latency * LATENCY_TOLERANCE:
+            self.__decrease(0.9, now)
+        elif self.limit < self.ceiling:
+            step = 1 / self.limit if self.limit + 1 < self.threshold else 1 / self.limit ** 2
+            self.limit = min(self.limit + step, float(self.ceiling))
+            self.peak = max(self.peak, self.limit)
+
+    def on_error(self):
+        self.throttled += 1
+        self.__decrease(0.5, time.monotonic())
+
+
+class HostLimits:
+    # Per-host windows shared by the workers. The state is kept between runs of the same process.
+    # network_errors: exceptions counted as congestion when they end a request
+    def __init__(self, ceiling, network_errors=(ConnectionError, TimeoutError), initial=ADAPTIVE_INITIAL):
+        self.ceiling = ceiling
+        self.network_errors = network_errors
+        self.initial = initial
+        self._windows: dict[str, HostWindow] = {}
+        self._cond = threading.Condition()
+
+    def window(self, url) -> HostWindow:
+        # Callers hold the condition
+        host = _parse.urlparse(str(url)).netloc
+        if host not in self._windows:
+            self._windows[host] = HostWindow(self.initial, self.ceiling)
+        return self._windows[host]
+
+    def reset(self, ceiling):
+        # Called at the start of a run: a new ceiling, fresh counters, learned limits kept
+        with self._cond:
+            self.ceiling = ceiling
+            for window in self._windows.values():
+                window.ceiling = ceiling
+                window.threshold = min(window.threshold, float(ceiling))
+                window.responses = window.throttled = 0
+
+    def acquire(self, url):
+        with self._cond:
+            window = self.window(url)
+            while (timeout := window.wait_time(time.monotonic())) is not None:
+                self._cond.wait(timeout)
+            window.in_flight += 1
+
+    def reserve(self, url, n) -> int:
+        # Takes up to n of the free slots of the host without waiting, e.g. for the segments of a transfer
+        # that already holds one. Returns how many were taken, each released on its own.
+        with self._cond:
+            window = self.window(url)
+            taken = 0
+            while taken < n and window.wait_time(time.monotonic()) is None:
+                window.in_flight += 1
+                taken += 1
+            return taken
+
+    def release(self, url, error=None):
+        with self._cond:
+            window = self.window(url)
+            window.in_flight -= 1
+            if error is not None:
+                window.on_error()
+            self._cond.notify_all()
+
+    def observe(self, url, status, latency, retry_after_value=None):
+        with self._cond:
+            self.window(url).on_response(status, latency, retry_after_value)
+            self._cond.notify_all()
+
+    def observe_response(self, response, *args, **kwargs):
+        # Response hook of requests sessions
+        self.observe(response.url, response.status_code, response.elapsed.total_seconds(),
+                     response.headers.get('Retry-After'))
+
+    def __call__(self, url):
+        return _Slot(self, url)
+
+    def held(self, url):
+        # The slot of a task that HostQueues started, released the same way
+        return _Slot(self, url, acquired=True)
+
+    def report(self) -> list[tuple]:
+        # (host, converged limit, peak limit, responses, throttled) of the hosts seen in this run
+        with self._cond:
+            return [(host, window.allowed, int(window.peak), window.responses, window.throttled)
+                    for host, window in self._windows.items() if window.responses > 0]
+
+
+class _Slot:
+    def __init__(self, limits: HostLimits, url, acquired=False):
+        self.limits = limits
+        self.url = url
+        self.acquired = acquired
+
+    def __enter__(self):
+        if not self.acquired:
+            self.limits.acquire(self.url)
+
+    def __exit__(self, exc_type, exc, tb):
+        # Network errors count as congestion, errors of the task itself do not
+        self.limits.release(self.url, exc if isinstance(exc, self.limits.network_errors) else None)
+
+
+class HostQueues:
+    # Tasks waiting for a slot of their host, one queue per host. A thread starts each of them once its
+    # host has a free slot, so that the tasks of a throttled host wait here instead of holding the workers
+    # that the other hosts could use. start(task) is called with the slot taken, see HostLimits.held.
+    # The workers call pump once they released a slot, which starts the next task without a thread switch.
+    def __init__(self, limits: HostLimits, start: Callable[[object], None]):
+        self.limits = limits
+        self.start = start
+        self._pending: dict[str, deque] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    def put(self, url, task):
+        with self.limits._cond:
+            self._pending.setdefault(_parse.urlparse(str(url)).netloc, deque()).append((url, task))
+        self.pump()
+
+    def pump(self):
+        with self.limits._cond:
+            ready, _ = self.__ready()
+        for task in ready:
+            self.start(task)
+
+    def __ready(self) -> (list, float | None):
+        # Callers hold the condition. The tasks that may start now, with their slots taken, and the time
+        # to wait at most before the next look when there are none.
+        ready = []
+        timeout = None
+        now = time.monotonic()
+        for host in list(self._pending):
+            tasks = self._pending[host]
+            window = self.limits.window(tasks[0][0])
+            while len(tasks) != 0:
+                wait = window.wait_time(now)
+                if wait is not None:
+                    timeout = wait if timeout is None else min(timeout, wait)
+                    break
+                window.in_flight += 1
+                ready.append(tasks.popleft()[1])
+            if len(tasks) == 0:
+                del self._pending[host]
+        return ready, timeout
+
+    def __run(self):
+        while True:
+            with self.limits._cond:
+                ready, timeout = self.__ready()
+                if len(ready) == 0:
+                    if self._closed and len(self._pending) == 0:
+                        return
+                    self.limits._cond.wait(timeout)
+                    continue
+            for task in ready:
+                self.start(task)
+
+    def close(self, cancel=False):
+        # Once the last task was put, returns when all of them were started, or dropped with cancel
+        with self.limits._cond:
+            self._closed = True
+            if cancel:
+                self._pending.clear()
+            self.limits._cond.notify_all()
+        self._thread.join()
+
+
+class AsyncHostLimits:
+    # The same windows, waited for on the event loop
+    def __init__(self, limits: HostLimits):
+        self.limits = limits
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, url):
+        async with self._cond:
+            while True:
+                with self.limits._cond:
+                    window = self.limits.window(url)
+                    timeout = window.wait_time(time.monotonic())
+                    if timeout is None:
+                        window.in_flight += 1
+                        return
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, url, error=None):
+        self.limits.release(url, error)
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def notify(self):
+        async with self._cond:
+            self._cond.notify_all()
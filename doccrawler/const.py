@@ -8,9 +8,73 @@ console = Console()
 ROOT_PATH = sys.path[0]
 GENERAL_CONFIG_PATH = os.path.join(ROOT_PATH, '../general_config.yaml')
 MOODLE_CONFIG_PATH = os.path.join(ROOT_PATH, '../moodle_config.yaml')
+MANIFEST_PATH = os.path.join(ROOT_PATH, '../manifest.db')
 
 DOWNLOAD_PATH = os.path.join(ROOT_PATH, '../Download/')
 TMP_PATH = os.path.join(ROOT_PATH, './tmp/')
+PAGE_CACHE_PATH = os.path.join(ROOT_PATH, '../cache/pages/')
+
+# Tasks that failed for good, replayed by --retry-failed
+FAILED_PATH = os.path.join(ROOT_PATH, '../failed.jsonl')
+
+# ---- Network ---- #
+MAX_WORKERS = 64
+# Seconds to connect, and seconds without a byte from the server before a request fails and is retried.
+# A whole transfer has no limit, so that long videos are never cut off.
+CONNECT_TIMEOUT = 15
+READ_TIMEOUT = 60
+# Requests in flight per host start here and adapt to the latency and 429/5xx responses of the host
+ADAPTIVE_INITIAL = 4
+# The latency may grow to this multiple of the best one seen before a host is considered saturated
+LATENCY_TOLERANCE = 2.0
+# Longest Retry-After honoured, in seconds
+RETRY_AFTER_MAX = 300
+DISCOVERY_WORKERS = 8
+# HEAD requests in flight while the sizes of a run are planned
+PLAN_WORKERS = 16
+# Seconds between two pages of the same host in recursive crawls, unless robots.txt asks for more
+CRAWL_DELAY = 0.0
+# Tasks submitted to the workers but not finished yet
+MAX_IN_FLIGHT = 4 * MAX_WORKERS
+ASYNC_MAX_CONCURRENCY = 256
+# Most requests in flight per host of the asyncio engine
+ASYNC_PER_HOST = 64
+# Transient errors are retried with jittered exponential backoff, in seconds
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Files larger than the threshold are fetched in byte ranges over several connections
+SEGMENT_THRESHOLD = 64 * 1024 * 1024
+SEGMENT_COUNT = 8
+SEGMENT_WORKERS = 16
+# Index pages: entries kept in memory, bytes kept on disk, seconds before revalidating
+PAGE_CACHE_ENTRIES = 64
+PAGE_CACHE_BYTES = 64 * 1024 * 1024
+PAGE_CACHE_FRESH = 300
+# Processes unzipping the downloaded archives next to the downloads
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+# Files with the same content are stored once, the copies are reflinks or hardlinks to it
+DEDUP = True
+# Smallest body left unread when the same URL announces content that is stored already. Leaving a body
+# unread closes its connection, which costs more than reading a small one.
+LINK_THRESHOLD = 1024 * 1024
+# When written files are flushed to disk: 'never', 'close' or 'interval' (every FSYNC_INTERVAL bytes)
+FSYNC_POLICY = 'never'
+FSYNC_INTERVAL = 64 * 1024 * 1024
+# Free space left on a disk by a planned run
+DISK_RESERVE = 256 * 1024 * 1024
+# Watch mode: seconds between polls of a source at first, doubled while it does not change, up to the max
+WATCH_INTERVAL = 600
+WATCH_MAX_INTERVAL = 6 * 3600
+# Shared work queue: seconds a worker holds the tasks it claimed without renewing them, and how many
+# times the lease of a task may expire, e.g. because its worker crashed, before it is given up
+LEASE_SECONDS = 300
+LEASE_MAX = 3
+# Tasks written to the work queue at once while they are discovered
+ENQUEUE_BATCH = 256
+# Log lines of headless runs are written when this many are pending, or after this many seconds
+LOG_FLUSH_LINES = 200
+LOG_FLUSH_INTERVAL = 5.0
 
 # ---- Moodle ---- #
 MAIN_PAGE_URL = 'https://selearning.nju.edu.cn/my/'
@@ -21,6 +85,8 @@ AUTH_API = 'https://authserver.nju.edu.cn/authserver/qrCode/get?ts={}'
 QR_API = 'https://authserver.nju.edu.cn/authserver/qrCode/code?uuid={}'
 CHECK_API = 'https://authserver.nju.edu.cn/authserver/qrCode/status?ts={}&uuid={}'
 MOODLE_AUTH_API = 'https://selearning.nju.edu.cn/login/index.php?authCAS=CAS&ticket={}'
+# REST endpoint of the web services, relative to the site
+MOODLE_WS_PATH = '/webservice/rest/server.php'
 
 MOODLE_RESOURCE_PAT = 'https://selearning.nju.edu.cn/mod/resource/.*'
 MOODLE_FOLDER_PAT = 'https://selearning.nju.edu.cn/mod/folder/.*'
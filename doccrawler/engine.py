@@ -1,38 +1,91 @@
 import argparse
+import contextlib
+import fcntl
+import functools
+import hashlib
+import multiprocessing
 import os
+import queue as _queue
 import re
+import threading
+import time
 import urllib.parse
-import zipfile
+from collections.abc import Callable, Iterable, Iterator
 from concurrent import futures as _futures
+from typing import TYPE_CHECKING
 from urllib import parse as _parse
 
-import bs4
-import rarfile
 import requests
-from rich import progress as _progress, panel as _panel, columns as _columns
+import urllib3
+from requests import adapters as _adapters
+from rich import panel as _panel, columns as _columns, table as _table, filesize as _filesize
 from rich.markup import escape
 
+import archive
+import frontier as _frontier
+import headless as _headless
+import links
+import metrics as _metrics
+import planner as _planner
 import taskexception
-from const import DOWNLOAD_PATH, console
+import workqueue as _workqueue
+from const import DOWNLOAD_PATH, MANIFEST_PATH, FAILED_PATH, DEDUP, LINK_THRESHOLD, MAX_WORKERS, MAX_IN_FLIGHT, \
+    DISCOVERY_WORKERS, ENQUEUE_BATCH, EXTRACT_WORKERS, WATCH_INTERVAL, CRAWL_DELAY, SEGMENT_COUNT, SEGMENT_THRESHOLD, \
+    SEGMENT_WORKERS, PAGE_CACHE_PATH, PAGE_CACHE_ENTRIES, PAGE_CACHE_BYTES, PAGE_CACHE_FRESH, CONNECT_TIMEOUT, \
+    READ_TIMEOUT, console
+from congestion import HostLimits, HostQueues, retry_after
+from manifest import Manifest
+from pagecache import PageCache
+from retry import FailedTasks, retry_delay
+from writer import StreamWriter, preallocate
+
+if TYPE_CHECKING:
+    # The progress panel and the HTML parser are imported when first used, runs with nothing to do
+    # start faster without them
+    import bs4
+    from boxprogress import BoxProgress
+
+manifest = Manifest(MANIFEST_PATH)
+page_cache = PageCache(PAGE_CACHE_PATH, PAGE_CACHE_ENTRIES, PAGE_CACHE_BYTES, PAGE_CACHE_FRESH)
+failed_tasks = FailedTasks(FAILED_PATH)
+# Timings of the transfers of a run, exported by --metrics
+metrics = _metrics.Metrics()
+# Log and summary of --headless runs
+headless = _headless.Headless()
+# Errors of the transport, retried and counted as congestion of the host
+NETWORK_ERRORS = (requests.ConnectionError, urllib3.exceptions.ProtocolError)
+TIMEOUT_ERRORS = (requests.Timeout, urllib3.exceptions.TimeoutError)
+# Requests in flight per host, adapted to the responses of all the sessions
+host_limits = HostLimits(MAX_WORKERS, NETWORK_ERRORS + TIMEOUT_ERRORS)
 
 
 class TaskInfo:
+    # Tasks reference the shared session of their host and account instead of carrying the cookies
+    __slots__ = ('download_path', 'url', 'filename', 'order', 'session', 'update', 'unzip', 'incremental',
+                 'group', 'attempts', 'modified', 'size', 'received', 'progress')
+
     def __init__(self,
                  download_path, url, filename,
                  order, cookies, update,
-                 unzip):
+                 unzip, incremental=False):
         self.download_path = download_path
         self.url = url
         self.filename = filename
         self.order = order
-        self.cookies = cookies
+        self.session = get_session(url, cookies)
         self.update = update
         self.unzip = unzip
-
-
-class BoxProgress(_progress.Progress):
-    def get_renderables(self):
-        yield _panel.Panel(self.make_tasks_table(self.tasks), border_style='white')
+        self.incremental = incremental
+        # Name of the preset the task comes from, when several run together
+        self.group = None
+        # Attempts that failed with a transient error so far
+        self.attempts = 0
+        # Time of the last change of the file on the server, when a listing gives it
+        self.modified = None
+        # Bytes to transfer when known, bytes transferred so far and where to report them
+        self.size = None
+        self.received = 0
+        self.progress = None
 
 
 def get_arg_parser():
@@ -47,17 +100,129 @@ def get_arg_parser():
     arg_parser.add_argument('-o', '--order', help='Add order prefix', action='store_true')
     arg_parser.add_argument('-U', '--update', help='Update existed file', action='store_true')
     arg_parser.add_argument('-z', '--unzip', help='Unzip compressed files', action='store_true')
+    arg_parser.add_argument('-i', '--incremental', help='Update changed files only', action='store_true')
+    arg_parser.add_argument('-A', '--async', help='Use the asyncio engine', action='store_true', dest='use_async')
+    arg_parser.add_argument('-D', '--depth', help='Follow links to other pages up to this depth', type=int, default=0)
+    arg_parser.add_argument('-s', '--scope', help='Regex of the pages to follow, the same site by default', type=str)
+    arg_parser.add_argument('--delay', help='Seconds between two pages of the same site', type=float,
+                            default=CRAWL_DELAY)
+    add_retry_argument(arg_parser)
+    add_changed_argument(arg_parser)
+    arg_parser.add_argument('-p', '--preset', help='Presets to run, all of them in headless mode by default',
+                            type=str, nargs='+', dest='presets')
+    add_headless_argument(arg_parser)
+    arg_parser.add_argument('--plan', help='Size all files first, check the free space and mix large and small '
+                                           'files', action='store_true')
+    arg_parser.add_argument('--priority', help='Regexes of the URLs or directories to download first, in order',
+                            type=str, nargs='+')
+    add_enqueue_argument(arg_parser)
+    add_watch_argument(arg_parser)
+    _metrics.add_arguments(arg_parser)
 
     return arg_parser
 
 
-def open_page(url, cookies={}):
-    return bs4.BeautifulSoup(requests.get(url, cookies=cookies).content.decode('utf-8'), 'html5lib')
+def add_enqueue_argument(arg_parser):
+    arg_parser.add_argument('--enqueue', help='Only discover the files and add them to the work queue at this path, '
+                                              'see queue_worker.py', type=str, metavar='PATH')
 
 
-def download_doc(task: TaskInfo, my_console=console) -> (str, bool):
-    response = requests.get(task.url, cookies=task.cookies, stream=True)
-    path_str = urllib.parse.urlparse(response.url).path
+def add_retry_argument(arg_parser, help_text='Retry the files that failed last time'):
+    arg_parser.add_argument('-R', '--retry-failed', help=help_text, action='store_true')
+
+
+def add_headless_argument(arg_parser):
+    arg_parser.add_argument('-H', '--headless', help='Never prompt nor render progress, print a JSON summary',
+                            action='store_true')
+
+
+def add_changed_argument(arg_parser):
+    arg_parser.add_argument('-C', '--changed', help='List the files whose content changed in the last run, and '
+                                                    'exit', action='store_true')
+
+
+def add_watch_argument(arg_parser):
+    arg_parser.add_argument('-W', '--watch', help=f'Keep running and poll for changes, every {WATCH_INTERVAL}s '
+                                                  f'at first', type=float, nargs='?', const=WATCH_INTERVAL,
+                            metavar='SECONDS')
+
+
+# ---- Sessions ---- #
+_sessions: dict[tuple[str, tuple], requests.Session] = {}
+# Last session created with cookies for each host, see get_session
+_logged_in: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+class _TimeoutAdapter(_adapters.HTTPAdapter):
+    # Requests without a timeout of their own get the connect and read timeouts
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT) if timeout is None else timeout,
+                            **kwargs)
+
+
+def get_session(url, cookies=None) -> requests.Session:
+    # One keep-alive session per host and set of cookies, i.e. per account, shared by all workers.
+    # Cookies are set on creation only. Without cookies, the last session of the host that was created
+    # with some is used, e.g. the fresh Moodle login for the tasks of --retry-failed.
+    host = _parse.urlparse(url).netloc
+    key = (host, tuple(sorted(cookies.items())) if cookies else ())
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None and not cookies:
+            session = _logged_in.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = _TimeoutAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS + SEGMENT_WORKERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _metrics.time_connections(adapter)
+            session.hooks['response'].extend((host_limits.observe_response, _metrics.observe_response))
+            if cookies:
+                session.cookies.update(cookies)
+                _logged_in[host] = session
+            _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _logged_in.clear()
+
+
+def fetch_page(url, cookies={}) -> bytes:
+    with metrics.transfer('page', url) as record:
+        body = page_cache.fetch(url, get_session(url, cookies))
+        record.bytes = len(body)
+    return body
+
+
+def open_page(url, cookies={}) -> 'bs4.BeautifulSoup':
+    import bs4
+    with metrics.transfer('page', url) as record:
+        body = page_cache.fetch(url, get_session(url, cookies))
+        record.bytes = len(body)
+        started = time.perf_counter()
+        soup = bs4.BeautifulSoup(body.decode('utf-8'), 'html5lib')
+        record.parse = time.perf_counter() - started
+    return soup
+
+
+def open_links(url, cookies={}, strict=False) -> links.PageLinks:
+    with metrics.transfer('page', url) as record:
+        body = page_cache.fetch(url, get_session(url, cookies), strict)
+        record.bytes = len(body)
+        started = time.perf_counter()
+        page = page_cache.links(body)
+        record.parse = time.perf_counter() - started
+    return page
+
+
+def resolve_filename(task: TaskInfo, response_url) -> str:
+    path_str = urllib.parse.urlparse(response_url).path
     path_str = os.path.split(path_str)[-1]
     path_str = urllib.parse.unquote(path_str)
 
@@ -70,88 +235,859 @@ def download_doc(task: TaskInfo, my_console=console) -> (str, bool):
         filename = task.filename.removesuffix(f'.{ext}')
         filename = f'{filename}.{ext}'
 
-    filename = task.order + filename
-    path = os.path.join(task.download_path, filename)
+    return task.order + filename
+
+
+def record_file(task: TaskInfo, response_url, headers, filename, path, sha256=None):
+    manifest.put(task.url,
+                 response_url=str(response_url),
+                 filename=filename,
+                 size=os.path.getsize(path),
+                 etag=headers.get('ETag'),
+                 last_modified=headers.get('Last-Modified'),
+                 length=headers.get('Content-Length'),
+                 sha256=sha256,
+                 modified=task.modified)
+
+
+def find_known(task: TaskInfo):
+    # Returns (record, filename) if the manifest knows the task and its file still exists
+    record = manifest.get(task.url)
+    if record is None:
+        return None, None
+    filename = resolve_filename(task, record['response_url'])
+    if not os.path.exists(os.path.join(task.download_path, filename)):
+        return None, None
+    return record, filename
+
+
+def listed_unchanged(task: TaskInfo, record) -> bool | None:
+    # Whether the time of change given by a listing matches the one of the local copy, None if unknown
+    if task.modified is None or record['modified'] is None:
+        return None
+    return task.modified == record['modified']
+
+
+def conditional_headers(record) -> dict:
+    headers = {}
+    if record['etag'] is not None:
+        headers['If-None-Match'] = record['etag']
+    if record['last_modified'] is not None:
+        headers['If-Modified-Since'] = record['last_modified']
+    return headers
+
+
+def same_length(record, headers, path) -> bool:
+    length = headers.get('Content-Length')
+    return length is not None and length == record['length'] and int(length) == os.path.getsize(path)
+
+
+def revalidate(task: TaskInfo, session, record, path):
+    # Returns None if the local copy is still fresh, otherwise an open response with the new body
+    headers = conditional_headers(record)
+    if len(headers) == 0:
+        # No validators: compare sizes with a HEAD first
+        head = session.head(task.url, allow_redirects=True)
+        if head.ok and same_length(record, head.headers, path):
+            return None
+        return session.get(task.url, stream=True)
+
+    response = session.get(task.url, headers=headers, stream=True)
+    if response.status_code == 304:
+        response.close()
+        return None
+    return response
+
+
+def check_status(status, headers, url):
+    if status >= 400:
+        raise taskexception.StatusException(status, url, retry_after(headers.get('Retry-After')))
+
+
+def check_complete(headers, written, url):
+    # Bodies shorter than announced are left in the .part file, to be resumed by the next attempt
+    length = headers.get('Content-Length')
+    if length is not None and 'Content-Encoding' not in headers and written < int(length):
+        raise taskexception.TruncatedException(url, written, int(length))
+
+
+# ---- Content store ---- #
+# ioctl of Linux cloning a whole file, where the file system supports it
+_FICLONE = 0x40049409
+
+
+def link_file(src, dst) -> bool:
+    # A reflink where possible, a hardlink otherwise. dst is replaced atomically.
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return True
+    tmp = dst + '.link'
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(tmp)
+    try:
+        with open(src, mode='rb') as fsrc, open(tmp, mode='wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    except OSError:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            return False
+    os.replace(tmp, dst)
+    return True
+
+
+def find_stored(rows, path) -> dict | None:
+    # First stored copy, other than path itself, which still exists with its recorded size
+    for row in rows:
+        if row['path'] != path and os.path.isfile(row['path']) and os.path.getsize(row['path']) == row['size']:
+            return row
+    return None
 
-    # ---- Update ---- #
-    updated = False
-    if task.update or not os.path.exists(path):
-        updated = True
-        with open(path, mode='wb') as fd:
-            for chunk in response.iter_content(chunk_size=128):
-                fd.write(chunk)
 
-    # ---- Unzip ---- #
-    if updated and task.unzip and re.match(r'.*(rar|zip)$', filename) is not None:
+def strong_etag(headers) -> str | None:
+    etag = headers.get('ETag')
+    return None if etag is None or etag.startswith('W/') else etag
+
+
+def link_known(task: TaskInfo, response_url, headers, path) -> str | None:
+    # Links the content that the same URL was served with before, when it comes with the same ETag and size
+    # again, before the body is read. ETags only tell apart the versions of one resource, so the copies
+    # served under other URLs are found by hash once downloaded, see store_file.
+    # Returns the hash of the linked content, or None if the body has to be fetched.
+    etag = strong_etag(headers)
+    length = headers.get('Content-Length')
+    if not DEDUP or etag is None or length is None or 'Content-Encoding' in headers \
+            or int(length) < LINK_THRESHOLD:
+        return None
+    record = manifest.get(task.url)
+    if record is None or record['sha256'] is None or record['etag'] != etag or record['size'] != int(length):
+        return None
+    path = os.path.abspath(path)
+    row = find_stored(manifest.find_content(record['sha256']), path)
+    if row is None or row['size'] != int(length) or not link_file(row['path'], path):
+        return None
+    manifest.put_content(path, sha256=row['sha256'], size=row['size'],
+                         host=_parse.urlparse(str(response_url)).netloc, etag=etag)
+    return row['sha256']
+
+
+def store_file(response_url, headers, path, sha256):
+    # Registers a downloaded file by content, and turns it into a link if the content is stored already
+    if not DEDUP or sha256 is None:
+        return
+    path = os.path.abspath(path)
+    size = os.path.getsize(path)
+    row = find_stored(manifest.find_content(sha256), path)
+    if row is not None and row['size'] == size:
+        link_file(row['path'], path)
+    manifest.put_content(path, sha256=sha256, size=size,
+                         host=_parse.urlparse(str(response_url)).netloc, etag=strong_etag(headers))
+
+
+# ---- Partial files ---- #
+def resume_range(task: TaskInfo) -> (dict, int):
+    # Range headers to continue an interrupted transfer, and the offset to continue from
+    partial = manifest.get_partial(task.url)
+    if partial is None:
+        return {}, 0
+    validator = partial['etag'] or partial['last_modified']
+    part = os.path.join(task.download_path, resolve_filename(task, partial['response_url'])) + '.part'
+    if validator is None or not os.path.exists(part):
+        return {}, 0
+    offset = os.path.getsize(part)
+    return {'Range': f'bytes={offset}-', 'If-Range': validator}, offset
+
+
+def can_resume(task: TaskInfo, status, headers) -> bool:
+    # The server must answer with a range of the very same version of the file
+    partial = manifest.get_partial(task.url)
+    return status == 206 and partial is not None \
+        and headers.get('ETag') == partial['etag'] \
+        and headers.get('Last-Modified') == partial['last_modified']
+
+
+def open_part(task: TaskInfo, response_url, headers, path, offset) -> StreamWriter:
+    part = path + '.part'
+    digest = hashlib.sha256()
+    if offset:
+        fd = open(part, mode='r+b')
+        for chunk in iter(lambda: fd.read(1 << 20), b''):
+            digest.update(chunk)
+        fd.seek(offset)
+        fd.truncate()
+    else:
+        manifest.put_partial(task.url,
+                             response_url=str(response_url),
+                             etag=headers.get('ETag'),
+                             last_modified=headers.get('Last-Modified'))
+        fd = open(part, mode='wb')
+    return StreamWriter(fd, digest, _planner.transfer_size(headers), on_write=task.progress)
+
+
+def finish_part(task: TaskInfo, path):
+    os.replace(path + '.part', path)
+    manifest.drop_partial(task.url)
+
+
+# ---- Segments ---- #
+SEGMENT_CHUNK = 64 * 1024
+_segment_executor: _futures.ThreadPoolExecutor | None = None
+_segment_lock = threading.Lock()
+
+
+class SegmentWriter:
+    # Positioned writes of the byte range [start, end) into a shared file descriptor
+    def __init__(self, fd, start, end, on_write=None):
+        self.fd = fd
+        self.pos = start
+        self.start = start
+        self.end = end
+        self.on_write = on_write
+
+    def write(self, chunk) -> bool:
+        chunk = chunk[:self.end - self.pos]
+        os.pwrite(self.fd, chunk, self.pos)
+        self.pos += len(chunk)
+        if self.on_write is not None:
+            self.on_write(len(chunk))
+        return self.pos >= self.end
+
+    def check(self):
+        if self.pos != self.end:
+            raise taskexception.DownloadException(f'Truncated segment {self.start}-{self.end - 1}')
+
+
+def segment_length(status, headers) -> int | None:
+    # Length of the body if it is worth splitting and the server can serve ranges of this very version
+    length = headers.get('Content-Length')
+    if status != 200 or length is None or int(length) < SEGMENT_THRESHOLD:
+        return None
+    if headers.get('Accept-Ranges') != 'bytes' or segment_validator(headers) is None:
+        return None
+    return int(length)
+
+
+def segment_validator(headers):
+    return headers.get('ETag') or headers.get('Last-Modified')
+
+
+def segment_ranges(length, count=SEGMENT_COUNT) -> list[tuple[int, int]]:
+    size = -(-length // count)
+    return [(start, min(start + size, length)) for start in range(0, length, size)]
+
+
+def segment_headers(validator, start, end) -> dict:
+    return {'Range': f'bytes={start}-{end - 1}', 'If-Range': validator}
+
+
+def check_segment(status, headers, validator, start, end):
+    content_range = headers.get('Content-Range', '').split('/')[0]
+    if status != 206 or content_range != f'bytes {start}-{end - 1}' or segment_validator(headers) != validator:
+        raise taskexception.DownloadException(f'Segment {start}-{end - 1} not served, the file may have changed')
+
+
+def open_segmented(task: TaskInfo, path, length) -> int:
+    # Segments leave holes in the file, so it cannot be resumed from its size
+    manifest.drop_partial(task.url)
+    fd = os.open(path + '.part', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        preallocate(fd, 0, length)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def segment_executor() -> _futures.ThreadPoolExecutor:
+    global _segment_executor
+    with _segment_lock:
+        if _segment_executor is None:
+            _segment_executor = _futures.ThreadPoolExecutor(max_workers=SEGMENT_WORKERS)
+    return _segment_executor
+
+
+def segment_slots(task: TaskInfo) -> int:
+    # Requests for the segments beyond the first, only as many as the host has free slots for, so that
+    # a host held to a few requests is not sent all of them anyway
+    return host_limits.reserve(task.url, SEGMENT_COUNT - 1)
+
+
+def fetch_segment(task: TaskInfo, session, validator, fd, start, end):
+    with session.get(task.url, headers=segment_headers(validator, start, end), stream=True) as response:
+        check_segment(response.status_code, response.headers, validator, start, end)
+        writer = SegmentWriter(fd, start, end, task.progress)
+        for chunk in response.iter_content(chunk_size=SEGMENT_CHUNK):
+            if writer.write(chunk):
+                break
+        writer.check()
+
+
+def download_segmented(task: TaskInfo, session, response, path, length) -> str:
+    validator = segment_validator(response.headers)
+    # The file first, so that the host slots are only taken once nothing but the transfers can fail
+    fd = open_segmented(task, path, length)
+    slots = 0
+    try:
+        slots = segment_slots(task)
+        ranges = segment_ranges(length, slots + 1)
+        futures = [segment_executor().submit(fetch_segment, task, session, validator, fd, start, end)
+                   for start, end in ranges[1:]]
+        # The response already streams from byte 0, so it serves the first segment
+        try:
+            writer = SegmentWriter(fd, *ranges[0], task.progress)
+            for chunk in response.iter_content(chunk_size=SEGMENT_CHUNK):
+                if writer.write(chunk):
+                    break
+            writer.check()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            response.close()
+            _futures.wait(futures)
+        for future in futures:
+            future.result()
+    finally:
+        os.close(fd)
+        for _ in range(slots):
+            host_limits.release(task.url)
+    os.replace(path + '.part', path)
+    return file_sha256(path)
+
+
+class Extractor:
+    # Unzips the downloaded archives in worker processes, while the downloads go on
+    def __init__(self, workers):
+        self.workers = workers
+        self.console = console
+        self._executor: _futures.ProcessPoolExecutor | None = None
+        self._progress: 'BoxProgress | None' = None
+        self._task = None
+        self._started = 0.0
+        self._submitted = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def attach(self, progress: 'BoxProgress'):
+        self._progress = progress
+        self.console = progress.console
+
+    def submit(self, task: TaskInfo, filename, path):
+        # The unzip time goes to the record of the transfer that downloaded the archive
+        record = _metrics.current()
         out_dir = os.path.join(task.download_path, re.sub(r'\.[^.]*$', '', filename, count=1))
-        if not os.path.exists(out_dir):
-            os.mkdir(out_dir)
-
-        unzipped = False
-        if filename.endswith('zip'):
-            with zipfile.ZipFile(path) as zf:
-                zi = zf.infolist()
-                for member in zi:
-                    member.filename = member.filename.encode('cp437').decode('gbk')
-                    zf.extract(member, path=out_dir)
-            unzipped = True
-        elif filename.endswith('rar'):
-            try:
-                with rarfile.RarFile(path) as rf:
-                    ri = rf.infolist()
-                    for member in ri:
-                        rf.extract(member, path=out_dir)
-                unzipped = True
-            except Exception as e:
-                my_console.print(f'[red]Got error: {e}')
-                if os.uname().sysname == 'Darwin':
-                    my_console.print('Try install unrar on your mac: \nbrew install carlocab/personal/unrar')
-        if unzipped:
-            my_console.print(f'< [white]Unzipped: {filename}')
-
-    response.close()
+        with self._lock:
+            if self._executor is None:
+                # Forking would copy the locks held by the download threads, so workers are spawned
+                self._executor = _futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                              mp_context=multiprocessing.get_context('spawn'))
+                self._started = time.perf_counter()
+                self._submitted = 0
+                self._bytes = 0
+            self._submitted += 1
+            if self._progress is not None:
+                if self._task is None:
+                    self._task = self._progress.add_task('Extracting...', total=0)
+                self._progress.update(self._task, total=self._submitted)
+            future = self._executor.submit(archive.extract, path, out_dir)
+        future.add_done_callback(functools.partial(self.__done, filename, record))
+
+    def __done(self, filename, record, future: _futures.Future):
+        error = future.exception()
+        if error is None:
+            extracted, skipped, size, seconds = future.result()
+            if record is not None:
+                record.unzip = seconds
+            self.console.print(f'< [white]Unzipped: {filename} '
+                               f'({extracted} extracted, {skipped} unchanged)')
+        else:
+            self.console.print(f'[red]Got error: {error}')
+            # The archive was downloaded, but the run did not deliver its files
+            headless.error(f'Unzip failed: {filename}: {error}')
+            if filename.endswith('rar') and os.uname().sysname == 'Darwin':
+                self.console.print('Try install unrar on your mac: \nbrew install carlocab/personal/unrar')
+            size = 0
+        with self._lock:
+            self._bytes += size
+            if self._task is not None:
+                self._progress.update(self._task, advance=1, description=f'Extracting... {self.__rate()}')
+
+    def __rate(self):
+        elapsed = time.perf_counter() - self._started
+        return f'{self._bytes / max(elapsed, 1e-6) / 1024 / 1024:.1f} MB/s'
+
+    def wait(self):
+        # Archives still being extracted when the downloads are over are waited for
+        with self._lock:
+            executor = self._executor
+        if executor is None:
+            return
+        executor.shutdown(wait=True)
+        with self._lock:
+            self._executor = None
+            if self._task is not None:
+                self._progress.update(self._task, description=f'[green]Extracted {self.__rate()}')
+            self._progress = None
+            self._task = None
+            self.console = console
+
+
+extractor = Extractor(EXTRACT_WORKERS)
+
+
+def need_unzip(task: TaskInfo, filename) -> bool:
+    return task.unzip and re.match(r'.*(rar|zip)$', filename) is not None
+
+
+# ---- Steps of a download, shared by both engines, which only do the requests and the reads ---- #
+def plan_known(task: TaskInfo):
+    # What the manifest tells about the local copy: (record, filename, changed), record None if there is none.
+    # changed is None when only a conditional request can tell, see revalidate.
+    known, filename = find_known(task)
+    if known is None or not task.incremental:
+        return known, filename, False
+    unchanged = listed_unchanged(task, known)
+    return known, filename, None if unchanged is None else not unchanged
+
+
+def keep_known(task: TaskInfo, known, changed) -> bool:
+    # Whether the local copy is kept as it is, without fetching the body
+    if known is None or changed or (task.update and not task.incremental):
+        return False
+    manifest.touch(task.url)
+    return True
+
+
+def resumed_offset(task: TaskInfo, offset, status, headers) -> int | None:
+    # Offset the response to a resuming request continues from, or None if the file has to be asked for
+    # again without a range
+    if not offset or can_resume(task, status, headers):
+        return offset
+    return 0 if status == 200 else None
+
+
+def plan_update(task: TaskInfo, offset, changed, status, response_url, headers, path):
+    # What to do with the body: (updated, sha256, length). sha256 is set when the content was linked from a
+    # stored copy, without reading the body. length is set when the body is fetched in segments.
+    if not (offset or task.update or changed or not os.path.exists(path)):
+        return False, None, None
+    if offset == 0 and status == 200:
+        sha256 = link_known(task, response_url, headers, path)
+        if sha256 is not None:
+            return True, sha256, None
+    return True, None, segment_length(status, headers) if offset == 0 else None
+
+
+def finish_stream(task: TaskInfo, record: _metrics.Transfer, writer: StreamWriter, headers, path) -> str:
+    # Once the body went through writer: the .part file becomes the file, returns its hash
+    record.bytes = writer.written
+    record.write = writer.write_time
+    check_complete(headers, writer.written, task.url)
+    finish_part(task, path)
+    return writer.digest.hexdigest()
+
+
+def finish_download(task: TaskInfo, response_url, headers, filename, path, updated, linked, sha256):
+    if updated and not linked:
+        store_file(response_url, headers, path, sha256)
+    record_file(task, response_url, headers, filename, path, sha256)
+    if updated and need_unzip(task, filename):
+        extractor.submit(task, filename, path)
+
+
+def download_doc(task: TaskInfo, my_console=console) -> (str, bool):
+    with metrics.transfer('file', task.url, task.group) as record:
+        record.attempt = task.attempts
+        return _download_doc(task, record)
+
+
+def _download_doc(task: TaskInfo, record: _metrics.Transfer) -> (str, bool):
+    session = task.session
+
+    # ---- Plan from manifest ---- #
+    response = None
+    known, filename, changed = plan_known(task)
+    if known is not None and changed is None:
+        response = revalidate(task, session, known, os.path.join(task.download_path, filename))
+        changed = response is not None
+    if keep_known(task, known, changed):
+        return filename, False
+
+    offset = 0
+    if response is None:
+        headers, offset = resume_range(task)
+        response = session.get(task.url, headers=headers, stream=True)
+        offset = resumed_offset(task, offset, response.status_code, response.headers)
+        if offset is None:
+            offset = 0
+            response.close()
+            response = session.get(task.url, stream=True)
+    with response:
+        check_status(response.status_code, response.headers, task.url)
+        filename = resolve_filename(task, response.url)
+        path = os.path.join(task.download_path, filename)
+
+        # ---- Update ---- #
+        updated, sha256, length = plan_update(task, offset, changed, response.status_code, response.url,
+                                              response.headers, path)
+        linked = sha256 is not None
+        if updated and not linked:
+            if length is not None:
+                sha256 = download_segmented(task, session, response, path, length)
+                record.bytes = length
+            else:
+                response.raw.decode_content = True
+                with open_part(task, response.url, response.headers, path, offset) as writer:
+                    writer.copy(response.raw)
+                sha256 = finish_stream(task, record, writer, response.headers, path)
+    finish_download(task, response.url, response.headers, filename, path, updated, linked, sha256)
     return filename, updated
 
 
-def parallel_process(queue: list[TaskInfo]):
-    failed = 0
-    with BoxProgress(
-            _progress.TextColumn("[progress.description]{task.description}"),
-            _progress.SpinnerColumn(),
-            _progress.BarColumn(),
-            _progress.TaskProgressColumn(),
-            _progress.TimeElapsedColumn(),
-    ) as progress, \
-            _futures.ThreadPoolExecutor(max_workers=32) as executor:
-        # ---- Setup workers ---- #
-        completed, total = 0, len(queue)
-        task = progress.add_task('Downloading...', total=total)
-        futures = []
-        for t_info in queue:
-            futures.append(executor.submit(download_doc, t_info, progress.console))
-        # ---- Working Loop ---- #
-        file_list = []
-        while completed < total:
-            done, not_done = _futures.wait(futures, return_when=_futures.FIRST_COMPLETED)
-            # ---- Gather results ---- #
-            for future in done:
-                if future.exception() is None:
-                    name, updated = future.result()
-                    file_list.append((name, updated))
-                    progress.console.print(f'< [white]{"Downloaded" if updated else "Existed"}: {name}')
+def new_progress() -> 'BoxProgress':
+    import boxprogress
+    # Headless runs keep the counts but never draw the panel
+    return boxprogress.new_progress(console, disable=headless.enabled)
+
+
+def task_entry(t_info: TaskInfo) -> dict:
+    # What it takes to run the task without discovering it, in another run, process or machine
+    return {'url': t_info.url, 'download_path': t_info.download_path, 'filename': t_info.filename,
+            'order': t_info.order, 'update': t_info.update, 'unzip': t_info.unzip,
+            'incremental': t_info.incremental, 'group': t_info.group, 'modified': t_info.modified,
+            'size': t_info.size, 'cookies': t_info.session.cookies.get_dict()}
+
+
+def failed_entry(t_info: TaskInfo, error) -> dict:
+    # What --retry-failed needs to run the task again. The file stays around, so the cookies are left out:
+    # the tasks get the session of their host that the next run logs in with, see get_session
+    entry = {**task_entry(t_info), 'error': str(error)}
+    del entry['cookies']
+    return entry
+
+
+def task_from_entry(entry: dict) -> TaskInfo:
+    t_info = TaskInfo(entry['download_path'], entry['url'], entry['filename'], entry['order'],
+                      entry.get('cookies'), entry['update'], entry['unzip'], entry['incremental'])
+    t_info.group = entry['group']
+    t_info.modified = entry.get('modified')
+    t_info.size = entry.get('size')
+    return t_info
+
+
+def retry_failed(use_async=False):
+    # Runs the failed tasks again as they were, without fetching any index page
+    tasks = load_failed()
+    console.print(_panel.Panel(f'{len(tasks)} failed file{"s" if len(tasks) != 1 else ""} to retry.'),
+                  style='green')
+    if len(tasks) > 0:
+        parallel_process(tasks, use_async)
+
+
+def print_changed():
+    # Files whose content hash changed since the last run started, from the manifest only
+    rows = manifest.changed_since_last_run()
+    if headless.enabled:
+        for row in rows:
+            headless.log(f'Changed: {row["url"]}')
+        return
+    table = _table.Table(title=f'{len(rows)} file{"s" if len(rows) != 1 else ""} changed in the last run',
+                         expand=True)
+    table.add_column('URL')
+    table.add_column('Size', justify='right')
+    table.add_column('Changed', justify='right')
+    for row in rows:
+        size = '' if row['size'] is None else _filesize.decimal(row['size'])
+        table.add_row(escape(row['url']), size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['changed_at'])))
+    console.print(table)
+
+
+def load_failed() -> list[TaskInfo]:
+    return [task_from_entry(entry) for entry in failed_tasks.load()]
+
+
+class ProgressBook:
+    # Results of a run, shown in the progress panel. With groups, each group also gets its own row
+    # and its [success, failed] counts. on_done: called with each task and its error, or None, once over.
+    def __init__(self, progress: 'BoxProgress', total=None, groups: dict[str, list[int]] | None = None,
+                 on_done: Callable[[TaskInfo, Exception | None], None] | None = None):
+        self.progress = progress
+        self.task = progress.add_task('Downloading...', total=total)
+        self.groups = groups
+        self.on_done = on_done
+        self.completed = 0
+        self.failed = 0
+        self.downloaded = 0
+        # Row of the bytes of the files whose size is known, and their total
+        self._bytes = None
+        self._bytes_total = 0
+        self._rows: dict[str, tuple] = {}
+        self._failures: list[dict] = []
+        self._successes: list[tuple] = []
+        self._lock = threading.Lock()
+
+    def add(self, t_info: TaskInfo):
+        if t_info.size:
+            self.__count_bytes(t_info)
+        if self.groups is None or t_info.group is None:
+            return
+        with self._lock:
+            if t_info.group not in self._rows:
+                self.groups.setdefault(t_info.group, [0, 0])
+                self._rows[t_info.group] = (self.progress.add_task(f'  {t_info.group}', total=0), [0])
+            row, added = self._rows[t_info.group]
+            added[0] += 1
+            self.progress.update(row, total=added[0])
+
+    def __count_bytes(self, t_info: TaskInfo):
+        t_info.received = 0
+        t_info.progress = functools.partial(self.__received, t_info)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self.progress.add_task('Transferring...', total=0, bytes=True)
+            self._bytes_total += t_info.size
+            self.progress.update(self._bytes, total=self._bytes_total)
+
+    def __received(self, t_info: TaskInfo, n):
+        # Called by the writers, segments of one file are written by several threads
+        with self._lock:
+            t_info.received += n
+        self.progress.advance(self._bytes, n)
+
+    def done(self, t_info: TaskInfo, result=None, error=None):
+        if headless.enabled:
+            if error is not None:
+                headless.log(f'Failed: {t_info.url}: {error}')
+        elif error is None:
+            name, updated = result
+            self.progress.console.print(f'< [white]{"Downloaded" if updated else "Existed"}: {name}')
+        else:
+            self.progress.console.print(f'[red]{error}')
+        with self._lock:
+            self.completed += 1
+            self.failed += error is not None
+            self.downloaded += error is None and result[1]
+            if error is None:
+                self._successes.append((t_info.url, t_info.download_path))
+            else:
+                self._failures.append(failed_entry(t_info, error))
+            if t_info.group in self._rows:
+                self.groups[t_info.group][error is not None] += 1
+                self.progress.advance(self._rows[t_info.group][0])
+        if t_info.progress is not None:
+            # Skipped files, retried bytes and sizes that were off end up with their planned size
+            t_info.progress = None
+            self.progress.advance(self._bytes, t_info.size - t_info.received)
+        self.progress.advance(self.task)
+        if self.on_done is not None:
+            self.on_done(t_info, error)
+
+    def retrying(self, t_info: TaskInfo, error, delay):
+        if headless.enabled:
+            headless.log(f'Retry {t_info.attempts} in {delay:.1f}s: {t_info.url}: {error}')
+            return
+        self.progress.console.print(f'[yellow]Retry {t_info.attempts} in {delay:.1f}s: {error}')
+
+    def finish(self, submitted):
+        self.progress.update(self.task, total=submitted, description='[green]Completed')
+        failed_tasks.update(self._failures, self._successes)
+        headless.add_run(self.completed - self.failed, self.failed, self.downloaded, self.groups)
+        if len(self._failures) > 0:
+            self.progress.console.print(f'[red]{len(self._failures)} failed, '
+                                        f'replay them with --retry-failed')
+
+    @property
+    def result(self):
+        return self.completed - self.failed, self.failed
+
+
+def print_host_report(my_console=console):
+    rows = host_limits.report()
+    if len(rows) == 0:
+        return
+    table = _table.Table(title='Concurrency per host', expand=True)
+    table.add_column('Host')
+    table.add_column('Converged', justify='right')
+    table.add_column('Peak', justify='right')
+    table.add_column('Responses', justify='right')
+    table.add_column('Throttled', style='red', justify='right')
+    for host, limit, peak, responses, throttled in rows:
+        table.add_row(escape(host), str(limit), str(peak), str(responses), str(throttled))
+    my_console.print(table)
+
+
+def iter_tasks(queue: Iterable[TaskInfo] | _queue.Queue) -> Iterator[TaskInfo]:
+    # A queue.Queue is read until it yields None
+    if isinstance(queue, _queue.Queue):
+        return iter(queue.get, None)
+    return iter(queue)
+
+
+def planned_size(task: TaskInfo) -> int | None:
+    # Bytes the task will transfer: none for the files kept as they are, else the size of the listing,
+    # of the copy in the manifest or of a HEAD request
+    known, _ = find_known(task)
+    if known is not None:
+        if not task.update and not task.incremental:
+            return 0
+        if task.incremental and listed_unchanged(task, known):
+            return 0
+        return task.size if task.size is not None else known['size']
+    if task.size is not None:
+        return task.size
+    with host_limits(task.url):
+        response = task.session.head(task.url, allow_redirects=True)
+    if not response.ok:
+        return None
+    return _planner.transfer_size(response.headers)
+
+
+def new_planner(args) -> _planner.Planner | None:
+    if not args.get('plan') and not args.get('priority'):
+        return None
+    return _planner.Planner(planned_size, args.get('priority') or ())
+
+
+def plan_tasks(queue: Iterable[TaskInfo] | _queue.Queue, planner: _planner.Planner) -> list[TaskInfo] | None:
+    # All the tasks, sized and ordered, or None if they do not fit on the disks
+    tasks = list(iter_tasks(queue))
+    with console.status(f'Planning {len(tasks)} files...'):
+        tasks = planner.plan(tasks)
+    shortage = planner.shortage(tasks)
+    for directory, needed, free in shortage:
+        message = f'Not enough space in {directory}: {_filesize.decimal(needed)} needed, ' \
+                  f'{_filesize.decimal(free)} free'
+        console.print(f'[red]{escape(message)}')
+        headless.abort(message)
+    if len(shortage) != 0:
+        return None
+    unknown = sum(t_info.size is None for t_info in tasks)
+    total = _filesize.decimal(sum(t_info.size or 0 for t_info in tasks))
+    console.print(f'{len(tasks)} files, {total} to download' + (f', {unknown} of unknown size' if unknown else ''))
+    headless.log(f'Planned {len(tasks)} files, {total}, {unknown} of unknown size')
+    return tasks
+
+
+def enqueue(queue: Iterable[TaskInfo] | _queue.Queue, path, planner: _planner.Planner | None = None) -> int:
+    # Discovery only, the tasks go to the shared work queue of the workers. They are written in batches
+    # as they are found, so that the workers can start before the discovery is over.
+    if planner is not None:
+        queue = plan_tasks(queue, planner)
+        if queue is None:
+            return 0
+    work_queue = _workqueue.WorkQueue(path)
+    queued = 0
+    batch = []
+    try:
+        for t_info in iter_tasks(queue):
+            batch.append(task_entry(t_info))
+            if len(batch) >= ENQUEUE_BATCH:
+                queued += work_queue.put(batch)
+                batch.clear()
+        queued += work_queue.put(batch)
+    finally:
+        work_queue.close()
+    headless.log(f'Queued {queued} files in {path}')
+    return queued
+
+
+def parallel_process(queue: Iterable[TaskInfo] | _queue.Queue, use_async=False, per_host=None, groups=None,
+                     planner: _planner.Planner | None = None, on_done=None):
+    if planner is not None:
+        # Nothing is transferred before every file is sized and the disks are checked
+        queue = plan_tasks(queue, planner)
+        if queue is None:
+            return 0, 0
+    if use_async:
+        import async_engine
+        return async_engine.parallel_process(queue, per_host=per_host, groups=groups, on_done=on_done)
+
+    try:
+        return _parallel_process(queue, per_host, groups, on_done)
+    finally:
+        extractor.wait()
+        # Also keeps the state of interrupted transfers, so that they can be resumed
+        manifest.save()
+
+
+def _parallel_process(queue: Iterable[TaskInfo] | _queue.Queue, per_host=None, groups=None, on_done=None):
+    host_limits.reset(per_host or MAX_WORKERS)
+    # Bounds the tasks submitted but not finished yet
+    window = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+    with new_progress() as progress, \
+            _futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        manifest.begin_run()
+        book = ProgressBook(progress, len(queue) if hasattr(queue, '__len__') else None, groups, on_done)
+        extractor.attach(progress)
+
+        def work(t_info: TaskInfo):
+            try:
+                with host_limits.held(t_info.url):
+                    return download_doc(t_info, progress.console)
+            finally:
+                host_queues.pump()
+
+        def start(t_info: TaskInfo):
+            executor.submit(work, t_info).add_done_callback(functools.partial(task_done, t_info))
+
+        # Tasks only reach the workers once their host has a free slot
+        host_queues = HostQueues(host_limits, start)
+
+        def submit(t_info: TaskInfo):
+            host_queues.put(t_info.url, t_info)
+
+        def task_done(t_info: TaskInfo, future: _futures.Future):
+            error = future.exception()
+            delay = None if error is None else retry_delay(t_info.attempts, error, NETWORK_ERRORS, TIMEOUT_ERRORS)
+            if delay is not None:
+                # The task keeps its place in the window until it is over
+                t_info.attempts += 1
+                book.retrying(t_info, error, delay)
+                timer = threading.Timer(delay, submit, (t_info,))
+                timer.daemon = True
+                timer.start()
+                return
+            try:
+                if error is None:
+                    book.done(t_info, result=future.result())
                 else:
-                    progress.console.print(f'[red]{future.exception()}')
-                    failed += 1
-                completed += 1
-            progress.update(task, completed=completed)
-            # Update futures
-            futures = list(not_done)
+                    book.done(t_info, error=error)
+            finally:
+                window.release()
+
+        try:
+            # ---- Feed workers ---- #
+            submitted = 0
+            for t_info in iter_tasks(queue):
+                window.acquire()
+                book.add(t_info)
+                submit(t_info)
+                submitted += 1
+
+            # ---- Wait for the window to drain ---- #
+            for _ in range(MAX_IN_FLIGHT):
+                window.acquire()
+        finally:
+            # After Ctrl+C, the tasks still waiting for their host are never started
+            host_queues.close(cancel=True)
+        extractor.wait()
 
         # ---- Fin ---- #
-        progress.update(task, description='[green]Completed')
+        book.finish(submitted)
 
-    success = len(queue) - failed
-    return success, failed
+    print_host_report()
+    return book.result
 
 
 class CrawlTask:
@@ -160,34 +1096,43 @@ class CrawlTask:
             cookies = {}
         self.args = args
         self.cookies = cookies
+        # Spinners are off when several tasks are collected concurrently
+        self.live = True
 
         self.url: str
+        self.pattern: re.Pattern | None = None
 
-        self.html_text: str
+        self.html_body: bytes
         self.download_path: str
         self.title: str
 
-        self.soup: bs4.BeautifulSoup
+        self.page: links.PageLinks
 
-    def __fetch_url(self):
-        # Fetch url
+    def __status(self, status):
+        return console.status(status) if self.live else contextlib.nullcontext()
+
+    def __ask_url(self):
         url = self.args['url']
+        if not url and headless.enabled:
+            headless.abort('No url given')
+            raise taskexception.TaskException()
         if not url:
             console.print(_panel.Panel('Please enter the url:'))
             url = console.input('> ')
 
         if not url.startswith('http'):
             url = 'https://' + url
+        self.url = url
 
+    def __fetch_url(self):
         # Fetch URL #
-        with console.status(f"Fetching {url}..."):
+        with self.__status(f"Fetching {self.url}..."):
             try:
-                response = requests.get(url, cookies=self.cookies)
-                self.html_text = response.content.decode('utf-8')
+                self.html_body = fetch_page(self.url, self.cookies)
             except requests.exceptions.RequestException as e:
                 console.print(f'[red]Fetch failed!\n{e}')
+                headless.error(f'Fetch failed: {self.url}: {e}')
                 raise taskexception.TaskException()
-        self.url = url
 
     def __load_ext(self):
         # Load extensions
@@ -195,7 +1140,7 @@ class CrawlTask:
         if not self.args['all']:
             if self.args['ex']:
                 extensions = self.args['ex']
-            else:
+            elif not headless.enabled:
                 console.print('Please enter file extensions\n(Separate with blank, no leading dot. Empty for all.):')
                 extensions = console.input('> ')
                 extensions = extensions.split()
@@ -220,6 +1165,7 @@ class CrawlTask:
             return re.compile(rf'.*\.{ext_str}$')
         except re.error as e:
             console.print(f'[red]Bad extensions: {ext}\nMessage: {e}')
+            headless.error(f'Bad extensions: {ext}: {e}')
             raise taskexception.TaskException()
 
     def __get_pattern_with_regex(self):
@@ -234,8 +1180,8 @@ class CrawlTask:
             return self.__get_pattern_with_regex()
 
     def __collect_docs(self):
-        self.soup = bs4.BeautifulSoup(self.html_text, 'html.parser')
-        self.title = self.soup.title.text
+        self.page = page_cache.links(self.html_body)
+        self.title = self.page.title
 
         # ---- Check whether download path is legal ---- #
         self.download_path = os.path.join(DOWNLOAD_PATH, self.title)
@@ -243,13 +1189,16 @@ class CrawlTask:
             self.download_path = self.args['dir']
             if not os.path.exists(self.download_path):
                 console.print(f'[red]Directory {self.download_path} not exists!')
+                headless.error(f'Directory {self.download_path} not exists')
                 raise taskexception.TaskException()
         else:
             if not os.path.exists(self.download_path):
                 os.makedirs(self.download_path)
 
         # Get Regex pattern
-        pat = self.__get_pattern()
+        if self.pattern is None:
+            self.pattern = self.__get_pattern()
+        pat = self.pattern
 
         # ---- Salutations ---- #
         console.print(_panel.Panel(
@@ -257,46 +1206,105 @@ class CrawlTask:
             renderable=f'[white]Will be saved at [underline]{escape(self.download_path)}[/underline]'
         ), style='dark_orange')
 
+        if self.args['depth'] > 0:
+            return self.__crawl_pages()
+
         # ---- Crawl all the documents' link ---- #
         url_map = {}
         order = 1
-        with console.status('Crawling documents...'):
-            tags = self.soup.find_all(name='a', href=pat)
+        with self.__status('Crawling documents...'):
+            tags = self.page.find_all('a', pat)
             if len(tags) == 0:
                 console.print('No document was found!')
                 return None
             for tag in tags:
-                furl = tag['href']
-                # Whether change names
-                name = None
-                this_order = ''
-                if self.args['name']:
-                    if tag.text.strip() != '':
-                        name = tag.text.strip()
-                    elif 'title' in tag.attrs:
-                        name = tag['title'].strip()
                 # Whether add order prefix
+                this_order = ''
                 if self.args['order']:
                     this_order = str(order) + '. '
                     order += 1
                 # Redirect URL
-                furl = _parse.urljoin(self.url, furl)
+                furl = _parse.urljoin(self.url, tag.url)
 
                 if furl not in url_map.keys():
-                    url_map[furl] = TaskInfo(self.download_path, furl, name, this_order,
-                                             self.cookies, self.args['update'], self.args['unzip'])
+                    url_map[furl] = self.__make_task(furl, tag, this_order)
 
         console.print(f'Found {len(url_map)} documents in total.')
         return list(url_map.values())
 
+    def __make_task(self, furl, tag: links.Link, this_order) -> TaskInfo:
+        # Whether change names
+        name = None
+        if self.args['name']:
+            if tag.text.strip() != '':
+                name = tag.text.strip()
+            elif tag.title is not None:
+                name = tag.title.strip()
+        return TaskInfo(self.download_path, furl, name, this_order,
+                        self.cookies, self.args['update'], self.args['unzip'],
+                        self.args['incremental'])
+
+    def __in_scope(self, url) -> bool:
+        if self.args['scope']:
+            return re.search(self.args['scope'], url) is not None
+        return _parse.urlsplit(url).netloc == _parse.urlsplit(_frontier.normalize_url(self.url, '')).netloc
+
+    def __page_failed(self, url, error):
+        console.print(f'[yellow]Skipped page {escape(url)}: {error}')
+        headless.log(f'Skipped page {url}: {error}')
+
+    def __crawl_pages(self) -> Iterator[TaskInfo]:
+        # Documents of the pages around the root page, handed to the downloads as the pages come in
+        session = get_session(self.url, self.cookies)
+        crawler = _frontier.Frontier(functools.partial(open_links, cookies=self.cookies, strict=True),
+                                     self.__in_scope,
+                                     self.args['depth'], _frontier.Politeness(session.get, self.args['delay']),
+                                     DISCOVERY_WORKERS, follow=lambda link: self.pattern.search(link.url) is None,
+                                     on_error=self.__page_failed)
+        seen = _frontier.VisitedSet()
+        found = pages = 0
+        for page_url, page in crawler.crawl(self.url, self.page):
+            pages += 1
+            for tag in page.find_all('a', self.pattern):
+                furl = _parse.urljoin(page_url, tag.url)
+                if not seen.add(furl):
+                    continue
+                found += 1
+                yield self.__make_task(furl, tag, f'{found}. ' if self.args['order'] else '')
+        console.print(f'Found {found} documents on {pages} pages in total.')
+
+    def prepare(self):
+        # Asks for whatever is missing, so that several tasks can then be collected concurrently
+        self.__ask_url()
+        self.pattern = self.__get_pattern()
+        self.live = False
+
+    def collect(self, sink: Callable[[TaskInfo], None] | None = None) -> Iterable[TaskInfo] | None:
+        # The tasks of the page, or with --depth those of the pages around it as they are found. With sink,
+        # they are handed to it instead, and the pages are crawled here, within the discovery record.
+        with metrics.transfer('discovery', self.url, self.args.get('preset')) as record:
+            self.__fetch_url()
+            started = time.perf_counter()
+            queue = self.__collect_docs()
+            record.parse = time.perf_counter() - started
+            if sink is not None:
+                for t_info in queue or []:
+                    sink(t_info)
+                return None
+        return queue
+
     def run(self):
         console.print()
 
-        self.__fetch_url()
-        queue = self.__collect_docs()
+        self.__ask_url()
+        queue = self.collect()
         if queue is None:
             return
-        success, failed = parallel_process(queue)
+        if self.args.get('enqueue'):
+            queued = enqueue(queue, self.args['enqueue'], new_planner(self.args))
+            console.print(_panel.Panel(f'{queued} files queued in {escape(self.args["enqueue"])}'), style='green')
+            return
+        success, failed = parallel_process(queue, self.args['use_async'], planner=new_planner(self.args))
 
         columns = _columns.Columns(expand=True)
         columns.add_renderable(_panel.Panel(f'{success}', title='Success', style='green'))
@@ -304,3 +1312,64 @@ class CrawlTask:
         console.print(columns, justify='center')
 
         console.rule('[light_slate_blue bold italic]Task complete![/]', style='light_slate_blue')
+
+
+def run_all(arg_list: list[dict]):
+    # Presets are collected concurrently and feed one download scheduler
+    crawls = [CrawlTask(args) for args in arg_list]
+    for crawl in crawls:
+        crawl.prepare()
+
+    def discovered():
+        # The jobs hand over their tasks as they find them, the recursive crawls included, so that one
+        # preset never holds the others back. Each job ends with its future.
+        found = _queue.Queue()
+        seen = set()
+
+        def discover(crawl: CrawlTask):
+            crawl.collect(lambda t_info: found.put((crawl, t_info)))
+
+        def finished(crawl: CrawlTask, future: _futures.Future):
+            found.put((crawl, future))
+
+        with _futures.ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+            for crawl in crawls:
+                executor.submit(discover, crawl).add_done_callback(functools.partial(finished, crawl))
+            running = len(crawls)
+            while running > 0:
+                crawl, item = found.get()
+                if isinstance(item, _futures.Future):
+                    running -= 1
+                    if (e := item.exception()) is not None:
+                        console.print(f'[red]{crawl.args["preset"]}: {e or "Failed"}')
+                        if not isinstance(e, taskexception.TaskException):
+                            headless.error(f'{crawl.args["preset"]}: {e}')
+                    continue
+                # The same file for the same directory is only downloaded once
+                if (item.url, item.download_path) in seen:
+                    continue
+                seen.add((item.url, item.download_path))
+                item.group = crawl.args['preset']
+                yield item
+
+    console.print()
+    if arg_list[0].get('enqueue'):
+        queued = enqueue(discovered(), arg_list[0]['enqueue'], new_planner(arg_list[0]))
+        console.print(_panel.Panel(f'{queued} files queued in {escape(arg_list[0]["enqueue"])}'), style='green')
+        return
+    # Presets whose files were all found by another one still get their row
+    groups = {crawl.args['preset']: [0, 0] for crawl in crawls}
+    success, failed = parallel_process(discovered(), arg_list[0]['use_async'], groups=groups,
+                                       planner=new_planner(arg_list[0]))
+
+    table = _table.Table(expand=True)
+    table.add_column('Preset')
+    table.add_column('Success', style='green', justify='right')
+    table.add_column('Failed', style='red', justify='right')
+    for name, (group_success, group_failed) in groups.items():
+        table.add_row(escape(name), str(group_success), str(group_failed))
+    table.add_section()
+    table.add_row('Total', str(success), str(failed))
+    console.print(table)
+
+    console.rule('[light_slate_blue bold italic]Task complete![/]', style='light_slate_blue')
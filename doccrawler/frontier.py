@@ -0,0 +1,160 @@
+import collections
+import hashlib
+import threading
+import time
+import urllib.robotparser
+from collections.abc import Callable, Iterator
+from concurrent import futures as _futures
+from urllib import parse as _parse
+
+import links
+
+# Paths followed as pages, anything else with an extension is left to the document pattern
+PAGE_EXTENSIONS = ('', '.html', '.htm', '.shtml', '.php', '.asp', '.aspx', '.jsp')
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(base, href) -> str | None:
+    # Absolute URL without fragment, scheme and host in lower case and without the default port.
+    # None for what cannot be fetched, e.g. mailto: or javascript: links.
+    url, _ = _parse.urldefrag(_parse.urljoin(base, href.strip()))
+    parts = _parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname.lower()
+    if parts.port is not None and parts.port != _DEFAULT_PORTS[scheme]:
+        netloc += f':{parts.port}'
+    return _parse.urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def is_page(url) -> bool:
+    name = _parse.urlsplit(url).path.rsplit('/', 1)[-1]
+    ext = name[name.rfind('.'):].lower() if '.' in name else ''
+    return ext in PAGE_EXTENSIONS
+
+
+class VisitedSet:
+    # 8-byte BLAKE2b digests of the URLs instead of the URLs themselves, a fraction of the memory on
+    # large sites. A collision is unlikely below billions of URLs, and it would only skip one page.
+    def __init__(self):
+        self._digests: set[int] = set()
+
+    def add(self, url) -> bool:
+        # True if the URL was not seen before
+        digest = int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), 'little')
+        if digest in self._digests:
+            return False
+        self._digests.add(digest)
+        return True
+
+    def __len__(self):
+        return len(self._digests)
+
+
+class Politeness:
+    # robots.txt rules and the delay between two pages of the same host, the larger of `delay` and
+    # the Crawl-delay of robots.txt. get: fetches a URL, e.g. with the pooled session of its host.
+    def __init__(self, get: Callable, delay=0.0, user_agent='*'):
+        self.get = get
+        self.delay = delay
+        self.user_agent = user_agent
+        self._robots: dict[str, urllib.robotparser.RobotFileParser] = {}
+        self._next: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __rules(self, url) -> urllib.robotparser.RobotFileParser:
+        parts = _parse.urlsplit(url)
+        with self._lock:
+            rules = self._robots.get(parts.netloc)
+        if rules is not None:
+            return rules
+        rules = urllib.robotparser.RobotFileParser()
+        try:
+            response = self.get(f'{parts.scheme}://{parts.netloc}/robots.txt')
+        except Exception:
+            response = None
+        # Same rules as RobotFileParser.read: 401/403 forbid everything, other errors allow everything
+        if response is None or response.status_code >= 500:
+            rules.allow_all = True
+        elif response.status_code in (401, 403):
+            rules.disallow_all = True
+        elif response.status_code >= 400:
+            rules.allow_all = True
+        else:
+            rules.parse(response.text.splitlines())
+        with self._lock:
+            return self._robots.setdefault(parts.netloc, rules)
+
+    def allowed(self, url) -> bool:
+        return self.__rules(url).can_fetch(self.user_agent, url)
+
+    def wait(self, url):
+        # Called by the fetching threads, each host gets one page per delay
+        rules = self.__rules(url)
+        delay = max(self.delay, float(rules.crawl_delay(self.user_agent) or 0))
+        if delay <= 0:
+            return
+        host = _parse.urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, 0.0))
+            self._next[host] = start + delay
+        if start > now:
+            time.sleep(start - now)
+
+
+class Frontier:
+    # Breadth-first crawl of the pages in scope up to max_depth links away from the root, with up to
+    # `workers` pages fetched at once. Pages are yielded as soon as they are parsed.
+    # fetch: URL -> PageLinks, follow: whether a link is worth fetching as a page at all
+    def __init__(self, fetch: Callable[[str], links.PageLinks], scope: Callable[[str], bool], max_depth,
+                 politeness: Politeness, workers, follow: Callable[[links.Link], bool] = lambda link: True,
+                 on_error: Callable[[str, Exception], None] = lambda url, error: None):
+        self.fetch = fetch
+        self.scope = scope
+        self.max_depth = max_depth
+        self.politeness = politeness
+        self.workers = workers
+        self.follow = follow
+        self.on_error = on_error
+        self.visited = VisitedSet()
+
+    def __fetch(self, url) -> links.PageLinks:
+        self.politeness.wait(url)
+        return self.fetch(url)
+
+    def __links(self, page_url, page: links.PageLinks) -> Iterator[str]:
+        for link in page.links:
+            if link.tag != 'a' or not self.follow(link):
+                continue
+            url = normalize_url(page_url, link.url)
+            if url is None or not is_page(url) or not self.scope(url) or not self.visited.add(url):
+                continue
+            if self.politeness.allowed(url):
+                yield url
+
+    def crawl(self, root_url, root_page: links.PageLinks) -> Iterator[tuple[str, links.PageLinks]]:
+        self.visited.add(normalize_url(root_url, '') or root_url)
+        yield root_url, root_page
+        if self.max_depth <= 0:
+            return
+        # Found but not submitted yet, so that at most `workers` pages wait in the executor
+        waiting = collections.deque((url, 1) for url in self.__links(root_url, root_page))
+        pending: dict[_futures.Future, tuple[str, int]] = {}
+        with _futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(waiting) != 0 or len(pending) != 0:
+                while len(waiting) != 0 and len(pending) < self.workers:
+                    url, depth = waiting.popleft()
+                    pending[executor.submit(self.__fetch, url)] = (url, depth)
+                done, _ = _futures.wait(pending, return_when=_futures.FIRST_COMPLETED)
+                for future in done:
+                    url, depth = pending.pop(future)
+                    try:
+                        page = future.result()
+                    except Exception as e:
+                        self.on_error(url, e)
+                        continue
+                    yield url, page
+                    if depth < self.max_depth:
+                        waiting.extend((link, depth + 1) for link in self.__links(url, page))
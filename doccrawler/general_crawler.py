@@ -1,17 +1,54 @@
 #!/usr/bin/env python3
 
 import os.path
+import sys
 
 import yaml
 from rich import panel as _panel, prompt as _prompt
 
 import const
 import engine
+import taskexception
+import watch as _watch
 from engine import get_arg_parser
 
 
+def select_presets(args, websites: dict) -> list[dict]:
+    # Presets named with --preset, or all of them
+    names = args['presets'] or list(websites.keys())
+    arg_list = []
+    for name in names:
+        if name not in websites:
+            engine.headless.error(f'Unknown preset: {name}')
+            const.console.print(f'[red]Unknown preset: {name}')
+            continue
+        tmp_args = args.copy()
+        for key, val in websites[name].items():
+            tmp_args[key] = val
+        tmp_args['preset'] = name
+        arg_list.append(tmp_args)
+    return arg_list
+
+
 def load_config(args) -> list[dict] | None:
     # Load config
+    if not args['url'] and (args['presets'] or args['headless']):
+        config_dict = {}
+        if os.path.exists(const.GENERAL_CONFIG_PATH):
+            with open(const.GENERAL_CONFIG_PATH, 'r') as fd:
+                config_dict = yaml.safe_load(fd) or {}
+        websites = config_dict.get('websites') or {}
+        if len(websites) == 0:
+            engine.headless.abort('No url given and no preset in the config')
+            return []
+        arg_list = select_presets(args, websites)
+        if len(arg_list) == 0:
+            engine.headless.abort()
+        elif len(arg_list) == 1:
+            # A single preset runs like before, with its own result panel
+            del arg_list[0]['preset']
+        return arg_list
+
     if not args['url']:
         config_dict = {}
         if os.path.exists(const.GENERAL_CONFIG_PATH):
@@ -33,14 +70,7 @@ def load_config(args) -> list[dict] | None:
 
             choice = _prompt.IntPrompt.ask('Choose one', choices=choices, default=0, show_choices=False)
             if choice == len(choices) - 1:
-                arg_list = []
-                for i in range(1, len(entries) - 1):
-                    web_config = entries[i][1]
-                    tmp_args = args.copy()
-                    for key, val in web_config.items():
-                        tmp_args[key] = val
-                    arg_list.append(tmp_args)
-                return arg_list
+                return select_presets(args, config_dict['websites'])
             elif choice != 0:
                 web_config = entries[choice][1]
                 for key, val in web_config.items():
@@ -48,25 +78,59 @@ def load_config(args) -> list[dict] | None:
     return [args]
 
 
+def watch(multi_args: list[dict]):
+    watcher = _watch.Watcher(multi_args[0]['use_async'], multi_args[0]['watch'])
+    for args in multi_args:
+        crawl = engine.CrawlTask(args)
+        crawl.prepare()
+        watcher.add(args.get('preset') or crawl.url, crawl.collect)
+    watcher.run()
+
+
 def driver():
-    const.console.clear()
+    parser = get_arg_parser()
+    args = vars(parser.parse_args())
+    if args['headless']:
+        engine.headless.start()
+    else:
+        const.console.clear()
     const.console.print(_panel.Panel(
         'Presented by [bold italic]NintenSAGA',
         title='[bold italic]DocCrawler',
         subtitle='Note: Use CLI args for full functions', expand=True,
         title_align='center'), style='green')
 
-    parser = get_arg_parser()
-    args = vars(parser.parse_args())
+    with engine.metrics.capture(args['metrics'], args['profile'], args['tracemalloc']):
+        crawl(args)
+    if args['headless']:
+        sys.exit(engine.headless.finish())
+
+
+def crawl(args):
+    if args['changed']:
+        engine.print_changed()
+        return
+    if args['retry_failed']:
+        engine.retry_failed(args['use_async'])
+        const.console.rule('[green bold italic]All tasks complete![/]', style='green')
+        return
     multi_args = load_config(args)
     n = len(multi_args)
+    if n == 0:
+        return
 
     const.console.print(_panel.Panel(f'{n} task{"s" if n > 1 else ""} in total.'), style='green')
-    for single_args in multi_args:
-        try:
-            engine.CrawlTask(single_args).run()
-        except Exception as e:
-            const.console.print(f'Error: {e}')
+    try:
+        if args['watch'] is not None:
+            watch(multi_args)
+        elif n > 1:
+            # All presets share one scheduler, so that a slow site never holds the others back
+            engine.run_all(multi_args)
+        else:
+            engine.CrawlTask(multi_args[0]).run()
+    except Exception as e:
+        const.console.print(f'Error: {e}')
+        engine.headless.abort(None if isinstance(e, taskexception.TaskException) else f'Error: {e}')
     const.console.rule('[green bold italic]All tasks complete![/]', style='green')
 
 
@@ -0,0 +1,101 @@
+import json
+import sys
+import threading
+import time
+
+from const import LOG_FLUSH_INTERVAL, LOG_FLUSH_LINES, console
+
+# Exit codes of a headless run
+EXIT_OK = 0
+# Some files or presets failed, the rest was downloaded
+EXIT_FAILED = 1
+# Nothing could be crawled, e.g. the config is incomplete or the cookies were rejected
+EXIT_ERROR = 2
+
+
+class Headless:
+    # Unattended runs: nothing is rendered and nothing is asked. Errors and retries are logged to stderr
+    # in batches, and the run ends with one JSON summary on stdout.
+    def __init__(self, stream=None, interval=LOG_FLUSH_INTERVAL, lines=LOG_FLUSH_LINES):
+        self.enabled = False
+        self.stream = stream
+        self.interval = interval
+        self.lines = lines
+        self._buffer: list[str] = []
+        self._flushed = 0.0
+        self._started = 0.0
+        self._lock = threading.Lock()
+        self.success = 0
+        self.failed = 0
+        self.downloaded = 0
+        self.groups: dict[str, list[int]] = {}
+        self.errors: list[str] = []
+        self.aborted = False
+
+    def start(self):
+        self.enabled = True
+        # Panels, tables and per-file lines of the shared console are dropped
+        console.quiet = True
+        self._started = self._flushed = time.monotonic()
+
+    def log(self, message):
+        if not self.enabled:
+            return
+        line = f'{time.strftime("%Y-%m-%d %H:%M:%S")} {message}'
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.lines and time.monotonic() - self._flushed < self.interval:
+                return
+            self.__flush()
+
+    def __flush(self):
+        # Callers hold the lock
+        if len(self._buffer) != 0:
+            stream = self.stream or sys.stderr
+            stream.write('\n'.join(self._buffer) + '\n')
+            stream.flush()
+            self._buffer.clear()
+        self._flushed = time.monotonic()
+
+    def error(self, message):
+        # Something other than a file failed, e.g. the index page of a preset
+        self.errors.append(str(message))
+        self.log(f'ERROR {message}')
+
+    def abort(self, message=None):
+        # The run could not go on, the message may already have been logged
+        if message is not None:
+            self.error(message)
+        self.aborted = True
+
+    def add_run(self, success, failed, downloaded, groups=None):
+        with self._lock:
+            self.success += success
+            self.failed += failed
+            self.downloaded += downloaded
+            for name, (group_success, group_failed) in (groups or {}).items():
+                counts = self.groups.setdefault(name, [0, 0])
+                counts[0] += group_success
+                counts[1] += group_failed
+
+    @property
+    def exit_code(self):
+        if self.aborted:
+            return EXIT_ERROR
+        if self.failed > 0 or len(self.errors) > 0:
+            return EXIT_FAILED
+        return EXIT_OK
+
+    def summary(self) -> dict:
+        return {'exit_code': self.exit_code, 'seconds': round(time.monotonic() - self._started, 3),
+                'success': self.success, 'failed': self.failed, 'downloaded': self.downloaded,
+                'existed': self.success - self.downloaded,
+                'groups': {name: {'success': s, 'failed': f} for name, (s, f) in self.groups.items()},
+                'errors': self.errors}
+
+    def finish(self) -> int:
+        # Flushes the log, prints the summary and returns the exit code
+        with self._lock:
+            self.__flush()
+        print(json.dumps(self.summary(), ensure_ascii=False))
+        return self.exit_code
@@ -0,0 +1,127 @@
+import re
+from html import parser as _parser
+
+_SECTION_ID = re.compile(r'section-[0-9]')
+
+
+class Link:
+    __slots__ = ('tag', 'url', 'text', 'title', 'type', 'section')
+
+    def __init__(self, tag, url, title, type_, section):
+        self.tag = tag
+        self.url = url
+        self.text = ''
+        self.title = title
+        self.type = type_
+        self.section = section
+
+
+class PageLinks:
+    # Title, anchors, video sources and Moodle sections of a page, gathered without building a tree
+    def __init__(self):
+        self.title: str | None = None
+        self.links: list[Link] = []
+        # Heading text -> section id, the last section wins like a dict built from the page
+        self.sections: dict[str, str] = {}
+
+    def find_all(self, tag, pattern, section=None) -> list[Link]:
+        # pattern is searched in the URL, as BeautifulSoup does for find_all(href=pattern)
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        section_id = None if section is None else self.sections[section]
+        return [link for link in self.links
+                if link.tag == tag and pattern.search(link.url) is not None
+                and (section is None or link.section == section_id)]
+
+    def find_source(self, type_) -> Link | None:
+        for link in self.links:
+            if link.tag == 'source' and link.type == type_:
+                return link
+        return None
+
+
+class LinkExtractor(_parser.HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.page = PageLinks()
+        self._anchor: Link | None = None
+        self._text: list[str] = []
+        self._in_title = False
+        self._title: list[str] = []
+        # li nesting depth, and the depth of the Moodle section being read
+        self._li_depth = 0
+        self._section: tuple[str, int] | None = None
+        self._heading: list[str] | None = None
+        self._section_named = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            attrs = dict(attrs)
+            if self._anchor is not None:
+                self.__close_anchor()
+            if attrs.get('href') is not None:
+                self._anchor = Link('a', attrs['href'], attrs.get('title'), None, self.__section_id())
+                self._text = []
+        elif tag == 'source':
+            attrs = dict(attrs)
+            if attrs.get('src') is not None:
+                self.page.links.append(Link('source', attrs['src'], None, attrs.get('type'), self.__section_id()))
+        elif tag == 'li':
+            self._li_depth += 1
+            section_id = dict(attrs).get('id')
+            if self._section is None and section_id is not None and _SECTION_ID.search(section_id):
+                self._section = (section_id, self._li_depth)
+                self._section_named = False
+        elif tag == 'h3':
+            if self._section is not None and not self._section_named:
+                self._heading = []
+        elif tag == 'title':
+            self._in_title = self.page.title is None
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            if self._anchor is not None:
+                self.__close_anchor()
+        elif tag == 'li':
+            if self._section is not None and self._li_depth == self._section[1]:
+                self._section = None
+            self._li_depth = max(self._li_depth - 1, 0)
+        elif tag == 'h3':
+            if self._heading is not None:
+                self.page.sections[''.join(self._heading).strip()] = self._section[0]
+                self._heading = None
+                self._section_named = True
+        elif tag == 'title':
+            if self._in_title:
+                self.page.title = ''.join(self._title)
+                self._in_title = False
+
+    def handle_data(self, data):
+        if self._anchor is not None:
+            self._text.append(data)
+        if self._heading is not None:
+            self._heading.append(data)
+        if self._in_title:
+            self._title.append(data)
+
+    def close(self):
+        super().close()
+        if self._anchor is not None:
+            self.__close_anchor()
+        if self._in_title:
+            self.page.title = ''.join(self._title)
+
+    def __section_id(self):
+        return None if self._section is None else self._section[0]
+
+    def __close_anchor(self):
+        self._anchor.text = ''.join(self._text)
+        self.page.links.append(self._anchor)
+        self._anchor = None
+
+
+def extract(html: str) -> PageLinks:
+    extractor = LinkExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.page
@@ -0,0 +1,203 @@
+import sqlite3
+import threading
+import time
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    url           TEXT PRIMARY KEY,
+    response_url  TEXT,
+    filename      TEXT,
+    size          INTEGER,
+    etag          TEXT,
+    last_modified TEXT,
+    length        TEXT,
+    sha256        TEXT,
+    last_seen     REAL,
+    changed_at    REAL,
+    modified      REAL
+);
+CREATE INDEX IF NOT EXISTS files_changed_at ON files (changed_at);
+CREATE TABLE IF NOT EXISTS partials (
+    url           TEXT PRIMARY KEY,
+    response_url  TEXT,
+    etag          TEXT,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS contents (
+    path    TEXT PRIMARY KEY,
+    sha256  TEXT,
+    size    INTEGER,
+    host    TEXT,
+    etag    TEXT
+);
+CREATE INDEX IF NOT EXISTS contents_sha256 ON contents (sha256);
+CREATE TABLE IF NOT EXISTS runs (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL
+);
+'''
+
+_FIELDS = ('response_url', 'filename', 'size', 'etag', 'last_modified', 'length', 'sha256', 'modified')
+_COLUMNS = ('url',) + _FIELDS + ('last_seen', 'changed_at')
+# Columns added after the first release, with their types
+_ADDED_COLUMNS = {'modified': 'REAL'}
+_PARTIAL_COLUMNS = ('url', 'response_url', 'etag', 'last_modified')
+_CONTENT_COLUMNS = ('path', 'sha256', 'size', 'host', 'etag')
+
+# A row only counts as changed when its content hash is known and differs from the stored one
+_UPSERT = f'''
+INSERT INTO files (url, {', '.join(_FIELDS)}, last_seen, changed_at)
+VALUES (?, {', '.join('?' for _ in _FIELDS)}, ?, ?)
+ON CONFLICT (url) DO UPDATE SET
+    response_url = excluded.response_url,
+    filename = excluded.filename,
+    size = excluded.size,
+    etag = excluded.etag,
+    last_modified = excluded.last_modified,
+    length = excluded.length,
+    sha256 = COALESCE(excluded.sha256, files.sha256),
+    modified = excluded.modified,
+    last_seen = excluded.last_seen,
+    changed_at = CASE WHEN excluded.sha256 IS NOT NULL AND excluded.sha256 IS NOT files.sha256
+                      THEN excluded.changed_at ELSE files.changed_at END
+'''
+
+
+class Manifest:
+    # Per-URL state kept between runs, in SQLite. Writes from the workers are batched.
+    def __init__(self, path, batch_size=64):
+        self.path = path
+        self.batch_size = batch_size
+        self.run_started = False
+        self._run_id: int | None = None
+        self._conn: sqlite3.Connection | None = None
+        self._pending: dict[str, tuple] = {}
+        self._touched: dict[str, float] = {}
+        self._partials: dict[str, tuple | None] = {}
+        self._contents: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def __connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_SCHEMA)
+            # Manifests of older versions get the new columns
+            existing = {row['name'] for row in self._conn.execute('PRAGMA table_info(files)')}
+            for name, type_ in _ADDED_COLUMNS.items():
+                if name not in existing:
+                    self._conn.execute(f'ALTER TABLE files ADD COLUMN {name} {type_}')
+        return self._conn
+
+    def __flush(self):
+        if len(self._pending) == 0 and len(self._touched) == 0 and len(self._partials) == 0 \
+                and len(self._contents) == 0:
+            return
+        conn = self.__connect()
+        with conn:
+            conn.executemany(_UPSERT, self._pending.values())
+            conn.executemany('UPDATE files SET last_seen = ? WHERE url = ?',
+                             [(ts, url) for url, ts in self._touched.items()])
+            conn.executemany('DELETE FROM partials WHERE url = ?',
+                             [(url,) for url, row in self._partials.items() if row is None])
+            conn.executemany('INSERT OR REPLACE INTO partials VALUES (?, ?, ?, ?)',
+                             [row for row in self._partials.values() if row is not None])
+            conn.executemany('INSERT OR REPLACE INTO contents VALUES (?, ?, ?, ?, ?)', self._contents.values())
+        self._pending.clear()
+        self._touched.clear()
+        self._partials.clear()
+        self._contents.clear()
+
+    def __maybe_flush(self):
+        if max(len(self._pending), len(self._touched), len(self._partials), len(self._contents)) >= self.batch_size:
+            self.__flush()
+
+    def get(self, url) -> dict | None:
+        with self._lock:
+            if url in self._pending:
+                return dict(zip(_COLUMNS, self._pending[url]))
+            row = self.__connect().execute('SELECT * FROM files WHERE url = ?', (url,)).fetchone()
+            return None if row is None else dict(row)
+
+    def put(self, url, **fields):
+        now = time.time()
+        with self._lock:
+            self._pending[url] = (url, *(fields.get(k) for k in _FIELDS), now, now)
+            self.__maybe_flush()
+
+    def touch(self, url):
+        with self._lock:
+            self._touched[url] = time.time()
+            self.__maybe_flush()
+
+    # ---- Unfinished transfers, with the validators of their first response ---- #
+    def get_partial(self, url) -> dict | None:
+        with self._lock:
+            if url in self._partials:
+                row = self._partials[url]
+            else:
+                row = self.__connect().execute('SELECT * FROM partials WHERE url = ?', (url,)).fetchone()
+            return None if row is None else dict(zip(_PARTIAL_COLUMNS, row))
+
+    def put_partial(self, url, **fields):
+        with self._lock:
+            self._partials[url] = (url, *(fields.get(k) for k in _PARTIAL_COLUMNS[1:]))
+            self.__maybe_flush()
+
+    def drop_partial(self, url):
+        with self._lock:
+            self._partials[url] = None
+            self.__maybe_flush()
+
+    # ---- Stored files by content, so that copies of known content become links ---- #
+    def put_content(self, path, **fields):
+        with self._lock:
+            self._contents[path] = (path, *(fields.get(k) for k in _CONTENT_COLUMNS[1:]))
+            self.__maybe_flush()
+
+    def find_content(self, sha256) -> list[dict]:
+        with self._lock:
+            found = [dict(zip(_CONTENT_COLUMNS, row)) for row in self._contents.values() if row[1] == sha256]
+            rows = self.__connect().execute('SELECT * FROM contents WHERE sha256 = ?', (sha256,)).fetchall()
+            return found + [dict(row) for row in rows if row['path'] not in self._contents]
+
+    def begin_run(self):
+        # Only the first call of a process opens a new run
+        with self._lock:
+            if self.run_started:
+                return
+            conn = self.__connect()
+            with conn:
+                self._run_id = conn.execute('INSERT INTO runs (started) VALUES (?)', (time.time(),)).lastrowid
+            self.run_started = True
+
+    def last_run(self) -> float | None:
+        # Start of the latest run before the one of this process, if it opened one
+        with self._lock:
+            row = self.__connect().execute('SELECT MAX(started) AS started FROM runs WHERE id IS NOT ?',
+                                           (self._run_id,)).fetchone()
+            return row['started']
+
+    def changed_since(self, ts) -> list[dict]:
+        with self._lock:
+            self.__flush()
+            rows = self.__connect().execute('SELECT * FROM files WHERE changed_at >= ? ORDER BY changed_at',
+                                            (ts,)).fetchall()
+            return [dict(row) for row in rows]
+
+    def changed_since_last_run(self) -> list[dict]:
+        started = self.last_run()
+        return self.changed_since(0 if started is None else started)
+
+    def save(self):
+        with self._lock:
+            self.__flush()
+
+    def close(self):
+        with self._lock:
+            self.__flush()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
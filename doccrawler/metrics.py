@@ -0,0 +1,217 @@
+import contextlib
+import contextvars
+import cProfile
+import csv
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from urllib3 import connection as _connection, connectionpool as _connectionpool
+
+# Record of the transfer being timed by the current thread or asyncio task
+_current: contextvars.ContextVar['Transfer | None'] = contextvars.ContextVar('transfer', default=None)
+
+_FIELDS = ('kind', 'url', 'group', 'attempt', 'status', 'error',
+           'connect', 'ttfb', 'seconds', 'bytes', 'throughput', 'write', 'parse', 'unzip')
+# Timings summarised with percentiles, in seconds except the throughput in bytes/s
+_SUMMARY_FIELDS = ('connect', 'ttfb', 'seconds', 'write', 'parse', 'unzip', 'throughput')
+_PERCENTILES = (50, 90, 99)
+
+
+class Transfer:
+    # One timed stage: a file ('file'), an index page ('page') or a discovery job ('discovery').
+    # Times are in seconds, None when the stage did not take place. The unzip time of a file is
+    # filled in once its extraction is over.
+    __slots__ = tuple(field for field in _FIELDS if field != 'throughput') + ('_started',)
+
+    def __init__(self, kind, url, group=None):
+        self.kind = kind
+        self.url = url
+        self.group = group
+        self.attempt = 0
+        self.status = None
+        self.error = None
+        self.connect = None
+        self.ttfb = None
+        self.seconds = None
+        self.bytes = None
+        self.write = None
+        self.parse = None
+        self.unzip = None
+        self._started = time.perf_counter()
+
+    @property
+    def throughput(self):
+        if not self.bytes or not self.seconds:
+            return None
+        return self.bytes / self.seconds
+
+    def add_connect(self, seconds):
+        self.connect = (self.connect or 0.0) + seconds
+
+    def add_ttfb(self, status, seconds):
+        # Redirects and retried ranges add up, the status is the one of the last response
+        self.status = status
+        self.ttfb = (self.ttfb or 0.0) + seconds
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in _FIELDS}
+
+
+def current() -> Transfer | None:
+    return _current.get()
+
+
+def percentile(values: list, p):
+    # Nearest rank on sorted values
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+class Metrics:
+    # Collects the stages of a run when enabled. Disabled, the records are created and dropped.
+    def __init__(self):
+        self.enabled = False
+        self._records: list[Transfer] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def transfer(self, kind, url, group=None):
+        record = Transfer(kind, url, group)
+        token = _current.set(record)
+        try:
+            yield record
+        except Exception as e:
+            record.error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            record.seconds = time.perf_counter() - record._started
+            if self.enabled:
+                with self._lock:
+                    self._records.append(record)
+
+    def summary(self) -> dict:
+        # kind -> count, errors, bytes and the percentiles of each timing
+        with self._lock:
+            records = list(self._records)
+        result = {}
+        for kind in sorted({record.kind for record in records}):
+            of_kind = [record for record in records if record.kind == kind]
+            entry = {'count': len(of_kind),
+                     'errors': sum(record.error is not None for record in of_kind),
+                     'bytes': sum(record.bytes or 0 for record in of_kind)}
+            for field in _SUMMARY_FIELDS:
+                values = sorted(v for v in (getattr(record, field) for record in of_kind) if v is not None)
+                if len(values) == 0:
+                    continue
+                entry[field] = {f'p{p}': percentile(values, p) for p in _PERCENTILES}
+                entry[field]['max'] = values[-1]
+            result[kind] = entry
+        return result
+
+    def export(self, path):
+        # CSV with one row per stage, or JSON with the stages and the summary
+        with self._lock:
+            rows = [record.as_dict() for record in self._records]
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as fd:
+                writer = csv.DictWriter(fd, fieldnames=_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(path, 'w') as fd:
+                json.dump({'summary': self.summary(), 'transfers': rows}, fd, ensure_ascii=False, indent=1)
+
+    @contextlib.contextmanager
+    def capture(self, path=None, profile_path=None, tracemalloc_path=None):
+        # Around a whole run: metrics to path, cProfile stats and a tracemalloc snapshot to their own files
+        self.enabled = path is not None
+        profile = _profile(profile_path) if profile_path is not None else contextlib.nullcontext()
+        if tracemalloc_path is not None:
+            tracemalloc.start(16)
+        try:
+            with profile:
+                yield self
+        finally:
+            if tracemalloc_path is not None:
+                tracemalloc.take_snapshot().dump(tracemalloc_path)
+                tracemalloc.stop()
+            if path is not None:
+                self.export(path)
+            self.enabled = False
+
+
+@contextlib.contextmanager
+def _profile(path):
+    # Before Python 3.12, cProfile only follows the thread that enabled it. Every thread started meanwhile,
+    # e.g. the download workers, then gets a profiler of its own, and the stats of all are merged.
+    profilers = [cProfile.Profile()]
+    per_thread = sys.version_info < (3, 12)
+    lock = threading.Lock()
+
+    def start(*args):
+        profiler = cProfile.Profile()
+        with lock:
+            profilers.append(profiler)
+        # Replaces this hook in the thread
+        profiler.enable()
+
+    if per_thread:
+        threading.setprofile(start)
+    profilers[0].enable()
+    try:
+        yield
+    finally:
+        profilers[0].disable()
+        if per_thread:
+            threading.setprofile(None)
+        with lock:
+            stats = pstats.Stats(*profilers)
+        stats.dump_stats(path)
+
+
+def observe_response(response, *args, **kwargs):
+    # Response hook of requests sessions, elapsed is the time until the headers were parsed
+    if (record := current()) is not None:
+        record.add_ttfb(response.status_code, response.elapsed.total_seconds())
+
+
+def add_arguments(arg_parser):
+    arg_parser.add_argument('--metrics', help='Write per-transfer timings to a .json or .csv file', type=str)
+    arg_parser.add_argument('--profile', help='Write cProfile stats of the run to a file', type=str)
+    arg_parser.add_argument('--tracemalloc', help='Write a tracemalloc snapshot of the run to a file', type=str)
+
+
+# ---- Connection timing of requests sessions ---- #
+class _TimedHTTPConnection(_connection.HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        if (record := current()) is not None:
+            record.add_connect(time.perf_counter() - started)
+
+
+class _TimedHTTPSConnection(_connection.HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        if (record := current()) is not None:
+            record.add_connect(time.perf_counter() - started)
+
+
+class _TimedHTTPConnectionPool(_connectionpool.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(_connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+def time_connections(adapter):
+    # DNS resolution, TCP and TLS handshakes of new connections count as the connect time of the transfer
+    adapter.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                  'https': _TimedHTTPSConnectionPool}
@@ -4,13 +4,8 @@ import time
 
 import bs4
 import requests
-from PIL import Image
 
-from const import TMP_PATH, console
-from doccrawler.const import QR_IMG_PATH, MOODLE_LOGIN, AUTH_API, QR_API, CHECK_API
-
-if not os.path.exists(TMP_PATH):
-    os.makedirs(TMP_PATH)
+from const import TMP_PATH, QR_IMG_PATH, MOODLE_LOGIN, AUTH_API, QR_API, CHECK_API, console
 
 
 def __ts():
@@ -35,8 +30,10 @@ def getCookie() -> str:
 
     qr = QR_API.format(uuid)
     r = session.get(qr)
+    os.makedirs(TMP_PATH, exist_ok=True)
     with open(QR_IMG_PATH, 'wb') as fd:
         fd.write(r.content)
+    from PIL import Image
     img = Image.open(QR_IMG_PATH)
     img.show()
 
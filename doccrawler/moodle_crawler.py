@@ -1,16 +1,22 @@
+import argparse
+import functools
 import os.path
 import re
+import sys
 import urllib.parse
+from collections.abc import Iterator
+from concurrent import futures as _futures
 from http.cookies import SimpleCookie
 
-import bs4
-import requests
 import yaml
 
 import engine
-import moodle_cookie
+import metrics
+import moodle_ws
+import watch as _watch
 from const import console, MAIN_PAGE_URL, SUPPOSE_MAIN_TITLE, \
-    MOODLE_CONFIG_PATH, DOWNLOAD_PATH, SLIDE_SEC_CHN, VIDEO_SEC_CHN, MOODLE_RESOURCE_PAT, MOODLE_FOLDER_PAT
+    MOODLE_CONFIG_PATH, DOWNLOAD_PATH, SLIDE_SEC_CHN, VIDEO_SEC_CHN, MOODLE_RESOURCE_PAT, MOODLE_FOLDER_PAT, \
+    DISCOVERY_WORKERS
 
 
 def load_config() -> (dict, dict):
@@ -33,7 +39,8 @@ def save_config(moodle_config, config_dict):
 
 
 def fetch_course_list(cookies, moodle_config):
-    response = requests.get(MAIN_PAGE_URL, cookies=cookies)
+    import bs4
+    response = engine.get_session(MAIN_PAGE_URL, cookies).get(MAIN_PAGE_URL)
     html = response.content.decode('utf-8')
     soup = bs4.BeautifulSoup(html, 'html.parser')
 
@@ -77,14 +84,205 @@ def fetch_course_list(cookies, moodle_config):
     return results
 
 
+def make_task(out_dir, url, text, i, args, cookies) -> engine.TaskInfo:
+    name = None
+    order = ''
+    if args['name']:
+        name = text.strip()
+    if args['order']:
+        order = f'{i}. '
+    return engine.TaskInfo(out_dir, url, name,
+                           order, cookies, args['update'],
+                           args['unzip'], args['incremental'])
+
+
+class CourseDiscovery:
+    # Course, folder and video pages are fetched by a bounded pool.
+    # Each page job returns its tasks and the follow-up page jobs it found.
+    def __init__(self, cookies, with_videos, workers=DISCOVERY_WORKERS):
+        self.cookies = cookies
+        self.with_videos = with_videos
+        self.workers = workers
+        self.parser = engine.get_arg_parser()
+        self.found: dict[str, int] = {}
+
+    def run(self, courses, course_infos) -> Iterator[engine.TaskInfo]:
+        with _futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for course in courses:
+                course_info = course_infos[course['cid']]
+                if course_info['exclude']:
+                    console.print(f'> Excluded: {course_info["name"]}')
+                    continue
+                args = vars(self.parser.parse_args(course_info['my_args']))
+                self.found[course_info['name']] = 0
+                pending.add(executor.submit(self.__timed, course_info['name'], self.__course,
+                                            course['url'], course_info, args))
+
+            while len(pending) != 0:
+                done, pending = _futures.wait(pending, return_when=_futures.FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        course_info, tasks, follow_ups = future.result()
+                    except Exception as e:
+                        console.print(f'[red]{e}')
+                        engine.headless.error(e)
+                        continue
+                    self.found[course_info['name']] += len(tasks)
+                    yield from tasks
+                    for job in follow_ups:
+                        # Follow-ups belong to the course of the job that found them
+                        pending.add(executor.submit(self.__timed, course_info['name'], *job))
+
+    @staticmethod
+    def __timed(course, job, url, *args):
+        with engine.metrics.transfer('discovery', url, course):
+            return job(url, *args)
+
+    def __course(self, url, course_info, args):
+        home = engine.open_links(url, self.cookies)
+
+        tasks, follow_ups = [], []
+        # ---- Slides ---- #
+        if SLIDE_SEC_CHN in home.sections.keys():
+            # Simple files
+            tags = home.find_all('a', MOODLE_RESOURCE_PAT, section=SLIDE_SEC_CHN)
+            for i, tag in enumerate(tags, start=1):
+                tasks.append(make_task(course_info['dir'], tag.url, tag.text, i, args, self.cookies))
+            # Folders
+            tags = home.find_all('a', MOODLE_FOLDER_PAT, section=SLIDE_SEC_CHN)
+            for tag in tags:
+                # The link text also holds the icon and the layout around the name
+                out_dir = os.path.join(course_info['dir'], tag.text.strip())
+                out_dir = out_dir.rstrip(' 文件夹').rstrip(' Folder')
+                follow_ups.append((self.__folder, tag.url, out_dir, course_info, args))
+        # ---- Videos ---- #
+        if self.with_videos and VIDEO_SEC_CHN in home.sections.keys():
+            tags = home.find_all('a', MOODLE_RESOURCE_PAT, section=VIDEO_SEC_CHN)
+            out_dir = os.path.join(course_info['dir'], 'videos')
+            os.makedirs(out_dir, exist_ok=True)
+            for i, tag in enumerate(tags, start=1):
+                follow_ups.append((self.__video, tag.url, out_dir, i, course_info, args))
+        return course_info, tasks, follow_ups
+
+    def __folder(self, furl, out_dir, course_info, args):
+        os.makedirs(out_dir, exist_ok=True)
+        folder = engine.open_links(furl, self.cookies)
+        sub_tags = folder.find_all('a', '.*mod_folder.*')
+        tasks = [make_task(out_dir, sub_tag.url, sub_tag.text, i, args, self.cookies)
+                 for i, sub_tag in enumerate(sub_tags, start=1)]
+        return course_info, tasks, []
+
+    def __video(self, url, out_dir, i, course_info, args):
+        video = engine.open_links(url, self.cookies)
+        v_tag = video.find_source('video/mp4')
+        return course_info, [make_task(out_dir, v_tag.url, v_tag.text, i, args, self.cookies)], []
+
+
+class WSDiscovery:
+    # The same files as CourseDiscovery, from one core_course_get_contents call per course
+    # instead of the course home, folder and video pages
+    def __init__(self, ws: moodle_ws.MoodleWS, cookies, with_videos, workers=DISCOVERY_WORKERS):
+        self.ws = ws
+        self.cookies = cookies
+        self.with_videos = with_videos
+        self.workers = workers
+        self.parser = engine.get_arg_parser()
+        self.found: dict[str, int] = {}
+
+    def run(self, courses, course_infos) -> Iterator[engine.TaskInfo]:
+        with _futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for course in courses:
+                course_info = course_infos[course['cid']]
+                if course_info['exclude']:
+                    console.print(f'> Excluded: {course_info["name"]}')
+                    continue
+                args = vars(self.parser.parse_args(course_info['my_args']))
+                self.found[course_info['name']] = 0
+                futures[executor.submit(self.__course, course['cid'], course_info, args)] = course_info
+            for future in _futures.as_completed(futures):
+                course_info = futures[future]
+                try:
+                    tasks = future.result()
+                except Exception as e:
+                    console.print(f'[red]{e}')
+                    engine.headless.error(e)
+                    continue
+                self.found[course_info['name']] += len(tasks)
+                yield from tasks
+
+    def __course(self, cid, course_info, args) -> list[engine.TaskInfo]:
+        with engine.metrics.transfer('discovery', f'{self.ws.url}?courseid={cid}', course_info['name']):
+            sections = {section['name'].strip(): section for section in self.ws.course_contents(cid)}
+
+        tasks = []
+        # ---- Slides ---- #
+        if SLIDE_SEC_CHN in sections.keys():
+            modules = sections[SLIDE_SEC_CHN]['modules']
+            # Simple files
+            resources = [module for module in modules if module['modname'] == 'resource']
+            for i, module in enumerate(resources, start=1):
+                for content in moodle_ws.module_files(module)[:1]:
+                    tasks.append(self.__task(course_info['dir'], content, module['name'], i, args, True))
+            # Folders, their subfolders are flattened like on the folder page
+            for module in modules:
+                if module['modname'] != 'folder':
+                    continue
+                out_dir = os.path.join(course_info['dir'], module['name'])
+                out_dir = out_dir.rstrip(' 文件夹').rstrip(' Folder')
+                os.makedirs(out_dir, exist_ok=True)
+                for i, content in enumerate(moodle_ws.module_files(module), start=1):
+                    tasks.append(self.__task(out_dir, content, content['filename'], i, args))
+        # ---- Videos ---- #
+        if self.with_videos and VIDEO_SEC_CHN in sections.keys():
+            out_dir = os.path.join(course_info['dir'], 'videos')
+            os.makedirs(out_dir, exist_ok=True)
+            resources = [module for module in sections[VIDEO_SEC_CHN]['modules'] if module['modname'] == 'resource']
+            for i, module in enumerate(resources, start=1):
+                for content in moodle_ws.module_files(module)[:1]:
+                    tasks.append(self.__task(out_dir, content, module['name'], i, args, True))
+        return tasks
+
+    def __task(self, out_dir, content, text, i, args, inline=False) -> engine.TaskInfo:
+        task = make_task(out_dir, moodle_ws.file_url(content['fileurl'], inline), text, i, args, self.cookies)
+        # Lets --incremental tell changed files apart, and --plan size the files, without a request
+        task.modified = content.get('timemodified')
+        task.size = content.get('filesize')
+        return task
+
+
 def driver():
-    # ---- Load config ---- #
-    config_dict, moodle_config = load_config()
-    parser = engine.get_arg_parser()
-    auth_ok = 'cookies' in moodle_config.keys()
+    arg_parser = argparse.ArgumentParser()
+    engine.add_retry_argument(arg_parser)
+    engine.add_changed_argument(arg_parser)
+    engine.add_headless_argument(arg_parser)
+    engine.add_enqueue_argument(arg_parser)
+    engine.add_watch_argument(arg_parser)
+    metrics.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    if args.headless:
+        engine.headless.start()
+    with engine.metrics.capture(args.metrics, args.profile, args.tracemalloc):
+        crawl(args)
+    if args.headless:
+        sys.exit(engine.headless.finish())
+
+
+def login(args, moodle_config, config_dict, rejected=False) -> (dict | None, list | None):
+    # Cookies and course list, with a QR login when the cookies are missing or were rejected
+    auth_ok = 'cookies' in moodle_config.keys() and not rejected
+    if rejected:
+        engine.close_sessions()
     while True:
+        if not auth_ok and args.headless:
+            # The QR code cannot be scanned unattended
+            engine.headless.abort('The cookies are missing or were rejected, log in once interactively')
+            return None, None
         if not auth_ok:
             # raw_cookies = _prompt.Prompt.ask('Please enter your cookies')
+            # The QR login and its image library are only loaded when the cookies are missing or rejected
+            import moodle_cookie
             raw_cookies = moodle_cookie.getCookie()
             moodle_config['cookies'] = raw_cookies
         else:
@@ -99,100 +297,129 @@ def driver():
         try:
             courses = fetch_course_list(cookies, moodle_config)
         except Exception as e:
-            print(e)
+            console.print(str(e), markup=False)
+            engine.headless.log(f'Course list: {e}')
             courses = None
 
         if courses is None:
             console.print('[red]Invalid cookies. Please retry.')
+            engine.close_sessions()
             auth_ok = False
         else:
             break
 
     save_config(moodle_config, config_dict)
+    return cookies, courses
 
-    queue = []
-    for course in courses:
-        url = course['url']
-        cid = course['cid']
-        course_info = moodle_config['courses'][cid]
-        if course_info['exclude']:
-            console.print(f'> Excluded: {course_info["name"]}')
-            continue
 
-        args = vars(parser.parse_args(course_info['my_args']))
+def watch(args, moodle_config, config_dict, cookies, with_videos):
+    # Polls the dashboard and every course. The QR login is only asked again when the server
+    # redirects a request of the session to the login page.
+    watcher = _watch.Watcher(moodle_config.get('async', False), args.watch)
+    discovery = new_discovery(moodle_config, cookies, with_videos)
 
-        home_soup = engine.open_page(url, cookies)
-        sec_map = {}
+    def on_response(response, *a, **kwargs):
+        if urllib.parse.urlparse(response.url).path.startswith('/login/'):
+            watcher.rejected.set()
 
-        for section in home_soup.find_all(name='li', id=re.compile(r'section-[0-9]')):
-            name = section.h3.text.strip()
-            sec_map[name] = section
+    def watch_session():
+        engine.get_session(MAIN_PAGE_URL, discovery.cookies).hooks['response'].append(on_response)
+        # The web services share the session of the site
+        if isinstance(discovery, WSDiscovery):
+            discovery.ws.session = engine.get_session(discovery.ws.url, discovery.cookies)
 
-        # ---- Slides ---- #
-        if SLIDE_SEC_CHN in sec_map.keys():
-            slide_sec = sec_map[SLIDE_SEC_CHN]
-            # Simple files
-            tags = slide_sec.find_all(name='a', href=re.compile(MOODLE_RESOURCE_PAT))
-            for i, tag in enumerate(tags, start=1):
-                # print(tag.text)
-                url = tag['href']
-                name = None
-                order = ''
-                if args['name']:
-                    name = tag.text.strip()
-                if args['order']:
-                    order = f'{i}. '
-                queue.append(engine.TaskInfo(course_info['dir'], url, name,
-                                             order, cookies, args['update'],
-                                             args['unzip']))
-            # Folders
-            tags = slide_sec.find_all(name='a', href=re.compile(MOODLE_FOLDER_PAT))
-            for tag in tags:
-                furl = tag['href']
-                out_dir = os.path.join(course_info['dir'], tag.text)
-                out_dir = out_dir.rstrip(' 文件夹').rstrip(' Folder')
-                if not os.path.exists(out_dir):
-                    os.makedirs(out_dir)
-                folder = engine.open_page(furl, cookies)
-                sub_tags = folder.find_all(name='a', href=re.compile(f'.*mod_folder.*'))
-                for i, sub_tag in enumerate(sub_tags, start=1):
-                    sub_url = sub_tag['href']
-                    name = None
-                    order = ''
-                    if args['name']:
-                        name = sub_tag.text.strip()
-                    if args['order']:
-                        order = f'{i}. '
-                    queue.append(engine.TaskInfo(out_dir, sub_url, name,
-                                                 order, cookies, args['update'],
-                                                 args['unzip']))
-        # ---- Videos ---- #
-        if VIDEO_SEC_CHN in sec_map.keys():
-            ans = console.input('Found videos. Would you like to download them? (Y/N)')
-            if ans.lower() != 'y':
-                continue
-            video_sec = sec_map[VIDEO_SEC_CHN]
-            tags = video_sec.find_all(name='a', href=re.compile(MOODLE_RESOURCE_PAT))
-            out_dir = os.path.join(course_info['dir'], 'videos')
-            if not os.path.exists(out_dir):
-                os.makedirs(out_dir)
-            for i, tag in enumerate(tags, start=1):
-                video = engine.open_page(tag['href'], cookies)
-                v_tag = video.find(name='source', type='video/mp4')
-                v_url = v_tag['src']
-                name = None
-                order = ''
-                if args['name']:
-                    name = v_tag.text.strip()
-                if args['order']:
-                    order = f'{i}. '
-                queue.append(engine.TaskInfo(out_dir, v_url, name,
-                                             order, cookies, args['update'],
-                                             args['unzip']))
-
-        console.print(f'> Found {len(queue)} files for {course_info["name"]}')
-
-    engine.parallel_process(queue)
+    def poll_course(course) -> list[engine.TaskInfo]:
+        return list(discovery.run([course], moodle_config['courses']))
+
+    def poll_dashboard() -> list[engine.TaskInfo]:
+        courses = fetch_course_list(discovery.cookies, moodle_config)
+        if courses is None:
+            watcher.rejected.set()
+            return []
+        for course in courses:
+            info = moodle_config['courses'][course['cid']]
+            if not info['exclude']:
+                watcher.add(info['name'], functools.partial(poll_course, course))
+        return []
+
+    def authenticate() -> bool:
+        console.print('[red]The session was rejected, logging in again.')
+        engine.headless.log('The session was rejected')
+        cookies, _ = login(args, moodle_config, config_dict, rejected=True)
+        if cookies is None:
+            return False
+        discovery.cookies = cookies
+        watch_session()
+        return True
+
+    watch_session()
+    watcher.authenticate = authenticate
+    watcher.add('Dashboard', poll_dashboard)
+    watcher.run()
+
+
+def ws_token(args, moodle_config, config_dict) -> bool:
+    # The web services need a token of the user, which the QR login does not give
+    if moodle_config.get('token'):
+        return True
+    if args.headless:
+        engine.headless.abort('The web services backend needs a token in the config')
+        return False
+    console.print('Please enter your web services token (Moodle > Preferences > Security keys):')
+    moodle_config['token'] = console.input('> ').strip()
+    save_config(moodle_config, config_dict)
+    return moodle_config['token'] != ''
+
+
+def new_discovery(moodle_config, cookies, with_videos) -> 'CourseDiscovery | WSDiscovery':
+    if moodle_config.get('backend') == 'ws':
+        site = urllib.parse.urljoin(MAIN_PAGE_URL, '/')
+        return WSDiscovery(moodle_ws.MoodleWS(site, moodle_config['token'], cookies), cookies, with_videos)
+    return CourseDiscovery(cookies, with_videos)
+
+
+def crawl(args):
+    if args.changed:
+        # Only the manifest is read, no login needed
+        engine.print_changed()
+        return
+
+    # ---- Load config ---- #
+    config_dict, moodle_config = load_config()
+    cookies, courses = login(args, moodle_config, config_dict)
+    if cookies is None:
+        return
+
+    if args.retry_failed:
+        # The session of the Moodle host already carries the fresh cookies
+        engine.retry_failed(moodle_config.get('async', False))
+        return
+
+    if moodle_config.get('backend') == 'ws' and not ws_token(args, moodle_config, config_dict):
+        return
+
+    with_videos = moodle_config.get('videos')
+    if with_videos is None and args.headless:
+        with_videos = False
+    elif with_videos is None:
+        ans = console.input('Would you like to download the videos of the courses? (Y/N)')
+        with_videos = ans.lower() == 'y'
+
+    if args.watch is not None:
+        watch(args, moodle_config, config_dict, cookies, with_videos)
+        return
+
+    # Downloads start while the remaining pages are still being discovered
+    discovery = new_discovery(moodle_config, cookies, with_videos)
+    if args.enqueue:
+        queued = engine.enqueue(discovery.run(courses, moodle_config['courses']), args.enqueue,
+                                engine.new_planner(moodle_config))
+        console.print(f'> Queued {queued} files in {args.enqueue}', markup=False)
+    else:
+        engine.parallel_process(discovery.run(courses, moodle_config['courses']), moodle_config.get('async', False),
+                                planner=engine.new_planner(moodle_config))
+    for name, count in discovery.found.items():
+        console.print(f'> Found {count} files for {name}')
     # soup = bs4.BeautifulSoup(requests.get(course[0], cookies=cookies).content.decode('utf-8'), 'html.parser')
     # for tag in soup.find_all(name='a', href=re.compile(MOODLE_FOLDER_PAT)):
     #     url = urllib.parse.urljoin(course[0], tag['href'])
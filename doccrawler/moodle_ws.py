@@ -0,0 +1,44 @@
+from urllib import parse as _parse
+
+import engine
+import taskexception
+from const import MOODLE_WS_PATH
+
+
+class MoodleWS:
+    # Moodle Web Services over REST, with the token of a user ("Preferences > Security keys")
+    def __init__(self, site, token, cookies=None):
+        self.url = site.rstrip('/') + MOODLE_WS_PATH
+        self.token = token
+        self.session = engine.get_session(self.url, cookies)
+
+    def call(self, function, **params):
+        query = {'wstoken': self.token, 'wsfunction': function, 'moodlewsrestformat': 'json', **params}
+        with engine.metrics.transfer('page', f'{self.url}?wsfunction={function}') as record:
+            response = self.session.get(self.url, params=query)
+            response.raise_for_status()
+            record.bytes = len(response.content)
+            result = response.json()
+        # Errors come back as 200 responses with an exception object
+        if isinstance(result, dict) and 'exception' in result:
+            raise taskexception.WSException(function, result.get('errorcode'), result.get('message'))
+        return result
+
+    def course_contents(self, cid) -> list[dict]:
+        # Sections of a course, each with its modules and their files, sizes and times of change
+        return self.call('core_course_get_contents', courseid=cid)
+
+
+def file_url(fileurl, inline=False) -> str:
+    # Files listed by the web services are served with the session cookies too, without the token.
+    # Dropping it keeps the URLs the same as those found in the pages, and out of the manifest.
+    # The pages link folder files with forcedownload=1, but resources and videos lead to the bare file.
+    parts = _parse.urlsplit(fileurl)
+    path = parts.path.replace('/webservice/pluginfile.php/', '/pluginfile.php/', 1)
+    dropped = ('token', 'forcedownload') if inline else ('token',)
+    query = [(k, v) for k, v in _parse.parse_qsl(parts.query) if k not in dropped]
+    return _parse.urlunsplit((parts.scheme, parts.netloc, path, _parse.urlencode(query), ''))
+
+
+def module_files(module) -> list[dict]:
+    return [content for content in module.get('contents') or [] if content.get('type') == 'file']
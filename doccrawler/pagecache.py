@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import links
+
+
+class CachedPage:
+    __slots__ = ('url', 'body', 'etag', 'last_modified', 'fetched')
+
+    def __init__(self, url, body, etag, last_modified, fetched):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+
+
+class PageCache:
+    # Index pages kept in memory and on disk, both bounded with LRU eviction.
+    # Pages fetched less than `fresh` seconds ago are served as is, older ones are revalidated.
+    # Pages fetched with cookies are only served to the same account, and never written to disk.
+    def __init__(self, path, max_entries, max_bytes, fresh):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.fresh = fresh
+        # Keyed by account, see __account, and URL
+        self._memory: OrderedDict[tuple[str, str], CachedPage] = OrderedDict()
+        self._links: OrderedDict[str, links.PageLinks] = OrderedDict()
+        self._disk: dict[str, int] | None = None
+        self._lock = threading.Lock()
+
+    # ---- Disk ---- #
+    def __key(self, url):
+        return os.path.join(self.path, hashlib.sha256(url.encode()).hexdigest()[:32])
+
+    def __disk_entries(self) -> dict[str, int]:
+        if self._disk is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._disk = {}
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.html'):
+                    self._disk[entry.path.removesuffix('.html')] = entry.stat().st_size
+        return self._disk
+
+    def __load(self, url) -> CachedPage | None:
+        key = self.__key(url)
+        if key not in self.__disk_entries():
+            return None
+        try:
+            with open(key + '.json', 'r') as fd:
+                meta = json.load(fd)
+            with open(key + '.html', 'rb') as fd:
+                body = fd.read()
+        except (OSError, ValueError):
+            return None
+        os.utime(key + '.html')
+        return CachedPage(url, body, meta['etag'], meta['last_modified'], 0)
+
+    def __store(self, page: CachedPage):
+        key = self.__key(page.url)
+        with open(key + '.html', 'wb') as fd:
+            fd.write(page.body)
+        with open(key + '.json', 'w') as fd:
+            json.dump({'url': page.url, 'etag': page.etag, 'last_modified': page.last_modified}, fd)
+        entries = self.__disk_entries()
+        entries[key] = len(page.body)
+        # Evict the least recently used pages beyond the size bound
+        total = sum(entries.values())
+        if total > self.max_bytes:
+            for old in sorted(entries, key=lambda k: os.path.getmtime(k + '.html')):
+                if total <= self.max_bytes or old == key:
+                    continue
+                total -= entries.pop(old)
+                for suffix in ('.html', '.json'):
+                    if os.path.exists(old + suffix):
+                        os.remove(old + suffix)
+
+    def __remember(self, account, page: CachedPage):
+        key = (account, page.url)
+        self._memory[key] = page
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def __account(session) -> str:
+        # The cookies of the session, hashed, or '' for pages anyone may be served
+        cookies = session.cookies.get_dict()
+        if len(cookies) == 0:
+            return ''
+        return hashlib.sha256(json.dumps(sorted(cookies.items())).encode()).hexdigest()[:32]
+
+    # ---- API ---- #
+    def fetch(self, url, session, strict=False) -> bytes:
+        # strict: error statuses raise requests.HTTPError instead of returning the error page
+        account = self.__account(session)
+        with self._lock:
+            page = self._memory.get((account, url))
+            if page is None and account == '':
+                page = self.__load(url)
+        if page is not None and time.time() - page.fetched < self.fresh:
+            with self._lock:
+                self.__remember(account, page)
+            return page.body
+
+        headers = {}
+        if page is not None:
+            if page.etag is not None:
+                headers['If-None-Match'] = page.etag
+            if page.last_modified is not None:
+                headers['If-Modified-Since'] = page.last_modified
+        response = session.get(url, headers=headers)
+
+        if page is not None and response.status_code == 304:
+            page.fetched = time.time()
+        elif response.ok and len(response.history) == 0:
+            # Redirected pages, e.g. to a login form, are not kept
+            page = CachedPage(url, response.content,
+                              response.headers.get('ETag'), response.headers.get('Last-Modified'), time.time())
+            if account == '':
+                with self._lock:
+                    self.__store(page)
+        else:
+            if strict:
+                response.raise_for_status()
+            return response.content
+        with self._lock:
+            self.__remember(account, page)
+        return page.body
+
+    def links(self, body: bytes) -> links.PageLinks:
+        # Identical pages, e.g. the same index of several presets, are only parsed once
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            page = self._links.get(digest)
+            if page is not None:
+                self._links.move_to_end(digest)
+                return page
+        page = links.extract(body.decode('utf-8'))
+        with self._lock:
+            self._links[digest] = page
+            while len(self._links) > self.max_entries:
+                self._links.popitem(last=False)
+        return page
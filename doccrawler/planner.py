@@ -0,0 +1,104 @@
+import os
+import re
+import shutil
+from collections.abc import Callable
+from concurrent import futures as _futures
+
+from const import DISK_RESERVE, PLAN_WORKERS
+
+
+def transfer_size(headers) -> int | None:
+    # Content-Length is the size of the encoded body, so only trust it for identity bodies
+    length = headers.get('Content-Length')
+    if length is None or 'Content-Encoding' in headers:
+        return None
+    return int(length)
+
+
+def existing_dir(path) -> str:
+    # The download directories may not exist yet, their free space is the one of the nearest parent
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def interleave(tasks: list) -> list:
+    # The largest file first, then the smallest, the second largest, the second smallest...
+    # The large files start early and keep the connections busy, the small ones keep finishing.
+    ordered = sorted(tasks, key=lambda t_info: t_info.size, reverse=True)
+    result = []
+    low, high = 0, len(ordered) - 1
+    while low <= high:
+        result.append(ordered[low])
+        if low != high:
+            result.append(ordered[high])
+        low += 1
+        high -= 1
+    return result
+
+
+class Planner:
+    # Sizes all the files of a run before its first transfer, checks that they fit on the disks and
+    # orders them: by priority first, then large and small files mixed.
+    # size: TaskInfo -> bytes to transfer or None, e.g. from the manifest or a HEAD request
+    # priorities: regexes of the URLs or directories to download first, in order
+    def __init__(self, size: Callable, priorities=(), workers=PLAN_WORKERS, reserve=DISK_RESERVE):
+        self.size = size
+        self.priorities = [re.compile(pattern) for pattern in priorities]
+        self.workers = workers
+        self.reserve = reserve
+
+    def __size(self, t_info):
+        try:
+            return self.size(t_info)
+        except Exception:
+            # The file itself will fail or succeed later, only its place in the order is unknown
+            return t_info.size
+
+    def measure(self, tasks: list):
+        # Every task goes through size, even when a listing gave its size already, since the files that
+        # will be kept transfer nothing. The size of the listing is the fallback of size itself.
+        with _futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for t_info, size in zip(tasks, executor.map(self.__size, tasks)):
+                t_info.size = size
+
+    def priority(self, t_info) -> int:
+        for i, pattern in enumerate(self.priorities):
+            if pattern.search(t_info.url) or pattern.search(t_info.download_path):
+                return i
+        return len(self.priorities)
+
+    def order(self, tasks: list) -> list:
+        # Files of unknown size come last in their priority, in the order they were found
+        classes: dict[int, tuple[list, list]] = {}
+        for t_info in tasks:
+            sized, unsized = classes.setdefault(self.priority(t_info), ([], []))
+            (unsized if t_info.size is None else sized).append(t_info)
+        result = []
+        for level in sorted(classes):
+            sized, unsized = classes[level]
+            result += interleave(sized) + unsized
+        return result
+
+    def shortage(self, tasks: list) -> list[tuple[str, int, int]]:
+        # (directory, bytes needed, bytes free) for every disk that the files would not fit on
+        needed: dict[int, list] = {}
+        for t_info in tasks:
+            directory = existing_dir(t_info.download_path)
+            device = os.stat(directory).st_dev
+            entry = needed.setdefault(device, [directory, 0])
+            entry[1] += t_info.size or 0
+        result = []
+        for directory, size in needed.values():
+            free = shutil.disk_usage(directory).free
+            if size + self.reserve > free:
+                result.append((directory, size, free))
+        return result
+
+    def plan(self, tasks: list) -> list:
+        self.measure(tasks)
+        return self.order(tasks)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+import os.path
+import sys
+import threading
+import time
+from collections.abc import Iterator
+
+from rich import table as _table
+
+import engine
+import metrics
+import workqueue as _workqueue
+from const import MAX_WORKERS, console
+
+# Seconds between two looks at the queue while the other workers still hold tasks
+POLL_INTERVAL = 5.0
+
+
+class Worker:
+    # Downloads the tasks of a shared work queue with one parallel_process, until nothing is left to claim.
+    # At most `held` tasks are claimed at once, so that the other workers get their share of the tail.
+    # The leases of the claimed tasks are renewed in the background, and the results are reported in
+    # batches along with the renewals.
+    def __init__(self, work_queue: _workqueue.WorkQueue, use_async=False, batch=MAX_WORKERS, held=2 * MAX_WORKERS):
+        self.work_queue = work_queue
+        self.use_async = use_async
+        self.batch = batch
+        self.held = held
+        self.name = _workqueue.worker_name()
+        self.stopped = threading.Event()
+        self._ids: dict[engine.TaskInfo, int] = {}
+        self._results: list[tuple[int, str | None]] = []
+        self._lost = 0
+        self._room = threading.Condition()
+
+    def tasks(self) -> Iterator[engine.TaskInfo]:
+        while not self.stopped.is_set():
+            with self._room:
+                while len(self._ids) >= self.held and not self.stopped.is_set():
+                    self._room.wait(POLL_INTERVAL)
+                room = min(self.batch, self.held - len(self._ids))
+            claimed = self.work_queue.claim(self.name, room) if room > 0 else []
+            if len(claimed) == 0:
+                # Tasks leased by the others may still come back when their workers crash
+                self.flush()
+                with self._room:
+                    busy = len(self._ids) != 0
+                if not busy and not self.work_queue.pending():
+                    return
+                with self._room:
+                    self._room.wait(min(POLL_INTERVAL, self.work_queue.lease / 4))
+                continue
+            for id_, entry in claimed:
+                t_info = engine.task_from_entry(entry)
+                with self._room:
+                    self._ids[t_info] = id_
+                yield t_info
+
+    def on_done(self, t_info: engine.TaskInfo, error):
+        with self._room:
+            self._results.append((self._ids.pop(t_info), None if error is None else str(error)))
+            self._room.notify()
+            full = len(self._results) >= self.batch
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._room:
+            results, self._results = self._results, []
+        if len(results) != 0:
+            self._lost += len(results) - self.work_queue.finish(self.name, results)
+
+    def __heartbeat(self):
+        while not self.stopped.wait(self.work_queue.lease / 3):
+            self.flush()
+            with self._room:
+                ids = list(self._ids.values())
+            if self.work_queue.renew(self.name, ids) < len(ids):
+                engine.headless.log(f'{self.name}: some leases expired and were taken over')
+
+    def run(self) -> (int, int):
+        heartbeat = threading.Thread(target=self.__heartbeat, daemon=True)
+        heartbeat.start()
+        try:
+            return engine.parallel_process(self.tasks(), self.use_async, on_done=self.on_done)
+        finally:
+            self.stopped.set()
+            with self._room:
+                self._room.notify_all()
+            heartbeat.join()
+            self.flush()
+            # Claimed but not over, e.g. after Ctrl+C, the others may take them at once
+            self.work_queue.release(self.name, list(self._ids.values()))
+            if self._lost > 0:
+                console.print(f'[yellow]{self._lost} results were dropped, their leases had been taken over')
+            self.work_queue.close()
+
+
+def print_counts(work_queue: _workqueue.WorkQueue):
+    table = _table.Table(title=work_queue.path, expand=True)
+    for state in _workqueue.STATES:
+        table.add_column(state.capitalize(), justify='right')
+    table.add_row(*(str(n) for n in work_queue.counts().values()))
+    console.print(table)
+
+
+def work(args):
+    # One worker process, see driver
+    if args.headless:
+        engine.headless.start()
+    with engine.metrics.capture(args.metrics, args.profile, args.tracemalloc):
+        Worker(_workqueue.WorkQueue(args.queue, args.lease), args.use_async).run()
+
+
+def suffixed(path, i):
+    if path is None:
+        return None
+    root, ext = os.path.splitext(path)
+    return f'{root}.{i}{ext}'
+
+
+def spawn(args) -> list[multiprocessing.Process]:
+    # Worker processes of this machine, quiet since they share the terminal. Their metrics go to a file each.
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for i in range(args.jobs):
+        child_args = argparse.Namespace(**vars(args))
+        child_args.headless = True
+        child_args.metrics = suffixed(args.metrics, i)
+        child_args.profile = suffixed(args.profile, i)
+        child_args.tracemalloc = suffixed(args.tracemalloc, i)
+        process = context.Process(target=work, args=(child_args,), name=f'worker-{i}')
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def driver():
+    arg_parser = argparse.ArgumentParser(description='Download the files of a work queue filled with --enqueue. '
+                                                     'Start it on as many machines as the queue is shared with.')
+    arg_parser.add_argument('queue', help='Path of the work queue', type=str)
+    arg_parser.add_argument('-j', '--jobs', help='Worker processes on this machine', type=int, default=1)
+    arg_parser.add_argument('-A', '--async', help='Use the asyncio engine', action='store_true', dest='use_async')
+    arg_parser.add_argument('--lease', help='Seconds before the tasks of a silent worker are claimed again',
+                            type=float, default=_workqueue.LEASE_SECONDS)
+    engine.add_retry_argument(arg_parser, help_text='Queue the failed tasks again before working')
+    arg_parser.add_argument('--status', help='Only show the number of tasks in each state', action='store_true')
+    engine.add_headless_argument(arg_parser)
+    metrics.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    work_queue = _workqueue.WorkQueue(args.queue, args.lease)
+    if args.status:
+        print_counts(work_queue)
+        return
+    if args.retry_failed:
+        console.print(f'{work_queue.requeue_failed()} failed tasks queued again')
+
+    if args.jobs <= 1:
+        work(args)
+    else:
+        if args.headless:
+            engine.headless.start()
+        processes = spawn(args)
+        try:
+            with console.status(f'{args.jobs} workers...') as status:
+                while any(process.is_alive() for process in processes):
+                    counts = work_queue.counts()
+                    status.update(', '.join(f'{n} {state}' for state, n in counts.items()))
+                    time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        for process in processes:
+            process.join()
+        for process in processes:
+            if process.exitcode != 0:
+                engine.headless.error(f'{process.name} exited with {process.exitcode}')
+
+    counts = work_queue.counts()
+    print_counts(work_queue)
+    for entry, error in work_queue.failures():
+        console.print(f'{entry["url"]}: {error}', style='red', markup=False)
+    work_queue.close()
+    if args.headless:
+        if args.jobs > 1:
+            engine.headless.add_run(counts['done'], counts['failed'], 0)
+        sys.exit(engine.headless.finish())
+
+
+if __name__ == '__main__':
+    driver()
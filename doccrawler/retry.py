@@ -0,0 +1,78 @@
+import contextlib
+import fcntl
+import json
+import os
+import random
+import threading
+
+import taskexception
+from const import RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+
+# Statuses worth asking again: timeouts, throttling and server errors
+_RETRY_STATUSES = (408, 425, 429)
+
+
+def classify(error, network_errors, timeout_errors=(TimeoutError,)) -> str | None:
+    # Kind of a transient error, or None if retrying cannot help
+    if isinstance(error, taskexception.StatusException):
+        if error.status in _RETRY_STATUSES or error.status >= 500:
+            return f'HTTP {error.status}'
+        return None
+    if isinstance(error, taskexception.TruncatedException):
+        return 'truncated body'
+    if isinstance(error, timeout_errors):
+        return 'timeout'
+    if isinstance(error, network_errors):
+        return 'connection'
+    return None
+
+
+def backoff(attempt, retry_after=0.0) -> float:
+    # Full jitter: spreads the retries of the tasks that failed together, never sooner than Retry-After
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after)
+
+
+def retry_delay(attempts, error, network_errors, timeout_errors=(TimeoutError,)) -> float | None:
+    # Seconds before the next attempt, or None once the task has failed for good
+    if attempts >= RETRY_ATTEMPTS or classify(error, network_errors, timeout_errors) is None:
+        return None
+    return backoff(attempts, getattr(error, 'retry_after', 0.0))
+
+
+class FailedTasks:
+    # Tasks that failed for good, one JSON object per line, replayed by --retry-failed.
+    # Each run adds its failures and drops the tasks it completed, by URL and directory. Runs of several
+    # processes, e.g. queue workers, update the file one at a time.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> list[dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as fd:
+            return [json.loads(line) for line in fd if line.strip()]
+
+    @contextlib.contextmanager
+    def __locked(self):
+        with self._lock, open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def update(self, failed: list[dict], succeeded: list[tuple]):
+        with self.__locked():
+            entries = {(entry['url'], entry['download_path']): entry for entry in self.load()}
+            for key in succeeded:
+                entries.pop(key, None)
+            for entry in failed:
+                entries[(entry['url'], entry['download_path'])] = entry
+            if len(entries) == 0:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as fd:
+                for entry in entries.values():
+                    fd.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(tmp, self.path)
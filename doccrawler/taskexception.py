@@ -1,3 +1,26 @@
 class TaskException(Exception):
     def __init__(self):
         super().__init__()
+
+
+class DownloadException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class StatusException(DownloadException):
+    def __init__(self, status, url, retry_after=0.0):
+        super().__init__(f'HTTP {status}: {url}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TruncatedException(DownloadException):
+    def __init__(self, url, received, expected):
+        super().__init__(f'Body cut after {received} of {expected} bytes: {url}')
+
+
+class WSException(Exception):
+    def __init__(self, function, errorcode, message):
+        super().__init__(f'{function}: {message} ({errorcode})')
+        self.errorcode = errorcode
@@ -0,0 +1,153 @@
+import hashlib
+import signal
+import threading
+import time
+from collections.abc import Callable
+from concurrent import futures as _futures
+
+import engine
+from const import DISCOVERY_WORKERS, WATCH_INTERVAL, WATCH_MAX_INTERVAL, console
+
+
+class Source:
+    # Something polled for files: a preset, a Moodle course or the Moodle dashboard.
+    # poll returns the tasks found, its signature tells whether the files found changed since the last poll.
+    __slots__ = ('name', 'poll', 'interval', 'due', 'signature')
+
+    def __init__(self, name, poll: Callable[[], list], interval):
+        self.name = name
+        self.poll = poll
+        self.interval = interval
+        self.due = 0.0
+        self.signature: str | None = None
+
+
+def signature(tasks) -> str:
+    # The time of change and size given by a listing, e.g. the Moodle web services, tell files replaced in place
+    digest = hashlib.sha256()
+    for key in sorted((t_info.url, t_info.download_path, t_info.filename or '', str(t_info.modified or ''),
+                       str(t_info.size or '')) for t_info in tasks):
+        digest.update('\0'.join(key).encode() + b'\n')
+    return digest.hexdigest()
+
+
+class Watcher:
+    # Polls its sources in a long-running process, so that the sessions, the page cache and the parsed
+    # pages stay warm. Pages are revalidated with conditional requests. The files of a source whose files
+    # changed go to the downloads as they are, where the manifest skips the files already there. Those of
+    # the other sources are revalidated like with --incremental, since a file may be replaced at the same URL.
+    # The interval of a source doubles after each poll without changes, up to max_interval, and is reset
+    # by a change.
+    def __init__(self, use_async=False, interval=WATCH_INTERVAL, max_interval=WATCH_MAX_INTERVAL,
+                 workers=DISCOVERY_WORKERS):
+        self.use_async = use_async
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.workers = workers
+        self.sources: dict[str, Source] = {}
+        # Set when the server rejected the session during a poll, see authenticate
+        self.rejected = threading.Event()
+        self.authenticate: Callable[[], bool] | None = None
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, name, poll):
+        # Sources may be added by the polls of other sources, e.g. new courses on the dashboard
+        with self._lock:
+            if name not in self.sources:
+                self.sources[name] = Source(name, poll, self.interval)
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    @staticmethod
+    def __poll_one(source: Source) -> list:
+        # Recursive crawls return a generator, it is drained in the pool as well
+        return list(source.poll() or [])
+
+    def __poll(self, due: list[Source]) -> list[tuple[Source, list]]:
+        polled = []
+        with _futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.__poll_one, source): source for source in due}
+            for future in _futures.as_completed(futures):
+                source = futures[future]
+                try:
+                    polled.append((source, future.result()))
+                except Exception as e:
+                    console.print(f'[red]{source.name}: {e or "Failed"}')
+                    engine.headless.error(f'{source.name}: {e}')
+                    self.__reschedule(source, False)
+        return polled
+
+    def __reschedule(self, source: Source, changed):
+        if changed:
+            source.interval = self.interval
+        else:
+            source.interval = min(source.interval * 2, self.max_interval)
+        source.due = time.monotonic() + source.interval
+
+    def cycle(self):
+        # One round over the sources that are due
+        now = time.monotonic()
+        with self._lock:
+            due = [source for source in self.sources.values() if source.due <= now]
+        polled = self.__poll(due)
+
+        if self.rejected.is_set():
+            # Whatever was found with a rejected session is dropped, and polled again once logged in
+            self.rejected.clear()
+            if self.authenticate is None or not self.authenticate():
+                self.stop()
+            return
+
+        if len(polled) == 0:
+            return
+        changed = []
+        for source, tasks in polled:
+            digest = signature(tasks)
+            if digest != source.signature:
+                changed.append(source)
+            else:
+                # Files replaced at the same URL only show up with a conditional request
+                for t_info in tasks:
+                    t_info.incremental = True
+            source.signature = digest
+
+        seen = set()
+
+        def queue():
+            for source, tasks in polled:
+                for t_info in tasks:
+                    if (t_info.url, t_info.download_path) in seen:
+                        continue
+                    seen.add((t_info.url, t_info.download_path))
+                    t_info.group = source.name
+                    yield t_info
+
+        groups = {source.name: [0, 0] for source, _ in polled}
+        success, failed = engine.parallel_process(queue(), self.use_async, groups=groups)
+        engine.headless.log(f'Changes in {len(changed)} of {len(polled)} sources: {success} files, {failed} failed')
+        for source, _ in polled:
+            if groups[source.name][1] != 0:
+                # Sources with failed files are polled again as changed, so that the failures are retried
+                source.signature = None
+            self.__reschedule(source, source in changed)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        # Every poll revalidates its pages, unchanged ones still come from the cache, already parsed
+        engine.page_cache.fresh = 0
+        console.print(f'Watching {len(self.sources)} sources, polled every {self.interval}s at first. '
+                      f'Press Ctrl+C to stop.')
+        try:
+            while not self.stopped.is_set():
+                self.cycle()
+                with self._lock:
+                    due = min((source.due for source in self.sources.values()), default=None)
+                if due is None:
+                    break
+                self.stopped.wait(max(0.0, due - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            engine.manifest.save()
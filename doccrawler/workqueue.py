@@ -0,0 +1,159 @@
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from const import LEASE_SECONDS, LEASE_MAX
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    key         TEXT UNIQUE,
+    entry       TEXT,
+    state       TEXT,
+    worker      TEXT,
+    lease_until REAL,
+    leases      INTEGER DEFAULT 0,
+    error       TEXT,
+    updated     REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+'''
+
+# Queued again by a new discovery once over, the others are left to their workers
+_PUT = '''
+INSERT INTO tasks (key, entry, state, leases, updated) VALUES (?, ?, 'queued', 0, ?)
+ON CONFLICT (key) DO UPDATE SET
+    entry = excluded.entry, state = 'queued', worker = NULL, lease_until = NULL, leases = 0, error = NULL,
+    updated = excluded.updated
+WHERE tasks.state IN ('done', 'failed')
+'''
+
+STATES = ('queued', 'leased', 'done', 'failed')
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue:
+    # Tasks shared by the worker processes of one or more machines, in SQLite. A worker leases the tasks
+    # it claims for `lease` seconds and renews the lease while it works on them. The tasks of a worker
+    # that stopped renewing, e.g. after a crash, are claimed again by the others once the lease expired,
+    # up to `max_leases` times. Entries are the dicts of engine.task_entry.
+    # The rollback journal instead of WAL keeps the queue usable on network filesystems with locks.
+    def __init__(self, path, lease=LEASE_SECONDS, max_leases=LEASE_MAX):
+        self.path = path
+        self.lease = lease
+        self.max_leases = max_leases
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def __connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        # The write lock is taken before the reads, so that two workers never claim the same rows
+        conn = self.__connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def put(self, entries) -> int:
+        # Returns the number of tasks queued, the ones already queued or leased are left as they are
+        now = time.time()
+        rows = [(f'{entry["url"]}\0{entry["download_path"]}', json.dumps(entry, ensure_ascii=False), now)
+                for entry in entries]
+        with self._lock, self.__transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(_PUT, rows)
+            return conn.total_changes - before
+
+    def claim(self, worker, n) -> list[tuple[int, dict]]:
+        # Up to n queued tasks, or tasks whose lease expired, in the order they were queued
+        now = time.time()
+        with self._lock, self.__transaction() as conn:
+            # Tasks that crashed their workers too many times are given up
+            conn.execute("UPDATE tasks SET state = 'failed', error = 'Lease expired ' || leases || ' times', "
+                         "updated = ? WHERE state = 'leased' AND lease_until < ? AND leases >= ?",
+                         (now, now, self.max_leases))
+            rows = conn.execute("SELECT id, entry FROM tasks WHERE state = 'queued' "
+                                "OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT ?",
+                                (now, n)).fetchall()
+            conn.executemany("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, "
+                             "leases = leases + 1, updated = ? WHERE id = ?",
+                             [(worker, now + self.lease, now, row['id']) for row in rows])
+        return [(row['id'], json.loads(row['entry'])) for row in rows]
+
+    def renew(self, worker, ids) -> int:
+        # Extends the leases still held by the worker, returns how many it still holds
+        if len(ids) == 0:
+            return 0
+        now = time.time()
+        with self._lock, self.__transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("UPDATE tasks SET lease_until = ?, updated = ? "
+                             "WHERE id = ? AND worker = ? AND state = 'leased'",
+                             [(now + self.lease, now, id_, worker) for id_ in ids])
+            return conn.total_changes - before
+
+    def finish(self, worker, results: list[tuple[int, str | None]]) -> int:
+        # Results as (id, error or None), in one transaction. Returns how many were recorded, the others
+        # were lost to another worker after their lease expired, which then reports them itself.
+        now = time.time()
+        with self._lock, self.__transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("UPDATE tasks SET state = ?, error = ?, lease_until = NULL, updated = ? "
+                             "WHERE id = ? AND worker = ? AND state = 'leased'",
+                             [('done' if error is None else 'failed', error, now, id_, worker)
+                              for id_, error in results])
+            return conn.total_changes - before
+
+    def release(self, worker, ids):
+        # Tasks claimed but not started, e.g. when a worker is stopped, go back to the queue at once
+        with self._lock, self.__transaction() as conn:
+            conn.executemany("UPDATE tasks SET state = 'queued', worker = NULL, lease_until = NULL, "
+                             "leases = leases - 1 WHERE id = ? AND worker = ? AND state = 'leased'",
+                             [(id_, worker) for id_ in ids])
+
+    def requeue_failed(self) -> int:
+        with self._lock:
+            cursor = self.__connect().execute("UPDATE tasks SET state = 'queued', worker = NULL, leases = 0, "
+                                              "error = NULL, updated = ? WHERE state = 'failed'", (time.time(),))
+            return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self.__connect().execute('SELECT state, COUNT(*) AS n FROM tasks GROUP BY state').fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update({row['state']: row['n'] for row in rows})
+        return counts
+
+    def pending(self) -> bool:
+        # Whether any task may still be claimed, now or once a lease expires
+        counts = self.counts()
+        return counts['queued'] + counts['leased'] != 0
+
+    def failures(self) -> list[tuple[dict, str]]:
+        with self._lock:
+            rows = self.__connect().execute("SELECT entry, error FROM tasks WHERE state = 'failed' "
+                                            "ORDER BY id").fetchall()
+        return [(json.loads(row['entry']), row['error']) for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,104 @@
+import os
+import time
+
+from const import FSYNC_INTERVAL, FSYNC_POLICY
+
+MIN_BUFFER = 64 * 1024
+MAX_BUFFER = 8 * 1024 * 1024
+# A buffer holds about this many seconds of the observed throughput
+BUFFER_SECONDS = 0.05
+
+
+def preallocate(fd: int, offset, length):
+    try:
+        os.posix_fallocate(fd, offset, length)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, offset + length)
+
+
+class StreamWriter:
+    # Streams a body into an open file through one reusable buffer.
+    # fsync_policy: 'never', 'close' or 'interval' (every FSYNC_INTERVAL bytes and on close)
+    # on_write: called with the number of bytes of every write, e.g. to show the progress
+    def __init__(self, fd, digest, length=None, fsync_policy=FSYNC_POLICY, on_write=None):
+        self.fd = fd
+        self.digest = digest
+        self.fsync_policy = fsync_policy
+        self.on_write = on_write
+        self.written = 0
+        # Seconds spent writing and syncing, without the reads
+        self.write_time = 0.0
+        self._unsynced = 0
+        self._buffer = bytearray(MIN_BUFFER)
+        self._preallocated = length is not None and length > 0
+        if self._preallocated:
+            preallocate(fd.fileno(), fd.tell(), length)
+
+    def __resize(self, n, elapsed):
+        # Power of two closest to BUFFER_SECONDS of the throughput of the last read
+        if elapsed <= 0:
+            target = MAX_BUFFER if n == len(self._buffer) else len(self._buffer)
+        else:
+            target = n / elapsed * BUFFER_SECONDS
+        size = MIN_BUFFER
+        while size < target and size < MAX_BUFFER:
+            size *= 2
+        if size != len(self._buffer):
+            self._buffer = bytearray(size)
+
+    def __sync(self, n):
+        self._unsynced += n
+        if self.fsync_policy == 'interval' and self._unsynced >= FSYNC_INTERVAL:
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+            self._unsynced = 0
+
+    def write(self, data):
+        started = time.perf_counter()
+        self.fd.write(data)
+        self.digest.update(data)
+        self.written += len(data)
+        self.__sync(len(data))
+        self.write_time += time.perf_counter() - started
+        if self.on_write is not None:
+            self.on_write(len(data))
+
+    def copy(self, raw) -> int:
+        # raw is a file-like object with readinto(), e.g. the urllib3 response of requests
+        last = time.perf_counter()
+        while True:
+            view = memoryview(self._buffer)
+            n = raw.readinto(view)
+            if not n:
+                break
+            self.write(view[:n])
+            now = time.perf_counter()
+            self.__resize(n, now - last)
+            last = now
+        return self.written
+
+    async def copy_async(self, content) -> int:
+        # content has an async read(n), e.g. the aiohttp StreamReader. Chunks come from its own buffer, so
+        # only the size of the reads follows the throughput.
+        last = time.perf_counter()
+        while chunk := await content.read(len(self._buffer)):
+            self.write(chunk)
+            now = time.perf_counter()
+            self.__resize(len(chunk), now - last)
+            last = now
+        return self.written
+
+    def close(self):
+        if self._preallocated:
+            # The body may be shorter than announced, e.g. when the connection dropped
+            self.fd.truncate(self.fd.tell())
+        if self.fsync_policy != 'never':
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()